@@ -0,0 +1,351 @@
+import atexit
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from pathlib import Path
+from langchain_core.documents import Document
+from rag_agents.retrieval_agent import get_embeddings, vector_store
+from rag_agents.index_store import (DB_PATH, WAL_NAME, SHARD_BY, read_manifest, current_index_dir,
+                                    publish_version, shard_key, shard_path, list_shards, acquire_writer_lock)
+from rag_agents.ann_index import choose_index_type, index_type_of, rebuild_store, tune_search
+from utils.logger import get_logger
+
+logger = get_logger("INDEXING_SERVICE")
+
+FLUSH_EVERY_DOCS = int(os.getenv("INDEX_FLUSH_EVERY", "32"))
+FLUSH_INTERVAL_SEC = float(os.getenv("INDEX_FLUSH_INTERVAL", "5"))
+# Switch index type automatically (flat -> HNSW -> IVF-PQ) when the corpus outgrows it
+AUTO_REBUILD = os.getenv("INDEX_AUTO_REBUILD", "1").lower() in ("1", "true", "yes")
+# Backoff for batches whose embedding failed (API outage, quota): 2s, 4s, ... up to this
+RETRY_MAX_SEC = float(os.getenv("INDEX_RETRY_MAX_SEC", "300"))
+
+class IndexingService:
+    """
+    Long-lived, single-writer FAISS indexer.
+    - The index is loaded once and kept in memory; new documents are appended.
+    - Every document is first appended (fsync) to a write-ahead log, so an
+      accepted document survives a crash before the next flush.
+    - One writer thread drains the queue, embeds in batches, and publishes a new
+      on-disk version every FLUSH_EVERY_DOCS documents or FLUSH_INTERVAL_SEC seconds.
+    - A batch that fails to embed is retried with backoff; its sequence numbers are
+      recorded as missing in the manifest, so the WAL keeps them until they are in.
+    - One process per index directory: the constructor takes the directory's writer
+      lock and raises WriterLockHeld if another process has it.
+    """
+    def __init__(self, db_path: str = DB_PATH, flush_every: int = FLUSH_EVERY_DOCS,
+                 flush_interval: float = FLUSH_INTERVAL_SEC):
+        self.db_path = Path(db_path)
+        self.db_path.mkdir(parents=True, exist_ok=True)
+        self.wal_path = self.db_path / WAL_NAME
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._writer_lock = acquire_writer_lock(str(self.db_path))  # Held for the life of the process
+
+        self._queue = queue.Queue()
+        self._wal_lock = threading.Lock()
+        self._flushed = threading.Condition()
+        self._db = None
+        self._pending = 0          # Docs added in memory but not yet published
+        self._last_seq = 0         # Highest WAL sequence number added in memory
+        self._published_seq = 0    # Highest WAL sequence number in a published version
+        self._next_seq = 0         # Last sequence number handed out by submit()
+        self._retry = []           # Records of failed batches, not in memory or on disk yet
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+
+        self._load()
+        self._writer = threading.Thread(target=self._run, name="faiss-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # --- Public API ---
+
+    def submit(self, docs: list) -> int:
+        """Durably accepts documents (WAL) and queues them for the writer. Returns the last sequence number."""
+        with self._wal_lock:
+            records = []
+            for doc in docs:
+                self._next_seq += 1
+                records.append({"seq": self._next_seq, "text": doc.page_content, "metadata": doc.metadata})
+            with open(self.wal_path, "a", encoding="utf-8") as f:
+                for rec in records:
+                    f.write(json.dumps(rec) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        for rec in records:
+            self._queue.put(rec)
+        return records[-1]["seq"] if records else self._last_seq
+
+    def flush(self, timeout: float = 60) -> bool:
+        """Blocks until everything submitted so far is published on disk."""
+        target = self._next_seq
+        self._queue.put("FLUSH")
+        with self._flushed:
+            return self._flushed.wait_for(
+                lambda: self._published_seq >= target and not any(r["seq"] <= target for r in self._retry),
+                timeout=timeout)
+
+    def rebuild(self, kind: str = None, timeout: float = 600) -> str:
+        """
+        Re-creates the index as `kind` (flat/hnsw/ivfpq; default: chosen by corpus size),
+        training it if needed, and publishes it. Runs on the writer thread, so it is
+        serialized with normal appends.
+        """
+        done = threading.Event()
+        result = {}
+        self._queue.put(("REBUILD", kind, done, result))
+        if not done.wait(timeout):
+            raise TimeoutError("Index rebuild did not finish in time")
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return result["index_type"]
+
+    def close(self):
+        if self._writer.is_alive():
+            self.flush(timeout=30)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "pending_docs": self._pending,
+            "last_seq": self._last_seq,
+            "published_seq": self._published_seq,
+            "retrying_docs": len(self._retry),
+            "version": read_manifest(str(self.db_path))["version"],
+            "vectors": self._db.index.ntotal if self._db is not None else 0,
+            "index_type": index_type_of(self._db.index) if self._db is not None else None,
+        }
+
+    # --- Writer thread ---
+
+    def _load(self):
+        manifest = read_manifest(str(self.db_path))
+        self._published_seq = self._last_seq = manifest.get("last_seq", 0)
+        index_dir = current_index_dir(str(self.db_path))
+        if index_dir:
+            from langchain_community.vectorstores import FAISS  # Deferred: slow import, writer thread only
+            self._db = FAISS.load_local(str(index_dir), get_embeddings(), allow_dangerous_deserialization=True)
+            tune_search(self._db.index)
+            logger.info(f"Loaded index version {manifest['version']} ({self._db.index.ntotal} vectors)")
+
+        # Crash recovery: re-add WAL entries that never made it into a published version
+        missing = set(manifest.get("missing_seqs", []))
+        replay = []
+        if self.wal_path.exists():
+            with open(self.wal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Torn line from a crash mid-write
+                    if rec["seq"] > self._published_seq or rec["seq"] in missing:
+                        replay.append(rec)
+            self._truncate_wal(self._published_seq, missing)  # Rewrite without torn/already-published lines
+        self._next_seq = max([self._published_seq] + [r["seq"] for r in replay])
+        if replay:
+            logger.warning(f"Replaying {len(replay)} un-flushed documents from WAL")
+            try:
+                self._add(replay)
+                self._publish()
+            except Exception as e:
+                self._schedule_retry(replay, e)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.1, self.flush_interval - (time.monotonic() - last_flush))
+            if self._retry:
+                timeout = min(timeout, max(0.1, self._retry_at - time.monotonic()))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, tuple):
+                self._handle_rebuild(*item[1:])
+                last_flush = time.monotonic()
+                continue
+
+            force = item == "FLUSH"
+            batch = [item] if isinstance(item, dict) else []
+            # Drain waiting documents so they are embedded in one call (commands wait their turn)
+            while len(batch) < self.flush_every:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt == "FLUSH":
+                    force = True
+                elif isinstance(nxt, tuple):
+                    self._queue.put(nxt)
+                    break
+                else:
+                    batch.append(nxt)
+
+            if self._retry and time.monotonic() >= self._retry_at:
+                batch = self._retry + batch  # Failed records go first, in sequence order
+                self._retry = []
+
+            if batch:
+                try:
+                    self._add(batch)
+                    self._retry_delay = 0.0
+                except Exception as e:
+                    self._schedule_retry(batch, e)
+
+            try:
+                due = time.monotonic() - last_flush >= self.flush_interval
+                if self._pending and (force or due or self._pending >= self.flush_every):
+                    self._publish()
+                    last_flush = time.monotonic()
+                elif force:
+                    self._notify()
+            except Exception as e:
+                # The documents are in memory and in the WAL: the next publish (or a restart) covers them
+                logger.error(f"Publishing index version failed: {e}")
+
+    def _schedule_retry(self, records: list, error: Exception):
+        """Keeps a failed batch for another attempt; until then its seqs are 'missing' in every publish."""
+        self._retry_delay = min(RETRY_MAX_SEC, max(2.0, self._retry_delay * 2))
+        self._retry_at = time.monotonic() + self._retry_delay
+        known = {r["seq"] for r in self._retry}
+        self._retry = sorted(self._retry + [r for r in records if r["seq"] not in known], key=lambda r: r["seq"])
+        logger.error(f"Indexing batch of {len(records)} failed ({error}); "
+                     f"retrying {len(self._retry)} docs in {self._retry_delay:.0f}s")
+
+    def _add(self, records: list):
+        docs = [Document(page_content=r["text"], metadata=r["metadata"]) for r in records]
+        if self._db is None:
+            from langchain_community.vectorstores import FAISS
+            self._db = FAISS.from_documents(docs, get_embeddings())
+        else:
+            self._db.add_documents(docs)
+        self._pending += len(docs)
+        self._last_seq = max(self._last_seq, max(r["seq"] for r in records))
+
+    def _handle_rebuild(self, kind, done, result):
+        try:
+            if self._db is None:
+                result["error"] = "Index is empty"
+                return
+            self._rebuild(kind)
+            self._publish(force=True)
+            result["index_type"] = index_type_of(self._db.index)
+        except Exception as e:
+            logger.error(f"Index rebuild failed: {e}")
+            result["error"] = str(e)
+        finally:
+            done.set()
+
+    def _rebuild(self, kind: str = None):
+        kind = kind or choose_index_type(self._db.index.ntotal)
+        start = time.perf_counter()
+        try:
+            self._db = rebuild_store(self._db, get_embeddings(), kind)
+        except ValueError as e:
+            # e.g. not enough vectors to train IVF-PQ yet: HNSW needs no training
+            logger.warning(f"{kind} rebuild not possible ({e}), using hnsw")
+            self._db = rebuild_store(self._db, get_embeddings(), "hnsw")
+        logger.info(f"Rebuilt index as {index_type_of(self._db.index)} "
+                    f"({self._db.index.ntotal} vectors) in {time.perf_counter() - start:.1f}s")
+
+    def _publish(self, force: bool = False):
+        if AUTO_REBUILD and not force:
+            wanted = choose_index_type(self._db.index.ntotal)
+            if wanted != index_type_of(self._db.index) and wanted != "flat":
+                self._rebuild(wanted)
+        staged = Path(tempfile.mkdtemp(prefix=".staging-", dir=str(self.db_path)))
+        self._db.save_local(str(staged))
+        missing = [r["seq"] for r in self._retry if r["seq"] <= self._last_seq]
+        manifest = publish_version(str(self.db_path), staged, self._last_seq, missing)
+        self._truncate_wal(manifest["last_seq"], set(missing))
+        logger.info(f"Published index version {manifest['version']} "
+                    f"({self._pending} new docs, {self._db.index.ntotal} total, {index_type_of(self._db.index)})")
+        self._pending = 0
+        self._published_seq = manifest["last_seq"]
+        vector_store.invalidate()  # Same-process retriever picks the new version up immediately
+        self._notify()
+
+    def _truncate_wal(self, upto_seq: int, missing: set = frozenset()):
+        # Keep records submitted while we were flushing and failed ones still being retried;
+        # drop everything already published
+        with self._wal_lock:
+            keep = []
+            if self.wal_path.exists():
+                with open(self.wal_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            seq = json.loads(line)["seq"]
+                            if seq > upto_seq or seq in missing:
+                                keep.append(line)
+                        except json.JSONDecodeError:
+                            continue
+            tmp = self.wal_path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(keep)
+            os.replace(tmp, self.wal_path)
+
+    def _notify(self):
+        with self._flushed:
+            self._flushed.notify_all()
+
+class ShardedIndexingService:
+    """
+    Routes documents to one IndexingService per shard (month or tenant, see VECTOR_SHARD_BY).
+    Each shard has its own WAL, versions and writer thread; same API as IndexingService.
+    """
+    def __init__(self, db_path: str = DB_PATH, mode: str = SHARD_BY):
+        self.db_path = db_path
+        self.mode = mode
+        self._shards = {}
+        self._lock = threading.Lock()
+        for key in list_shards(db_path):
+            self._shard(key)  # Replay any pending WAL entries of existing shards at startup
+
+    def _shard(self, key: str) -> IndexingService:
+        with self._lock:
+            if key not in self._shards:
+                self._shards[key] = IndexingService(db_path=shard_path(self.db_path, key))
+            return self._shards[key]
+
+    def submit(self, docs: list) -> int:
+        groups = {}
+        for doc in docs:
+            groups.setdefault(shard_key(doc.metadata, self.mode), []).append(doc)
+        seq = 0
+        for key, group in groups.items():
+            seq = self._shard(key).submit(group)
+        return seq
+
+    def flush(self, timeout: float = 60) -> bool:
+        return all(s.flush(timeout) for s in list(self._shards.values()))
+
+    def rebuild(self, kind: str = None, timeout: float = 600) -> dict:
+        return {key: s.rebuild(kind, timeout) for key, s in list(self._shards.items())}
+
+    def stats(self) -> dict:
+        return {"shard_by": self.mode, "shards": {k: s.stats() for k, s in list(self._shards.items())}}
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_indexing_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ShardedIndexingService() if SHARD_BY else IndexingService()
+        return _service
+
+if __name__ == "__main__":
+    # Training / rebuild job:  python -m agents.indexing_service rebuild [flat|hnsw|ivfpq]
+    # Fails with WriterLockHeld while an API process owns the index directory.
+    import sys
+    if len(sys.argv) >= 2 and sys.argv[1] == "rebuild":
+        service = get_indexing_service()
+        print(service.rebuild(sys.argv[2] if len(sys.argv) > 2 else None))
+        print(service.stats())
+    else:
+        print("usage: python -m agents.indexing_service rebuild [flat|hnsw|ivfpq]")
@@ -1,20 +1,64 @@
 # A simple script to index text
-from langchain_community.vectorstores import FAISS
+import json
+import os
+import time
+import requests
 from langchain_core.documents import Document
-# Re-use the embeddings logic
-from rag_agents.retrieval_agent import embeddings, DB_PATH
+from agents.indexing_service import get_indexing_service
+from utils.logger import get_logger
+
+logger = get_logger("INDEXING")
+
+# The API process owns the index directory (single writer, see IndexingService);
+# other processes such as the ingestion daemon hand their chunks to it over HTTP
+INDEX_WRITER_URL = os.getenv("INDEX_WRITER_URL", "http://127.0.0.1:8000")
 
 def index_invoice_text(text: str, metadata: dict):
-    print(" [Indexing] Saving invoice text to Vector DB...")
+    """
+    Hands the invoice text to the long-lived indexing service.
+    Returns once the document is in the write-ahead log; embedding and the
+    on-disk FAISS flush happen in batches on the service's writer thread.
+    """
+    logger.info("Queuing invoice text for Vector DB...")
     
     doc = Document(page_content=text, metadata=metadata)
-    
-    # Check if DB exists to append or create new
-    try:
-        db = FAISS.load_local(DB_PATH, embeddings, allow_dangerous_deserialization=True)
-        db.add_documents([doc])
-    except:
-        db = FAISS.from_documents([doc], embeddings)
+    seq = get_indexing_service().submit([doc])
         
-    db.save_local(DB_PATH)
-    print(" [Indexing] Success.")
\ No newline at end of file
+    logger.info("Accepted (seq %s).", seq)
+
+
+def index_invoice_documents(docs: list):
+    """Queues pre-chunked invoice documents (see agents.invoice_chunker) in one WAL write."""
+    if not docs:
+        return
+    seq = get_indexing_service().submit(docs)
+    logger.info("Accepted %d chunks (seq %s).", len(docs), seq)
+
+
+def as_payload(doc) -> dict:
+    """Wire / spool form of a chunk: {"page_content", "metadata"} (Documents or such dicts)."""
+    if isinstance(doc, dict):
+        return doc
+    return {"page_content": doc.page_content, "metadata": doc.metadata}
+
+
+def forward_invoice_documents(docs: list, url: str = INDEX_WRITER_URL, retries: int = 3):
+    """
+    Sends chunks to the writer process's /api/index/documents instead of opening a
+    second IndexingService on the same WAL and versions. Raises if the writer stays unreachable.
+    """
+    if not docs:
+        return
+    body = json.dumps({"documents": [as_payload(d) for d in docs]}, default=str)
+    for attempt in range(1, retries + 1):
+        try:
+            response = requests.post(f"{url}/api/index/documents", data=body, timeout=30,
+                                     headers={"Content-Type": "application/json"})
+            response.raise_for_status()
+            logger.info("Forwarded %d chunks to the index writer.", len(docs))
+            return
+        except requests.RequestException as e:
+            if attempt == retries:
+                raise RuntimeError(f"Index writer at {url} did not accept {len(docs)} chunks: {e}") from e
+            logger.warning("Index writer not reachable (%s), retrying...", e)
+            time.sleep(2 ** attempt)
@@ -0,0 +1,75 @@
+from datetime import datetime
+from typing import List
+from langchain_core.documents import Document
+from utils.dates import normalize_date
+
+RAW_CHUNK_CHARS = 1200
+
+def _fmt(value, default="N/A"):
+    return default if value in (None, "", "null", "None") else value
+
+def chunk_invoice(final_state: dict, source: str) -> List[Document]:
+    """
+    Splits one processed invoice into small typed chunks for the vector store:
+      header      - who / when / how much / outcome
+      line_item   - one per invoice line
+      discrepancy - the validation issues (only if any)
+      validation  - the pass/fail verdict
+      raw_text    - only when translation failed and there is nothing structured
+    Every chunk carries the invoice metadata so retrieval can filter and group on it.
+    """
+    data = final_state.get("structured_data") or {}
+    status = "PASS" if final_state.get("is_valid") else "FAIL"
+    issues = final_state.get("discrepancies") or []
+    invoice_no = _fmt(data.get("invoice_no"), source)
+    vendor = _fmt(data.get("vendor_name"), "Unknown Vendor")
+    currency = _fmt(data.get("currency"), "")
+
+    base_meta = {
+        "source": source,
+        "invoice_no": data.get("invoice_no"),
+        "vendor_name": data.get("vendor_name"),
+        # ISO or None: date filters fall back to processed_at only when the date is unreadable
+        "invoice_date": normalize_date(data.get("invoice_date")),
+        "total_amount": data.get("total_amount"),
+        "currency": data.get("currency"),
+        "status": status,
+        "processed_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    docs = []
+
+    def add(chunk_type: str, text: str, **extra):
+        docs.append(Document(page_content=text, metadata={**base_meta, "chunk_type": chunk_type, **extra}))
+
+    if data:
+        line_items = data.get("line_items") or []
+        po_numbers = sorted({str(i.get("po_number")) for i in line_items if i.get("po_number")})
+        add("header",
+            f"Invoice {invoice_no} from {vendor}, dated {_fmt(data.get('invoice_date'))}. "
+            f"Total {currency}{_fmt(data.get('total_amount'))} over {len(line_items)} line items. "
+            f"PO: {', '.join(po_numbers) or 'none'}. Validation status: {status}. Source file: {source}.")
+
+        for n, item in enumerate(line_items, start=1):
+            add("line_item",
+                f"Invoice {invoice_no} ({vendor}) line {n}: {_fmt(item.get('description'))}, "
+                f"qty {_fmt(item.get('qty'))} x {currency}{_fmt(item.get('unit_price'))} = "
+                f"{currency}{_fmt(item.get('total'))}, PO {_fmt(item.get('po_number'))}, "
+                f"item code {_fmt(item.get('item_code'))}.",
+                line_no=n, item_code=item.get("item_code"), po_number=item.get("po_number"))
+
+    if issues:
+        add("discrepancy",
+            f"Invoice {invoice_no} ({vendor}) discrepancies: " + "; ".join(str(i) for i in issues))
+
+    verdict = "passed validation" if status == "PASS" else "failed validation"
+    add("validation",
+        f"Invoice {invoice_no} from {vendor} {verdict} ({len(issues)} issue(s)).")
+
+    # Nothing structured to index (e.g. translation failed): fall back to the OCR text
+    if not data and final_state.get("raw_text"):
+        text = final_state["raw_text"]
+        for part, start in enumerate(range(0, len(text), RAW_CHUNK_CHARS)):
+            add("raw_text", f"Invoice file {source} (raw text part {part + 1}): {text[start:start + RAW_CHUNK_CHARS]}",
+                part=part + 1)
+
+    return docs
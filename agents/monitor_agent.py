@@ -1,18 +1,22 @@
 from tools.file_watcher import InvoiceWatcherTool
+from utils.logger import get_logger
+
+logger = get_logger("AGENT_MONITOR")
 
 def monitor_node(state: dict) -> dict:
     """
     Checks the folder for new files.
     """
-    print(" [Workflow] Monitor: Scanning for invoices...")
+    logger.debug("Monitor: Scanning for invoices...")
     watcher = InvoiceWatcherTool()
     result = watcher.execute()
     
     if result["found"]:
-        print(f" [Workflow] Monitor: Found {result['file_name']}")
+        logger.info("Monitor: Found %s", result['file_name'])
         return {
             "file_path": result["file_path"], 
             "file_name": result["file_name"],
+            "lease_path": result["lease_path"],
             "status": "PROCESSING"
         }
     else:
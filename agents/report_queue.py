@@ -0,0 +1,129 @@
+import asyncio
+import json
+import queue
+import threading
+import uuid
+from datetime import datetime
+from protocols.a2a import AgentMessage
+from agents.reporting_agent import ReportingAgent
+from utils.logger import get_logger
+
+logger = get_logger("REPORT_QUEUE")
+
+# Job lifecycle: QUEUED -> RUNNING -> READY | FAILED
+class ReportQueue:
+    """
+    Background report generation.
+    The workflow returns right after validation; reports are written to
+    outputs/reports by worker threads, and listeners are notified on completion.
+    """
+    def __init__(self, workers: int = 2, max_history: int = 1000):
+        self.jobs = {}
+        self.max_history = max_history
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+        self._subscribers = {}  # subscriber queue -> callable delivering one event to it
+        self._agent = ReportingAgent()
+
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f"report-worker-{i}", daemon=True)
+            t.start()
+
+    def submit(self, report_data: dict, file_name: str = None) -> str:
+        """Queues a report and returns its job id immediately."""
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "file_name": file_name,
+            "status": "QUEUED",
+            "invoice_id": None,
+            "html_report_path": None,
+            "error": None,
+            "queued_at": datetime.now().isoformat(),
+            "finished_at": None,
+        }
+        with self._lock:
+            self.jobs[job_id] = job
+            self._trim_history()
+        self._tasks.put((job_id, report_data))
+        logger.info(f"Queued report job {job_id} ({file_name}), depth={self._tasks.qsize()}")
+        return job_id
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def depth(self) -> int:
+        return self._tasks.qsize()
+
+    def subscribe(self) -> queue.Queue:
+        """Returns a queue that receives a copy of every finished job."""
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers[q] = q.put
+        return q
+
+    def subscribe_async(self) -> asyncio.Queue:
+        """
+        Same for async consumers (SSE handlers): an asyncio.Queue fed from the worker
+        threads with call_soon_threadsafe, so a listener holds no thread while it waits.
+        Call it on the event loop that will read the queue.
+        """
+        loop = asyncio.get_running_loop()
+        q = asyncio.Queue()
+        with self._lock:
+            self._subscribers[q] = lambda event: loop.call_soon_threadsafe(q.put_nowait, event)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.pop(q, None)
+
+    def _worker(self):
+        while True:
+            job_id, report_data = self._tasks.get()
+            self._update(job_id, status="RUNNING")
+            try:
+                msg = AgentMessage("report_queue", "rep", "GENERATE_REPORT", report_data)
+                res = self._agent.process_message(msg)
+                if res.status == "SUCCESS":
+                    meta = res.payload["final_report"]
+                    self._update(job_id, status="READY", invoice_id=meta["invoice_id"],
+                                 html_report_path=meta["html_report_path"])
+                else:
+                    self._update(job_id, status="FAILED", error=res.payload.get("error"))
+            except Exception as e:
+                logger.error(f"Report job {job_id} crashed: {e}")
+                self._update(job_id, status="FAILED", error=str(e))
+            finally:
+                self._tasks.task_done()
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            if job["status"] in ("READY", "FAILED"):
+                job["finished_at"] = datetime.now().isoformat()
+                event = dict(job)
+                for deliver in self._subscribers.values():
+                    try:
+                        deliver(event)
+                    except RuntimeError:
+                        pass  # Event loop of an async subscriber already closed
+        logger.info(f"Report job {job_id} -> {fields.get('status')}")
+
+    def _trim_history(self):
+        # Drop the oldest finished jobs so the status table does not grow forever
+        if len(self.jobs) <= self.max_history:
+            return
+        for jid in [j for j, v in self.jobs.items() if v["status"] in ("READY", "FAILED")]:
+            del self.jobs[jid]
+            if len(self.jobs) <= self.max_history:
+                break
+
+def format_sse(event: dict, name: str = "report") -> str:
+    """Server-Sent Events frame (a finished job by default)."""
+    return f"event: {name}\ndata: {json.dumps(event)}\n\n"
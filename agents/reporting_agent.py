@@ -1,10 +1,13 @@
+import os
 import json
 import uuid
-import ast
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from protocols.a2a import AgentMessage
 from protocols.mcp_client import sync_mcp_call
+from tools.report_renderer import ReportRendererTool
+from storage.report_store import get_report_store
 from utils.logger import get_logger
 
 # Initialize Logger
@@ -15,9 +18,21 @@ MCP_SERVER_PORT = 8002
 REPORTS_DIR = Path("outputs/reports")
 REPORTS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Set REPORT_NARRATIVE=1 to add an LLM-written summary to reports in the background
+NARRATIVE_ENABLED = os.getenv("REPORT_NARRATIVE", "0").lower() in ("1", "true", "yes")
+_narrative_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="report-narrative")
+
+def _write_json(path: Path, data: dict):
+    # Readers (and a crash mid-write) see either the old file or the new one, never half of it
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
 class ReportingAgent:
     def __init__(self):
         self.name = "reporting_agent"
+        self.renderer = ReportRendererTool()
         logger.debug("Reporting Agent Initialized")
 
     def process_message(self, message: AgentMessage) -> AgentMessage:
@@ -27,33 +42,14 @@ class ReportingAgent:
         if message.task_type != "GENERATE_REPORT":
             return self._error(message, "Invalid Task Type")
             
-        data = message.payload
+        data = dict(message.payload or {})
+        # Checkpoint thread of the run that produced this report (used to resume reruns)
+        thread_id = data.pop("workflow_thread_id", None)
         if not data:
             return self._error(message, "No data provided for reporting")
 
-        # 2. Prepare Data for Remote Call
-        safe_data = str(data)
-        logger.info(f"Calling FastMCP (Port {MCP_SERVER_PORT})... Data Size: {len(safe_data)} chars")
-        
         try:
-            # 3. Call Remote Server (Google ADK Tools) to get HTML
-            res_str = sync_mcp_call(MCP_SERVER_PORT, "generate_report", {"report_data": safe_data})
-            
-            # 4. Parse Response
-            if isinstance(res_str, str):
-                if "Error" in res_str and not res_str.strip().startswith("{"):
-                    logger.error(f"Server returned error string: {res_str}")
-                    return self._error(message, res_str)
-                
-                # Clean Markdown if the LLM added it
-                clean = res_str.replace("```json", "").replace("```", "").strip()
-                res = json.loads(clean)
-            else:
-                res = res_str
-                
-            report_html = res.get("html", "<b>Error: No HTML returned from AI</b>")
-            
-            # 5. Generate Filenames
+            # 2. Generate Filenames
             inv_num = data.get('invoice_no')
             
             # Create a safe filename
@@ -62,13 +58,17 @@ class ReportingAgent:
             else:
                 safe_id = f"Unknown_{uuid.uuid4().hex[:8]}"
 
+            # Never overwrite an existing report: a second invoice with the same number gets its own files
+            if (REPORTS_DIR / f"{safe_id}.json").exists() or get_report_store().get(safe_id):
+                safe_id = f"{safe_id}_{uuid.uuid4().hex[:8]}"
+
             html_filename = f"{safe_id}.html"
             json_filename = f"{safe_id}.json"
             
             html_path = REPORTS_DIR / html_filename
             json_path = REPORTS_DIR / json_filename
             
-            # 6. Generate Human Readable Summary (THE FIX)
+            # 3. Generate Human Readable Summary
             status = data.get('validation_status', 'Unknown')
             discrepancies = data.get('discrepancies', [])
             
@@ -79,10 +79,10 @@ class ReportingAgent:
                 issue_text = discrepancies[0] if discrepancies else "Unknown Validation Error"
                 summary = f"❌ Rejected: {issue_text}"
 
-            # 7. Save Files to Disk
-            # Save HTML
-            with open(html_path, "w", encoding="utf-8") as f: 
-                f.write(report_html)
+            # 4. Save Files to Disk
+            # Render HTML locally from the versioned template (no LLM round trip)
+            render = self.renderer.execute(data, str(html_path))
+            report_html = html_path.read_text(encoding="utf-8")
             
             # Save JSON Metadata
             metadata = {
@@ -91,6 +91,9 @@ class ReportingAgent:
                 "status": status,
                 "human_readable_summary": summary, # <--- Contains the real reason now
                 "html_report_path": str(html_filename), # Store relative name for API convenience
+                "template_version": render["template_version"],
+                "narrative_summary": None,
+                "workflow_thread_id": thread_id,
                 "timestamp": datetime.now().isoformat(),
                 "audit_trail": {
                     "invoice_data": data,
@@ -98,12 +101,18 @@ class ReportingAgent:
                 }
             }
             
-            with open(json_path, "w", encoding="utf-8") as f: 
-                json.dump(metadata, f, indent=2)
+            _write_json(json_path, metadata)
+
+            # Index it for the dashboard (GET /api/reports reads the store, not the folder)
+            get_report_store().upsert(metadata)
 
             logger.info(f"Files Saved Successfully: {json_filename}")
+
+            # Optional LLM narrative: runs off the critical path and patches the files when ready
+            if NARRATIVE_ENABLED:
+                _narrative_pool.submit(self._attach_narrative, data, html_path, json_path)
             
-            # 8. Return Success
+            # 5. Return Success
             return AgentMessage(
                 sender=self.name, 
                 receiver=message.sender, 
@@ -116,6 +125,29 @@ class ReportingAgent:
             logger.critical(f"Reporting Logic Failed: {str(e)}")
             return self._error(message, str(e))
 
+    def _attach_narrative(self, data: dict, html_path: Path, json_path: Path):
+        """Background job: asks Gemini for a short summary, then re-renders the report with it."""
+        try:
+            res_str = sync_mcp_call(MCP_SERVER_PORT, "summarize_report", {"report_data": json.dumps(data, default=str)})
+            res = json.loads(res_str) if isinstance(res_str, str) else (res_str or {})
+            narrative = res.get("summary")
+            if not narrative:
+                logger.warning(f"No narrative returned for {json_path.name}: {res.get('message') or res.get('error')}")
+                return
+
+            self.renderer.execute(data, str(html_path), narrative=narrative)
+
+            with open(json_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            metadata["narrative_summary"] = narrative
+            _write_json(json_path, metadata)
+            # Narrow patch: a full upsert would reset a reviewer's Approve/Reject and bump the version
+            get_report_store().set_narrative(metadata["invoice_id"], narrative)
+
+            logger.info(f"Narrative attached to {json_path.name}")
+        except Exception as e:
+            logger.error(f"Narrative generation failed for {json_path.name}: {e}")
+
     def _error(self, msg, err):
         return AgentMessage(
             sender=self.name, 
@@ -1,56 +1,134 @@
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
 from protocols.mcp_client import sync_mcp_call
 from persona.persona_agent import load_rules
 from utils.logger import get_logger
+from utils.vendors import normalize_vendor_name
 
 logger = get_logger("AGENT_VALIDATOR")
 MCP_SERVER_PORT = 8001
+# Normalized-name similarity (0..1) at which an unresolved vendor still counts as the PO's vendor
+VENDOR_NAME_SIMILARITY = float(os.getenv("VENDOR_NAME_SIMILARITY", "0.85"))
 
-def validation_node(state: dict) -> dict:
-    data = state.get("structured_data")
-    if not data: 
-        logger.error("No Data Received")
-        return {"status": "FAILED", "error_message": "No Data"}
+# Each check below is an independent branch of the validator stage in main_workflow.
+# They return {"discrepancies": [...], "validation_results": {<check>: {...}}}; the graph
+# reducers merge the branches, so the stage takes as long as the slowest check.
 
-    # 1. FIND PO NUMBER
-    po_number = None
-    line_items = data.get('line_items', [])
-    
+def _remote_check(validation_type: str, key: str) -> dict:
+    """One ERP lookup through FastMCP (port 8001)."""
+    res_str = sync_mcp_call(MCP_SERVER_PORT, "validate_business_data", {"validation_type": validation_type, "key": key})
+
+    # Parse Response
+    if isinstance(res_str, str):
+        if "Error" in res_str and not res_str.strip().startswith("{"): raise Exception(res_str)
+        return json.loads(res_str)
+    return res_str or {}
+
+def _result(check: str, discrepancies: list, **details) -> dict:
+    return {
+        "discrepancies": discrepancies,
+        "validation_results": {check: {"passed": not discrepancies, **details}},
+    }
+
+def _find_po_number(data: dict):
     # Scan header first, then items
     if data.get('po_number'):
-        po_number = data.get('po_number')
-    else:
-        for item in line_items:
-            val = item.get('po_number')
-            if val and str(val).lower() not in ['none', 'null', '']:
-                po_number = val
-                break
-            
+        return data.get('po_number')
+    for item in data.get('line_items', []):
+        val = item.get('po_number')
+        if val and str(val).lower() not in ['none', 'null', '']:
+            return val
+    return None
+
+def check_po(state: dict) -> dict:
+    data = state.get("structured_data") or {}
+    po_number = _find_po_number(data)
     if not po_number:
         logger.warning("❌ NO PO NUMBER FOUND. Skipping Remote Validation.")
-        return {"discrepancies": ["Missing PO Number in Invoice Data"], "is_valid": False}
+        return _result("po", ["Missing PO Number in Invoice Data"])
 
-    # 2. CALL REMOTE SERVER
-    logger.info(f"Calling FastMCP (Port {MCP_SERVER_PORT}) to validate {po_number}...")
-    
+    logger.info("Calling FastMCP (Port %s) to validate %s...", MCP_SERVER_PORT, po_number)
     try:
-        res_str = sync_mcp_call(MCP_SERVER_PORT, "validate_business_data", {"validation_type": "po", "key": po_number})
-        
-        # Parse Response
-        if isinstance(res_str, str):
-            if "Error" in res_str and not res_str.strip().startswith("{"): raise Exception(res_str)
-            res = json.loads(res_str)
-        else:
-            res = res_str
-            
-        logger.info(f"Remote Result: {res}")
-        
-        discrepancies = []
+        res = _remote_check("po", po_number)
+        logger.debug("Remote Result: %s", res)
         if not res.get("valid"):
-            discrepancies.append(f"Invalid PO Number: {po_number} (Not found in ERP)")
-            
-        return {"discrepancies": discrepancies, "is_valid": len(discrepancies) == 0}
-        
+            return _result("po", [f"Invalid PO Number: {po_number} (Not found in ERP)"], key=po_number)
+        return _result("po", [], key=po_number)
+    except Exception as e:
+        logger.error("Validation Crash (po): %s", e)
+        return _result("po", [f"System Error: {e}"], key=po_number)
+
+def _po_vendor(data: dict):
+    """ERP vendor record the invoice's PO was raised for, or None."""
+    po_number = _find_po_number(data)
+    if not po_number:
+        return None
+    po = _remote_check("po", po_number)
+    vendor_id = (po.get("data") or {}).get("vendor_id") if po.get("valid") else None
+    if not vendor_id:
+        return None
+    res = _remote_check("vendor", vendor_id)
+    return res.get("data") if res.get("valid") else None
+
+def check_vendor(state: dict) -> dict:
+    data = state.get("structured_data") or {}
+    vendor = data.get("vendor_name")
+    if not vendor:
+        return _result("vendor", [], skipped="no vendor name")  # Reported by the mandatory-field check
+
+    try:
+        # The ERP matches on the normalized name (case, punctuation, legal form ignored)
+        res = _remote_check("vendor_name", vendor)
+        if res.get("valid"):
+            return _result("vendor", [], key=vendor, vendor_id=(res.get("data") or {}).get("vendor_id"))
+
+        # Not resolvable by name: compare with the vendor on the invoice's PO. A name the
+        # LLM read slightly differently ("Hafen Logistik") is a warning, not a rejection.
+        po_vendor = _po_vendor(data)
+        if not po_vendor:
+            return _result("vendor", [f"Unknown Vendor: {vendor} (Not found in ERP)"], key=vendor)
+        erp_name = po_vendor.get("vendor_name") or ""
+        similarity = SequenceMatcher(None, normalize_vendor_name(vendor), normalize_vendor_name(erp_name)).ratio()
+        if similarity < VENDOR_NAME_SIMILARITY:
+            return _result("vendor", [f"Vendor Mismatch: {vendor} (PO vendor in ERP is {erp_name})"],
+                           key=vendor, similarity=round(similarity, 3))
+        warning = f"Vendor name '{vendor}' differs slightly from ERP vendor '{erp_name}' on the PO"
+        logger.warning("%s (similarity %.2f)", warning, similarity)
+        return _result("vendor", [], key=vendor, vendor_id=po_vendor.get("vendor_id"),
+                       warning=warning, similarity=round(similarity, 3))
     except Exception as e:
-        logger.error(f"Validation Crash: {e}")
-        return {"discrepancies": [f"System Error: {e}"], "is_valid": False}
\ No newline at end of file
+        logger.error("Validation Crash (vendor): %s", e)
+        return _result("vendor", [f"System Error: {e}"], key=vendor)
+
+def check_skus(state: dict) -> dict:
+    items = (state.get("structured_data") or {}).get("line_items") or []
+    codes = sorted({str(i["item_code"]) for i in items
+                    if i.get("item_code") and str(i["item_code"]).lower() not in ['none', 'null', '']})
+    if not codes:
+        return _result("sku", [], skipped="no item codes")
+
+    def lookup(code):
+        try:
+            return code, _remote_check("sku", code).get("valid", False), None
+        except Exception as e:
+            return code, False, e
+
+    # Lookups are independent too: one round trip of latency for all line items
+    with ThreadPoolExecutor(max_workers=min(8, len(codes))) as pool:
+        results = list(pool.map(lookup, codes))
+
+    discrepancies = []
+    for code, valid, error in results:
+        if error is not None:
+            discrepancies.append(f"System Error: {error}")
+        elif not valid:
+            discrepancies.append(f"Unknown SKU: {code} (Not found in ERP)")
+    return _result("sku", discrepancies, checked=codes)
+
+def check_mandatory_fields(state: dict) -> dict:
+    data = state.get("structured_data") or {}
+    required = (load_rules().get("validation_rules") or {}).get("mandatory_fields") or []
+    missing = [f for f in required if data.get(f) in (None, "", "null", "None")]
+    return _result("mandatory_fields", [f"Missing mandatory field: {f}" for f in missing], missing=missing)
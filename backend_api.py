@@ -1,29 +1,47 @@
+import asyncio
+import os
+import time
 import uvicorn
-import shutil
 import json
-import uuid
 from pathlib import Path
 from datetime import datetime
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from langchain_core.documents import Document
 from typing import List, Optional, Dict, Any
-import traceback 
-from langfuse.callback import CallbackHandler
 
 # Import Core Logic
-from main_workflow import build_graph
-from rag_agents.workflow import rag_app
-from agents.indexing_tool import index_invoice_text
+from main_workflow import run_workflow, resume_workflow, build_report_payload
+from agents.report_queue import ReportQueue, format_sse
+from rag_agents.workflow import get_rag_app
+from agents.indexing_tool import index_invoice_documents
+from agents.invoice_chunker import chunk_invoice
+from rag_agents.index_store import WriterLockHeld
+from rag_agents.retrieval_agent import vector_store
+from rag_agents.semantic_cache import answer_cache
+from rag_agents.rephrase_agent import rephrase_stats
+from rag_agents.reflection_agent import reflection_stats
+from storage.report_store import get_report_store
+from storage.checkpoints import new_thread_id
+from tools.file_lease import claim
+from tools.upload_receiver import MAX_UPLOAD_BYTES, UploadRejected, receive_upload
+from utils.metrics import LatencyWindow, CONTENT_TYPE, get_registry, render_prometheus
+from utils.logger import get_logger
+from utils.profiling import (PROFILE_ID_HEADER, current_profile_id, reset_profile_context,
+                             start_profile, wants_profile)
 from dotenv import load_dotenv
 
 load_dotenv()
+logger = get_logger("API")
 # Paths
 BASE_DIR = Path(__file__).resolve().parent
 WEB_UPLOAD_DIR = BASE_DIR / "data" / "web_uploads" 
 INCOMING_DIR = BASE_DIR / "data" / "incoming" 
 PROCESSED_DIR = BASE_DIR / "data" / "processed"
+FAILED_DIR = BASE_DIR / "data" / "failed"
 REPORTS_DIR = BASE_DIR / "outputs" / "reports"
 
 # Ensure directories exist
@@ -32,6 +50,44 @@ INCOMING_DIR.mkdir(parents=True, exist_ok=True)
 PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 REPORTS_DIR.mkdir(parents=True, exist_ok=True)
 
+# "inline": the response waits for the HTML report (legacy behaviour)
+# "deferred": respond after validation, report is written by a background queue
+REPORT_MODE = os.getenv("REPORT_MODE", "inline").lower()
+_report_queue = None
+
+def get_report_queue() -> ReportQueue:
+    global _report_queue
+    if _report_queue is None:
+        _report_queue = ReportQueue(workers=int(os.getenv("REPORT_WORKERS", "2")))
+    return _report_queue
+
+def _claim_or_409(file_path: Path):
+    """Takes the lease on an incoming file so a running ingestion daemon cannot process it too."""
+    lease = claim(file_path, owner="backend_api")
+    if lease is None:
+        raise HTTPException(409, f"{file_path.name} is already being processed by another worker")
+    return lease.start_heartbeat()
+
+def _tracing_callbacks() -> list:
+    """Langfuse tracing for a workflow run; the SDK is imported on the first upload, not at startup."""
+    from langfuse.callback import CallbackHandler
+    return [CallbackHandler()]
+
+def _use_deferred(defer_report: Optional[bool]) -> bool:
+    return defer_report if defer_report is not None else REPORT_MODE == "deferred"
+
+def _report_fields(final_state: dict, filename: str, deferred: bool) -> dict:
+    """Report part of the upload response: inline HTML, or a job id to poll / listen for."""
+    if not deferred:
+        return {"report_status": "READY" if final_state.get("final_report_html") else "SKIPPED",
+                "report_html": final_state.get("final_report_html")}
+
+    if final_state.get("status") == "FAILED" or not final_state.get("structured_data"):
+        return {"report_status": "SKIPPED", "report_job_id": None, "report_html": None}
+
+    job_id = get_report_queue().submit(build_report_payload(final_state), file_name=filename)
+    return {"report_status": "PENDING", "report_job_id": job_id, "report_html": None}
+
 # Initialize API
 app = FastAPI(title="Lumina Invoice Auditor API", version="1.0.0")
 
@@ -42,8 +98,121 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", PROFILE_ID_HEADER],
 )
 
+http_latency = get_registry().histogram("http_request_seconds", "API latency in seconds (streams: until headers)")
+http_in_flight = get_registry().gauge("http_requests_in_flight", "API requests being handled")
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    http_in_flight.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        http_in_flight.dec()
+        # Route template, not the raw path, so ids do not explode the label set
+        route = request.scope.get("route")
+        http_latency.observe(time.perf_counter() - start, method=request.method,
+                             route=getattr(route, "path", "unmatched"), status=status)
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """
+    Opt-in profiling ("X-Profile: 1" or PROFILE_REQUESTS=1): samples every thread until
+    the response body is fully sent (so SSE streams are covered) and writes
+    outputs/profiles/<id>.folded. Requests without the header only pay for the check.
+    """
+    if not wants_profile(request.headers):
+        return await call_next(request)
+
+    profiler, token = start_profile(f"{request.method} {request.url.path}", request.headers.get("X-Request-ID"))
+    try:
+        response = await call_next(request)
+    except Exception:
+        reset_profile_context(token)
+        profiler.stop(error=True)
+        raise
+    reset_profile_context(token)
+    response.headers[PROFILE_ID_HEADER] = profiler.trace_id
+
+    body = response.body_iterator
+    async def body_then_stop():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            profiler.stop(status=response.status_code)
+    response.body_iterator = body_then_stop()
+    return response
+
+# Multipart framing around the file part (boundary lines, part headers, other form fields)
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+class _BodyTooLarge(Exception):
+    pass
+
+class UploadSizeLimit:
+    """
+    Plain ASGI middleware for POST /api/upload: 413 from the Content-Length alone, and
+    for chunked bodies (no length) the bytes are counted as they arrive. The multipart
+    parser spools the whole part before the handler runs, so this is the only place a
+    chunked upload can be stopped at the limit instead of after it is on disk.
+    """
+    def __init__(self, app, path: str, max_bytes: int):
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+
+        length = dict(scope["headers"]).get(b"content-length", b"").decode()
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(send, f"Upload of {length} bytes exceeds the {MAX_UPLOAD_BYTES} byte limit")
+
+        received = 0
+        too_large = False
+
+        async def counting_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    too_large = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # The parser may turn our exception into its own 400: answer 413 instead
+            if not too_large:
+                await send(message)
+
+        try:
+            await self.app(scope, counting_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if too_large:
+            await self._reject(send, f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+
+    @staticmethod
+    async def _reject(send, detail: str):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+# Added last, so it is the outermost layer and sees the body before anything reads it
+app.add_middleware(UploadSizeLimit, path="/api/upload", max_bytes=MAX_UPLOAD_BYTES + UPLOAD_OVERHEAD_BYTES)
+
 # --- Pydantic Models (Data Structures) ---
 class ChatRequest(BaseModel):
     question: str
@@ -53,6 +222,12 @@ class ActionRequest(BaseModel):
     invoice_id: str
     action: str 
     notes: Optional[str] = ""
+    expected_version: Optional[int] = None # Optimistic lock: "version" from GET /api/reports
+
+class BulkActionRequest(BaseModel):
+    actions: List[ActionRequest]
+    actor: Optional[str] = None
+    all_or_nothing: bool = False
 
 class RerunRequest(BaseModel):
     invoice_id: str
@@ -61,6 +236,13 @@ class RerunRequest(BaseModel):
 class ProcessRequest(BaseModel):
     filename: str
 
+class IndexDocumentsRequest(BaseModel):
+    documents: List[Dict[str, Any]]  # [{"page_content": str, "metadata": {...}}]
+
+class ResumeRequest(BaseModel):
+    workflow_id: str
+    from_node: Optional[str] = None  # Default: the node that failed
+
 # --- ENDPOINTS ---
 
 @app.get("/")
@@ -68,9 +250,9 @@ def health_check():
     return {"status": "online", "system": "Lumina Auditor Backend"}
 
 @app.post("/api/upload")
-async def upload_invoice(file: UploadFile = File(...)):
+async def upload_invoice(file: UploadFile = File(...), defer_report: Optional[bool] = None):
     """
-    1. Saves file
+    1. Saves file (streamed in chunks off the event loop, size-limited, type-sniffed)
     2. Runs LangGraph Workflow
     3. Indexes for RAG
     4. MOVES file to processed folder <--- NEW
@@ -78,88 +260,132 @@ async def upload_invoice(file: UploadFile = File(...)):
     """
     try:
         # 1. Save File
-        file_path = INCOMING_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        print(f" [API] Processing: {file.filename}")
+        try:
+            upload = await receive_upload(file, INCOMING_DIR)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        filename = upload["file_name"]
 
-        langfuse_handler = CallbackHandler()
-        
-        # 2. Run Workflow
-        workflow = build_graph()
-        final_state = workflow.invoke({"status": "STARTING", "file_name": file.filename},config={"callbacks": [langfuse_handler]})
-        
-        # 3. Index for RAG
-        if final_state.get("raw_text"):
-            audit = final_state.get("structured_data", {})
-            status = "PASS" if final_state.get("is_valid") else "FAIL"
-            issues = final_state.get("discrepancies", [])
+        logger.info("Processing: %s", filename)
+        # Rename, WAL fsync and file moves are blocking filesystem calls: all of them run in the pool
+        lease = await run_in_threadpool(_claim_or_409, upload["path"])
+
+        # 2. Run Workflow (OCR / LLM calls take seconds: keep them off the event loop)
+        try:
+            deferred = _use_deferred(defer_report)
+            final_state, workflow_id = await run_in_threadpool(
+                run_workflow, {"status": "STARTING", "file_name": filename, "file_path": str(lease.path)},
+                defer_report=deferred, callbacks=_tracing_callbacks())
             
-            context = f"""
-            INVOICE: {file.filename}
-            STATUS: {status}
-            VENDOR: {audit.get('vendor_name')}
-            ISSUES: {issues}
-            RAW TEXT: {final_state['raw_text']}
-            """
-            index_invoice_text(context, {"source": file.filename})
+            # 3. Index for RAG (a FAILED run is indexed once, when /api/workflows/resume completes it)
+            if final_state.get("raw_text") and final_state.get("status") != "FAILED":
+                # Typed chunks (header, line items, discrepancies, verdict) instead of one big blob
+                await run_in_threadpool(index_invoice_documents, chunk_invoice(final_state, filename))
+        except Exception as e:
+            await run_in_threadpool(lease.finalize, False, FAILED_DIR, error=str(e))
+            raise
 
         # --- 4. NEW: FILE LIFECYCLE MANAGEMENT ---
         # Move the file to 'processed' only if we reached this point successfully
-        destination_path = PROCESSED_DIR / file.filename
-        
-        # Check for duplicates and rename if necessary (e.g., "invoice.pdf" -> "uuid_invoice.pdf")
-        if destination_path.exists():
-            timestamp = uuid.uuid4().hex[:8]
-            destination_path = PROCESSED_DIR / f"{timestamp}_{file.filename}"
-            
-        shutil.move(str(file_path), str(destination_path))
-        print(f" [API] Archived {file.filename} to processed folder.")
+        # (a name clash gets a uuid prefix, e.g. "invoice.pdf" -> "1a2b3c4d_invoice.pdf")
+        await run_in_threadpool(lease.finalize, True, PROCESSED_DIR)
+        logger.info("Archived %s to processed folder.", filename)
         # -----------------------------------------
 
         return {
             "status": "success",
-            "filename": file.filename,
+            "filename": filename,
+            "workflow_id": workflow_id,
+            "profile_id": current_profile_id(),
             "data": final_state.get("structured_data"),
             "validation": {
                 "is_valid": final_state.get("is_valid"),
-                "discrepancies": final_state.get("discrepancies")
+                "discrepancies": final_state.get("discrepancies"),
+                "duplicate_of": final_state.get("duplicate_of")
             },
-            "report_html": final_state.get("final_report_html")
+            "upload": {k: upload[k] for k in ("size_bytes", "sha256", "content_type")},
+            **_report_fields(final_state, filename, deferred)
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error: {e}")
-        # Optional: You could delete the file from 'incoming' if processing fails so it doesn't get stuck
-        # if file_path.exists():
-        #    os.remove(file_path)
+        logger.exception("Upload processing failed: %s", e)
+        # The lease already moved the file to data/failed (with an .error.json next to it)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/reports")
-def get_reports():
-    """Returns list of all processed JSON reports"""
-    reports = []
-    # Sort by newest
-    files = sorted(REPORTS_DIR.glob("*.json"), key=lambda x: x.stat().st_mtime, reverse=True)
-    for f in files:
+def get_reports(response: Response, limit: int = 50, cursor: Optional[str] = None,
+                status: Optional[str] = None, vendor: Optional[str] = None,
+                date_from: Optional[str] = None, date_to: Optional[str] = None,
+                date_field: str = "created_at", sort: str = "created_at", order: str = "desc"):
+    """
+    Returns one page of processed reports (newest first by default) from the indexed store.
+    Pass the X-Next-Cursor response header back as ?cursor= to fetch the next page.
+    """
+    try:
+        page = get_report_store().list(limit=limit, cursor=cursor, status=status, vendor=vendor,
+                                       date_from=date_from, date_to=date_to, date_field=date_field,
+                                       sort=sort, order=order)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return page["items"]
+
+# Idle SSE connections send a comment this often; disconnects are noticed within SSE_POLL_SEC
+SSE_KEEPALIVE_SEC = 15
+SSE_POLL_SEC = 1.0
+
+@app.get("/api/report-jobs/events")
+async def report_job_events(request: Request):
+    """
+    SSE stream: one 'report' event per background report as soon as it is READY or FAILED.
+    Runs on the event loop (no threadpool worker is held per connected dashboard).
+    """
+    report_queue = await run_in_threadpool(get_report_queue)  # First call starts the workers
+
+    async def stream():
+        q = report_queue.subscribe_async()
         try:
-            with open(f, "r") as jf:
-                reports.append(json.load(jf))
-        except: pass
-    return reports
+            yield ": connected\n\n"
+            idle = 0.0
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(q.get(), timeout=SSE_POLL_SEC)
+                except asyncio.TimeoutError:
+                    idle += SSE_POLL_SEC
+                    if idle >= SSE_KEEPALIVE_SEC:
+                        idle = 0.0
+                        yield ": keep-alive\n\n"
+                    continue
+                idle = 0.0
+                yield format_sse(event)
+        finally:
+            report_queue.unsubscribe(q)
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.get("/api/report-jobs/{job_id}")
+def report_job_status(job_id: str):
+    """Polling alternative to the event stream."""
+    job = get_report_queue().get(job_id)
+    if not job:
+        raise HTTPException(404, "Report job not found")
+    return job
 
 @app.post("/api/chat")
 def chat_agent(req: ChatRequest):
     """RAG Chatbot Endpoint"""
     try:
-        print(f" [API] Chat Request: {req.question}") # Debug print
+        logger.info("Chat Request: %s", req.question)
         
         # Format history string for the agent
         hist_str = [f"{msg}" for msg in req.history]
         
         # RUN THE AGENT
-        result = rag_app.invoke({"question": req.question, "chat_history": hist_str})
+        result = get_rag_app().invoke({"question": req.question, "chat_history": hist_str})
         
         return {
             "answer": result.get("answer", "No answer"),
@@ -167,56 +393,137 @@ def chat_agent(req: ChatRequest):
             "is_safe": result.get("reflection_score", {}).get("is_safe", False)
         }
     except Exception as e:
-        print("!!! CHAT ENDPOINT ERROR !!!")
-        traceback.print_exc() 
+        logger.exception("!!! CHAT ENDPOINT ERROR !!!")
         raise HTTPException(status_code=500, detail=f"Backend Error: {str(e)}")
 
+# Streaming chat: time to first token and to the reflection verdict
+chat_ttft = LatencyWindow("chat_ttft")
+chat_total = LatencyWindow("chat_total")
+
+@app.post("/api/chat/stream")
+def chat_stream(req: ChatRequest):
+    """
+    RAG Chatbot over SSE: 'token' events as the generator streams, then one trailing
+    'verdict' event with the reflection score. Clients should keep the streamed answer
+    provisional until the verdict says is_safe; is_safe null means it was not graded.
+    """
+    logger.info("Streaming Chat Request: %s", req.question)
+    hist_str = [f"{msg}" for msg in req.history]
+
+    def stream():
+        start = time.perf_counter()
+        ttft_ms = None
+        final = {}
+        try:
+            for mode, payload in get_rag_app().stream({"question": req.question, "chat_history": hist_str},
+                                                stream_mode=["messages", "updates"]):
+                if mode == "messages":
+                    chunk, meta = payload
+                    text = chunk.content if isinstance(chunk.content, str) else ""
+                    if meta.get("langgraph_node") != "generate" or not text:
+                        continue  # Rephrase / reflection tokens are internal
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - start) * 1000
+                        chat_ttft.record(ttft_ms)
+                    yield format_sse({"text": text}, "token")
+                else:
+                    for update in payload.values():
+                        final.update(update or {})
+
+            # Answers that never hit the LLM (analytics fast path, cache hit, no context) arrive whole
+            if ttft_ms is None and final.get("answer"):
+                ttft_ms = (time.perf_counter() - start) * 1000
+                chat_ttft.record(ttft_ms)
+                yield format_sse({"text": final["answer"]}, "token")
+
+            total_ms = (time.perf_counter() - start) * 1000
+            chat_total.record(total_ms)
+            score = final.get("reflection_score", {})
+            yield format_sse({
+                "answer": final.get("answer", "No answer"),
+                "score": score,
+                "is_safe": score.get("is_safe", False),
+                "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+                "total_ms": round(total_ms, 1),
+            }, "verdict")
+        except Exception as e:
+            logger.exception("!!! CHAT STREAM ERROR !!!")
+            yield format_sse({"error": f"Backend Error: {str(e)}"}, "error")
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/rag/stats")
+def rag_stats():
+    """Resident vector store version, retrieval latency percentiles (ms) and answer cache hit rate."""
+    return {**vector_store.stats(), "answer_cache": answer_cache.stats(),
+            "chat_ttft_ms": chat_ttft.snapshot(), "chat_total_ms": chat_total.snapshot(),
+            "llm_calls": {"rephrase": rephrase_stats, "reflection": reflection_stats}}
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: per-node, MCP, ERP, LLM and FAISS latency histograms."""
+    return Response(render_prometheus(), media_type=CONTENT_TYPE)
+
 @app.post("/api/action")
 def human_action(req: ActionRequest):
-    """Handle Manual Approve/Reject"""
-    json_path = REPORTS_DIR / f"{req.invoice_id}.json"
+    """Handle Manual Approve/Reject (a bulk action of one)"""
+    result = get_report_store().apply_actions([req.model_dump()])[0]
     
-    if not json_path.exists():
+    if result["result"] == "not_found":
         raise HTTPException(404, "Report not found")
+    if result["result"] == "conflict":
+        raise HTTPException(409, f"Report was modified (current version {result['current_version']})")
+    if result["result"] != "ok":
+        raise HTTPException(400, f"Invalid action: {req.action}")
         
-    with open(json_path, "r") as f:
-        data = json.load(f)
-        
-    data["status"] = "Approved" if req.action == "APPROVE" else "Rejected"
-    data["human_readable_summary"] += f" (Manually {req.action}: {req.notes})"
-    
-    with open(json_path, "w") as f:
-        json.dump(data, f)
-        
-    return {"status": "success", "new_state": data["status"]}
+    return {"status": "success", "new_state": result["status"], "version": result["version"]}
+
+@app.post("/api/actions/bulk")
+def bulk_human_action(req: BulkActionRequest):
+    """
+    Approve/Reject many invoices in one call and one DB transaction.
+    Every applied change is recorded in the append-only audit log.
+    """
+    results = get_report_store().apply_actions(
+        [a.model_dump() for a in req.actions], actor=req.actor, all_or_nothing=req.all_or_nothing
+    )
+    applied = sum(1 for r in results if r["result"] == "ok")
+    return {"status": "success" if applied == len(results) else "partial", "applied": applied, "results": results}
+
+@app.get("/api/reports/{invoice_id}/audit")
+def report_audit_log(invoice_id: str):
+    """Append-only history of human actions for one report."""
+    return get_report_store().audit_trail(invoice_id)
 
 @app.post("/api/rerun")
 def rerun_validation(req: RerunRequest):
-    """Edit Data and Re-run Workflow"""
+    """Edit Data and Re-run Validation (resumes the checkpointed run: no OCR, no translation)"""
     try:
-        print(f" [API] Re-running {req.invoice_id} with new data...")
-        workflow = build_graph()
+        logger.info("Re-running %s with new data...", req.invoice_id)
+        report = get_report_store().get(req.invoice_id) or {}
+        # Reports from before checkpointing have no thread: seed a fresh one at the validator
+        workflow_id = report.get("workflow_thread_id") or new_thread_id(req.invoice_id)
         
-        rerun_state = {
+        corrections = {
             "is_rerun": True,
             "corrected_data": req.updated_data,
-            "status": "STARTING",
-            "file_name": req.invoice_id,
-            "file_path": "manual_override",
-            "raw_text": ""
+            "structured_data": req.updated_data,
         }
+        if not report.get("workflow_thread_id"):
+            corrections.update({"file_name": req.invoice_id, "thread_id": workflow_id})
         
-        final_state = workflow.invoke(rerun_state)
+        final_state = resume_workflow(workflow_id, from_node="validator", updates=corrections)
         
-        # Update JSON if passed
+        # Update the stored report if passed (locked + audited, no JSON file rewrite)
         if final_state.get("is_valid"):
-            json_path = REPORTS_DIR / f"{req.invoice_id}.json"
-            if json_path.exists():
-                with open(json_path, "r") as f: data = json.load(f)
+            def apply_rerun(data):
                 data["status"] = "Approved"
                 data["audit_trail"]["invoice_data"] = req.updated_data
                 data["human_readable_summary"] = "Re-run Passed (Manual Data)"
-                with open(json_path, "w") as f: json.dump(data, f)
+
+            get_report_store().update_report(req.invoice_id, "RERUN_PASS", apply_rerun,
+                                             notes="Re-run with manually corrected data")
 
         return {
             "is_valid": final_state.get("is_valid"),
@@ -224,7 +531,46 @@ def rerun_validation(req: RerunRequest):
         }
     except Exception as e:
         raise HTTPException(500, str(e))
+
+@app.post("/api/workflows/resume")
+def resume_failed_workflow(req: ResumeRequest, defer_report: Optional[bool] = None):
+    """Continues a failed run (e.g. a transient Gemini error) from the failed node, reusing earlier steps"""
+    deferred = _use_deferred(defer_report)
+    try:
+        final_state = resume_workflow(req.workflow_id, from_node=req.from_node, defer_report=deferred)
+    except KeyError as e:
+        raise HTTPException(404, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    filename = final_state.get("file_name")
+    if final_state.get("status") != "FAILED" and final_state.get("structured_data"):
+        index_invoice_documents(chunk_invoice(final_state, filename))
+
+    return {
+        "status": "failed" if final_state.get("status") == "FAILED" else "success",
+        "workflow_id": req.workflow_id,
+        "failed_node": final_state.get("failed_node"),
+        "error_message": final_state.get("error_message"),
+        "data": final_state.get("structured_data"),
+        "validation": {
+            "is_valid": final_state.get("is_valid"),
+            "discrepancies": final_state.get("discrepancies"),
+            "duplicate_of": final_state.get("duplicate_of")
+        },
+        **_report_fields(final_state, filename, deferred)
+    }
     
+@app.post("/api/index/documents")
+def index_documents(req: IndexDocumentsRequest):
+    """Single-writer hop: other processes (the ingestion daemon) queue their chunks on this process's indexer."""
+    docs = [Document(page_content=d["page_content"], metadata=d.get("metadata") or {}) for d in req.documents]
+    try:
+        index_invoice_documents(docs)
+    except WriterLockHeld as e:
+        raise HTTPException(503, str(e))
+    return {"status": "accepted", "documents": len(docs)}
+
 @app.get("/api/download/{filename}")
 def download_report(filename: str):
     """Serves the generated HTML report to the frontend."""
@@ -254,7 +600,7 @@ def list_incoming_files():
 
 # --- NEW: Process Existing File ---
 @app.post("/api/process-existing")
-async def process_existing_file(req: ProcessRequest):
+async def process_existing_file(req: ProcessRequest, defer_report: Optional[bool] = None):
     """Manually trigger workflow for a file already in INCOMING"""
     filename = req.filename
     file_path = INCOMING_DIR / filename
@@ -262,56 +608,49 @@ async def process_existing_file(req: ProcessRequest):
     if not file_path.exists():
         raise HTTPException(404, "File not found in incoming folder")
     
-    print(f" [API] Manually triggering existing file: {filename}")
+    logger.info("Manually triggering existing file: %s", filename)
+    lease = await run_in_threadpool(_claim_or_409, file_path)
     
     try:
         # 1. Run Workflow
-        # We pass the full path so the workflow knows exactly where to find it
-        workflow = build_graph()
-        final_state = workflow.invoke({
+        # We pass the full (leased) path so the workflow knows exactly where to find it
+        deferred = _use_deferred(defer_report)
+        final_state, workflow_id = await run_in_threadpool(run_workflow, {
             "status": "STARTING", 
             "file_name": filename,
-            "file_path": str(file_path) 
-        })
+            "file_path": str(lease.path) 
+        }, defer_report=deferred)
         
-        # 2. Index for RAG
-        if final_state.get("raw_text"):
-            audit = final_state.get("structured_data", {})
-            status = "PASS" if final_state.get("is_valid") else "FAIL"
-            issues = final_state.get("discrepancies", [])
-            
-            context = f"""
-            INVOICE: {filename}
-            STATUS: {status}
-            VENDOR: {audit.get('vendor_name')}
-            ISSUES: {issues}
-            RAW TEXT: {final_state['raw_text']}
-            """
-            index_invoice_text(context, {"source": filename})
+        # 2. Index for RAG (FAILED runs are indexed when resumed)
+        if final_state.get("raw_text") and final_state.get("status") != "FAILED":
+            # Typed chunks (header, line items, discrepancies, verdict) instead of one big blob
+            await run_in_threadpool(index_invoice_documents, chunk_invoice(final_state, filename))
+    except Exception as e:
+        logger.exception("Processing %s failed: %s", filename, e)
+        await run_in_threadpool(lease.finalize, False, FAILED_DIR, error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
 
+    try:
         # 3. Archive File (Move to Processed)
-        destination_path = PROCESSED_DIR / filename
-        if destination_path.exists():
-            timestamp = uuid.uuid4().hex[:8]
-            destination_path = PROCESSED_DIR / f"{timestamp}_{filename}"
-            
-        shutil.move(str(file_path), str(destination_path))
-        print(f" [API] Archived {filename} to processed folder.")
+        await run_in_threadpool(lease.finalize, True, PROCESSED_DIR)
+        logger.info("Archived %s to processed folder.", filename)
 
         return {
             "status": "success",
             "filename": filename,
+            "workflow_id": workflow_id,
+            "profile_id": current_profile_id(),
             "data": final_state.get("structured_data"),
             "validation": {
                 "is_valid": final_state.get("is_valid"),
-                "discrepancies": final_state.get("discrepancies")
+                "discrepancies": final_state.get("discrepancies"),
+                "duplicate_of": final_state.get("duplicate_of")
             },
-            "report_html": final_state.get("final_report_html")
+            **_report_fields(final_state, filename, deferred)
         }
         
     except Exception as e:
-        print(f"Error: {e}")
-        traceback.print_exc()
+        logger.exception("Archiving %s failed: %s", filename, e)
         raise HTTPException(status_code=500, detail=str(e))
     
 
@@ -0,0 +1,70 @@
+"""
+Recall vs latency of the ANN index types against exact (flat) search.
+
+    python -m benchmarks.bench_ann --n 100000 --dim 768 --queries 500 --k 10
+
+Vectors are synthetic and clustered (invoices of the same vendor/template embed
+close together), so recall numbers are closer to production than uniform noise.
+"""
+import argparse
+import time
+import numpy as np
+import faiss
+from rag_agents.ann_index import build_index, INDEX_TYPES
+
+def make_corpus(n: int, dim: int, clusters: int, seed: int = 0):
+    rng = np.random.RandomState(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.randint(0, clusters, size=n)
+    vectors = centers[labels] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors.astype(np.float32)
+
+def run(index, queries: np.ndarray, k: int):
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found[i] = ids[0]
+    return found, np.array(latencies)
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=1, help="FAISS OpenMP threads (1 = per-request latency)")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    corpus = make_corpus(args.n, args.dim, args.clusters)
+    queries = make_corpus(args.queries, args.dim, args.clusters, seed=1)
+    print(f"corpus={args.n} x {args.dim}, queries={args.queries}, k={args.k}\n")
+
+    truth = None
+    print(f"{'index':<8}{'build s':>10}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'MB':>10}")
+    for kind in INDEX_TYPES:
+        start = time.perf_counter()
+        try:
+            index = build_index(corpus, kind)
+        except ValueError as e:
+            print(f"{kind:<8} skipped: {e}")
+            continue
+        build_s = time.perf_counter() - start
+
+        found, lat = run(index, queries, args.k)
+        if truth is None:  # flat runs first and is the exact baseline
+            truth = found
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        print(f"{kind:<8}{build_s:>10.2f}{recall_at_k(found, truth):>10.3f}"
+              f"{np.percentile(lat, 50):>10.3f}{np.percentile(lat, 99):>10.3f}{size_mb:>10.1f}")
+
+if __name__ == "__main__":
+    main()
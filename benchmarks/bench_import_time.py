@@ -0,0 +1,82 @@
+"""
+Cold-start cost of the service entry points, measured with `python -X importtime`.
+
+    python -m benchmarks.bench_import_time backend_api --runs 5 --top 15
+    python -m benchmarks.bench_import_time backend_api --budget-ms 2500   # exit 1 on regression
+
+Every run is a fresh interpreter (the first one only warms the .pyc cache). Besides
+the time budget, the run fails if a module that must stay lazy (LLM / embedding SDKs,
+langfuse, FAISS, OCR models) is imported at startup again.
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Loaded on first use by rag_llms / retrieval_agent / backend_api / the indexing service
+MUST_STAY_LAZY = (
+    "langchain_openai", "langchain_google_genai", "langchain_community",
+    "langfuse", "faiss", "easyocr", "torch",
+)
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def measure(module: str) -> list:
+    """[(module, self_us, cumulative_us, depth)] for one cold import of `module`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BASE_DIR, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+def total_ms(rows: list) -> float:
+    # Top-level entries only (depth 0), so nested imports are not counted twice
+    return sum(cum for name, _, cum, depth in rows if depth == 0) / 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=["backend_api"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest modules to list (cumulative)")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Fail if the median exceeds this")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        measure(module)  # Warm-up: compile .pyc files
+        runs = [measure(module) for _ in range(args.runs)]
+        totals = [total_ms(rows) for rows in runs]
+        median = statistics.median(totals)
+        print(f"{module}: median {median:.0f} ms, min {min(totals):.0f} ms, max {max(totals):.0f} ms "
+              f"({args.runs} runs, {len(runs[-1])} modules)")
+
+        print(f"  {'cumulative ms':>14}{'self ms':>10}  module")
+        for name, self_us, cumulative_us, _ in sorted(runs[-1], key=lambda r: r[2], reverse=True)[:args.top]:
+            print(f"  {cumulative_us / 1000:>14.1f}{self_us / 1000:>10.1f}  {name}")
+
+        imported = {name for name, *_ in runs[-1]}
+        eager = sorted(m for m in MUST_STAY_LAZY if m in imported)
+        if eager:
+            print(f"  FAIL: imported at startup, should be lazy: {', '.join(eager)}")
+            failed = True
+        if args.budget_ms is not None and median > args.budget_ms:
+            print(f"  FAIL: median {median:.0f} ms over budget {args.budget_ms:.0f} ms")
+            failed = True
+        print()
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
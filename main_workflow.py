@@ -1,15 +1,41 @@
-import json
 from langgraph.graph import StateGraph, END
-from typing import TypedDict, List, Dict, Any, Optional
+from typing import TypedDict, List, Dict, Any, Optional, Annotated
 import os
 
 # Import Agents
 from agents.extractor_agent import extractor_node
-from agents.validation_agent import validation_node
+from agents.validation_agent import check_po, check_vendor, check_skus, check_mandatory_fields
 from agents.translation_agent import TranslationAgent
 from agents.reporting_agent import ReportingAgent
 from protocols.a2a import AgentMessage
 from tools.file_watcher import InvoiceWatcherTool
+from tools.file_lease import finalize_path
+from storage.duplicate_index import get_duplicate_index
+from storage.checkpoints import get_checkpointer, new_thread_id, thread_config
+from utils.metrics import timed
+from utils.logger import get_logger, log_payload
+
+logger = get_logger("WORKFLOW")
+
+# "flag": duplicates are reported as a discrepancy but still processed
+# "skip": duplicates stop right after extraction (no translation / report)
+DUPLICATE_POLICY = os.getenv("DUPLICATE_POLICY", "flag").lower()
+
+# --- REDUCERS (parallel validation branches write the same keys) ---
+
+def merge_discrepancies(left, right):
+    """Ordered union of the branches' discrepancies; None resets (start of a validation run)."""
+    if right is None:
+        return []
+    merged = list(left or [])
+    merged.extend(d for d in right if d not in merged)
+    return merged
+
+def merge_results(left, right):
+    """Per-check results keyed by check name; None resets."""
+    if right is None:
+        return {}
+    return {**(left or {}), **right}
 
 # Define Shared Memory
 class InvoiceState(TypedDict):
@@ -17,14 +43,19 @@ class InvoiceState(TypedDict):
     file_name: str
     raw_text: str
     structured_data: Optional[dict]
-    validation_results: Dict[str, Any]
+    validation_results: Annotated[Dict[str, Any], merge_results]
     is_valid: bool
-    discrepancies: List[str]
+    discrepancies: Annotated[List[str], merge_discrepancies]
     final_report_html: str
     status: str
     error_message: str
     is_rerun: bool
     corrected_data: dict
+    duplicate_of: Optional[str]
+    near_duplicate_of: Optional[str]
+    lease_path: Optional[str]
+    failed_node: Optional[str]
+    thread_id: Optional[str]
 
 # --- NODE DEFINITIONS ---
 
@@ -63,19 +94,26 @@ class InvoiceState(TypedDict):
 #     return {"status": "WAITING"}
 
 def monitor_node(state):
-    print(f"\n--- [1] MONITOR NODE ---")
+    logger.info("--- [1] MONITOR NODE ---")
+    # Full path from the ingestion daemon / API: trust it
+    if state.get("file_path"):
+        logger.info("   Using existing path: %s", state['file_path'])
+        return {"status": "PROCESSING"}
+
     # Support for UI-driven file selection
     if state.get("file_name"):
         path = f"data/incoming/{state['file_name']}"
-        print(f"   Targeting File: {path}")
+        logger.info("   Targeting File: %s", path)
         return {"file_path": path, "status": "PROCESSING"}
     
     # Default Watcher logic
+    # Claimed with a lease: run_workflow finalizes it when the run ends (see _finalize_lease)
     res = InvoiceWatcherTool().execute()
     if res["found"]:
         return {
             "file_path": res["file_path"], 
             "file_name": res["file_name"], 
+            "lease_path": res["lease_path"],
             "status": "PROCESSING"
         }
     return {"status": "WAITING"}
@@ -116,16 +154,36 @@ def monitor_node(state):
 #     return {"status": "WAITING"}
 
 def extractor_wrapper(state):
-    # Wrapper to print debug info
-    print(f"\n--- [2] EXTRACTOR NODE ---")
+    # Wrapper to log the stage banner
+    logger.info("--- [2] EXTRACTOR NODE ---")
     return extractor_node(state)
 
+def _run_id(state) -> str:
+    # Duplicate registrations belong to the workflow run, so a re-upload of the same file name still matches
+    return state.get("thread_id") or state.get("file_name")
+
+def dedup_node(state):
+    logger.info("--- [2b] DUPLICATE CHECK ---")
+    if state.get("is_rerun") or not state.get("raw_text"):
+        return {}
+
+    # Near-duplicate check on the OCR text: cheap, and runs before the LLM translation
+    # Only looked up here: the signature is registered in check_duplicate, once the run got that far,
+    # so a run that fails in translation does not make its own re-upload look like a duplicate
+    match = get_duplicate_index().find_near_duplicate(state["raw_text"], run_id=_run_id(state))
+
+    if not match:
+        return {}
+
+    source, score = match
+    logger.warning("   DUPLICATE: %s ~ %s (similarity %.2f)", state.get('file_name'), source, score)
+    if DUPLICATE_POLICY == "skip":
+        return {"status": "FAILED", "duplicate_of": source, "near_duplicate_of": source,
+                "error_message": f"Duplicate of already processed invoice {source} (similarity {score:.2f})"}
+    return {"near_duplicate_of": source}
+
 def translation_node(state):
-    print(f"\n--- [3] TRANSLATOR NODE ---")
-    if state.get("status") == "FAILED": 
-        print("   Skipping (Previous Step Failed)")
-        return {"status": "FAILED"}
-    
+    logger.info("--- [3] TRANSLATOR NODE ---")
     agent = TranslationAgent()
     msg = AgentMessage("orch", "trans", "TRANSLATE_EXTRACT", {"raw_text": state["raw_text"]})
     
@@ -134,49 +192,88 @@ def translation_node(state):
     
     if res.status == "SUCCESS": 
         data = res.payload["structured_data"]
-        print(f"   DATA EXTRACTED:\n{json.dumps(data, indent=2)}") 
+        logger.info("   DATA EXTRACTED: %d fields, %d line items", len(data), len(data.get("line_items") or []))
+        log_payload(logger, "   Structured data for %s", data, state.get("file_name"))
         return {"structured_data": data}
         
-    print(f"   TRANSLATION FAILED: {res.payload}")
+    logger.error("   TRANSLATION FAILED: %s", res.payload)
     return {"status": "FAILED", "error_message": res.payload.get("error")}
 
+# Independent checks, run as parallel branches between "validator" and "validation_join"
+VALIDATION_CHECKS = {
+    "check_po": check_po,
+    "check_vendor": check_vendor,
+    "check_skus": check_skus,
+    "check_mandatory": check_mandatory_fields,
+}
+
 def validation_wrapper(state):
-    print(f"\n--- [4] VALIDATION NODE ---")
-    if state.get("status") == "FAILED": return {"status": "FAILED"}
-    
-    # Run the agent logic
-    result = validation_node(state)
-    
-    print(f"   VALIDATION RESULT: {result}")
+    logger.info("--- [4] VALIDATION NODE ---")
+    if not state.get("structured_data"):
+        return {"status": "FAILED", "error_message": "No Data"}
+    # Fan-out point: clear the previous run's results (reruns) before the branches merge theirs;
+    # duplicate_of is recomputed by check_duplicate from the (possibly corrected) data
+    return {"discrepancies": None, "validation_results": None, "duplicate_of": None}
+
+def duplicate_check_node(state):
+    # Exact duplicate check on (vendor, invoice_no, total), plus any near-duplicate flagged earlier.
+    # A rerun is judged on the human-corrected data alone: the OCR text match no longer applies.
+    data = state.get("structured_data") or {}
+    index = get_duplicate_index()
+    duplicate_of = index.check_exact(
+        data.get("vendor_name"), data.get("invoice_no"), data.get("total_amount"), run_id=_run_id(state))
+    if not duplicate_of and not state.get("is_rerun"):
+        duplicate_of = state.get("near_duplicate_of")
+    if not state.get("is_rerun"):
+        # Registered together: only runs that reached validation count as prior submissions
+        index.register_exact(data.get("vendor_name"), data.get("invoice_no"), data.get("total_amount"),
+                             source=state.get("file_name"), run_id=_run_id(state))
+        if state.get("raw_text"):
+            index.register_text(state["raw_text"], source=state.get("file_name"), run_id=_run_id(state))
+    if duplicate_of:
+        return {"discrepancies": [f"Possible duplicate of invoice {duplicate_of}"], "duplicate_of": duplicate_of,
+                "validation_results": {"duplicate": {"passed": False, "duplicate_of": duplicate_of}}}
+    return {"validation_results": {"duplicate": {"passed": True}}}
+
+def validation_join(state):
+    """Runs once every branch has finished; the reducers already merged their outputs."""
+    discrepancies = state.get("discrepancies") or []
+    result = {"is_valid": not discrepancies}
+    logger.info("   VALIDATION RESULT: %s %s", result, discrepancies)
     return result
 
+def build_report_payload(state) -> dict:
+    """Merges the structured invoice with its validation outcome (input for the ReportingAgent)."""
+    report_data = state["structured_data"].copy()
+    report_data["validation_status"] = "PASS" if state.get("is_valid") else "FAIL"
+    report_data["discrepancies"] = state.get("discrepancies", [])
+    # Passed checks may still carry a warning (e.g. a vendor name that only nearly matches the ERP)
+    report_data["warnings"] = [r["warning"] for r in (state.get("validation_results") or {}).values()
+                               if isinstance(r, dict) and r.get("warning")]
+    report_data["workflow_thread_id"] = state.get("thread_id")
+    return report_data
+
 def reporting_node(state):
-    print(f"\n--- [5] REPORTING NODE ---")
-    if state.get("status") == "FAILED": 
-        print("   Skipping Report (Status is FAILED)")
-        return {"status": "FAILED"}
-        
+    logger.info("--- [5] REPORTING NODE ---")
     data = state.get("structured_data")
     if not data: 
-        print("   CRITICAL: No Data for Reporting")
+        logger.error("   CRITICAL: No Data for Reporting")
         return {"status": "FAILED", "error_message": "No structured data"}
         
     # Merge Full Data with Status
-    report_data = data.copy()
-    report_data["validation_status"] = "PASS" if state.get("is_valid") else "FAIL"
-    report_data["discrepancies"] = state.get("discrepancies", [])
+    report_data = build_report_payload(state)
     
-    print(f"   Sending Full Data to Reporter ({len(str(report_data))} chars)")
+    logger.debug("   Sending Full Data to Reporter (%d fields)", len(report_data))
     
     agent = ReportingAgent()
     msg = AgentMessage("orch", "rep", "GENERATE_REPORT", report_data)
     res = agent.process_message(msg)
     
     if res.status == "SUCCESS":
-        print("   Report Generated Successfully.")
+        logger.info("   Report Generated Successfully.")
         return {"final_report_html": res.payload["report_html"], "status": "COMPLETED"}
         
-    print(f"   REPORTING FAILED: {res.payload}")
+    logger.error("   REPORTING FAILED: %s", res.payload)
     return {"status": "FAILED", "error_message": res.payload.get("error")}
 
 # def reporting_node(state):
@@ -219,23 +316,138 @@ def reporting_node(state):
 #     print(f"   REPORTING FAILED: {res.payload}")
 #     return {"status": "FAILED", "error_message": res.payload.get("error")}
 
+def error_handler_node(state):
+    """Terminal node for failures and for a monitor run that found nothing to do."""
+    logger.info("--- [X] ERROR HANDLER ---")
+    if state.get("status") == "WAITING":
+        logger.info("   Nothing to process.")
+        return {}
+
+    message = state.get("error_message") or "Unknown error"
+    logger.error("   %s failed in '%s': %s", state.get('file_name'), state.get('failed_node', 'unknown'), message)
+    return {"status": "FAILED", "error_message": message}
+
+# --- ROUTING ---
+
+def _tracked(name, node):
+    """Runs a node and records its name as failed_node when it reports FAILED."""
+    def run(state):
+        result = node(state) or {}
+        if result.get("status") == "FAILED":
+            result["failed_node"] = name
+        return result
+    return run
+
+def _timed(name, node):
+    """Latency histogram / in-flight gauge per node, exported at /metrics."""
+    return timed("workflow_node", graph="invoice", node=name)(node)
+
+def route_on_status(state) -> str:
+    """'stop' for FAILED / WAITING (straight to error_handler), 'next' otherwise."""
+    return "stop" if state.get("status") in ("FAILED", "WAITING") else "next"
+
 # --- GRAPH BUILDER ---
 
-def build_graph():
+def build_graph(defer_report: bool = False, checkpointer=None):
+    """
+    defer_report=True stops the graph after validation; the caller hands the
+    result to agents.report_queue so the HTML/JSON is written in the background.
+    Every step routes on its own result, so a failure skips everything downstream.
+    With a checkpointer every step is persisted per thread_id (see resume_workflow).
+    """
     wf = StateGraph(InvoiceState)
     
-    wf.add_node("monitor", monitor_node)
-    wf.add_node("extractor", extractor_wrapper)
-    wf.add_node("translator", translation_node)
-    wf.add_node("validator", validation_wrapper)
-    wf.add_node("reporter", reporting_node)
+    wf.add_node("monitor", _timed("monitor", _tracked("monitor", monitor_node)))
+    wf.add_node("extractor", _timed("extractor", _tracked("extractor", extractor_wrapper)))
+    wf.add_node("dedup", _timed("dedup", _tracked("dedup", dedup_node)))
+    wf.add_node("translator", _timed("translator", _tracked("translator", translation_node)))
+    wf.add_node("validator", _timed("validator", _tracked("validator", validation_wrapper)))
+    for name, check in VALIDATION_CHECKS.items():
+        wf.add_node(name, _timed(name, check))
+    wf.add_node("check_duplicate", _timed("check_duplicate", duplicate_check_node))
+    wf.add_node("validation_join", _timed("validation_join", validation_join))
+    wf.add_node("error_handler", _timed("error_handler", error_handler_node))
     
     wf.set_entry_point("monitor")
+
+    branches = list(VALIDATION_CHECKS) + ["check_duplicate"]
+    steps = ["monitor", "extractor", "dedup", "translator", "validator"]
+    tail = ["validation_join"]
+    if not defer_report:
+        wf.add_node("reporter", _timed("reporter", _tracked("reporter", reporting_node)))
+        tail.append("reporter")
+
+    for current, following in zip(steps, steps[1:]):
+        wf.add_conditional_edges(current, route_on_status, {"next": following, "stop": "error_handler"})
+    # Fan-out: all checks run in the same step (in parallel); fan-in: validation_join waits for every branch
+    wf.add_conditional_edges(
+        "validator",
+        lambda state: branches if route_on_status(state) == "next" else "error_handler",
+        branches + ["error_handler"],
+    )
+    wf.add_edge(branches, "validation_join")
+    for current, following in zip(tail, tail[1:] + [END]):
+        wf.add_conditional_edges(current, route_on_status, {"next": following, "stop": "error_handler"})
+    wf.add_edge("error_handler", END)
     
-    wf.add_edge("monitor", "extractor")
-    wf.add_edge("extractor", "translator")
-    wf.add_edge("translator", "validator")
-    wf.add_edge("validator", "reporter")
-    wf.add_edge("reporter", END)
-    
-    return wf.compile()
\ No newline at end of file
+    return wf.compile(checkpointer=checkpointer)
+
+# --- CHECKPOINTED RUNS ---
+
+# Node whose outgoing edge leads to the given node: resuming "from X" replays that edge
+RESUME_AFTER = {
+    "extractor": "monitor",
+    "dedup": "extractor",
+    "translator": "dedup",
+    "validator": "translator",
+    "reporter": "validation_join",
+}
+
+def _finalize_lease(lease_path: str, error: str = None):
+    """Archives a file the monitor node's watcher claimed (callers with their own lease pass file_path)."""
+    try:
+        watcher = InvoiceWatcherTool()
+        if error:
+            finalize_path(lease_path, False, watcher.failed_path, error=error)
+        else:
+            finalize_path(lease_path, True, watcher.process_path)
+    except FileNotFoundError:
+        logger.warning("Lease %s was already finalized or reclaimed", lease_path)
+
+def run_workflow(initial_state: dict, defer_report: bool = False, thread_id: str = None, **config):
+    """Runs the graph with checkpointing; returns (final_state, thread_id)."""
+    thread_id = thread_id or new_thread_id(initial_state.get("file_name") or "invoice")
+    workflow = build_graph(defer_report=defer_report, checkpointer=get_checkpointer())
+    run_config = thread_config(thread_id, **config)
+    try:
+        final_state = workflow.invoke({**initial_state, "thread_id": thread_id}, config=run_config)
+    except Exception as e:
+        lease_path = workflow.get_state(run_config).values.get("lease_path")
+        if lease_path:
+            _finalize_lease(lease_path, error=str(e))
+        raise
+    if final_state.get("lease_path"):
+        _finalize_lease(final_state["lease_path"])
+    return final_state, thread_id
+
+def resume_workflow(thread_id: str, from_node: str = None, updates: dict = None, defer_report: bool = True):
+    """
+    Continues a checkpointed run without repeating earlier steps.
+    from_node defaults to the node that failed; updates (e.g. human-corrected
+    structured_data) are written into the state before resuming. With from_node
+    and updates, an unknown thread is seeded from the updates alone.
+    """
+    workflow = build_graph(defer_report=defer_report, checkpointer=get_checkpointer())
+    config = thread_config(thread_id)
+    snapshot = workflow.get_state(config)
+    if not snapshot.values and not (from_node and updates):
+        raise KeyError(f"No checkpoint for thread {thread_id}")
+
+    from_node = from_node or snapshot.values.get("failed_node")
+    if from_node not in RESUME_AFTER:
+        raise ValueError(f"Cannot resume from node: {from_node}")
+
+    logger.info("--- RESUMING %s FROM [%s] ---", thread_id, from_node)
+    patch = {"status": "PROCESSING", "error_message": None, "failed_node": None, **(updates or {})}
+    workflow.update_state(config, patch, as_node=RESUME_AFTER[from_node])
+    return workflow.invoke(None, config=config)
\ No newline at end of file
@@ -2,6 +2,7 @@ from fastapi import FastAPI, HTTPException
 import json
 import os
 from typing import Optional
+from utils.vendors import normalize_vendor_name
 
 app = FastAPI(title="Mock ERP System")
 
@@ -23,6 +24,17 @@ def load_data(filepath):
 def health_check():
     return {"status": "ERP System Online", "version": "1.0"}
 
+@app.get("/api/v1/vendors")
+def find_vendor(name: str):
+    """Lookup by name (invoices carry the vendor name, not our vendor id)"""
+    vendors = load_data(VENDORS_FILE)
+    # Case, punctuation, accents and the legal form do not count: "Global Logistics Limited" matches
+    wanted = normalize_vendor_name(name)
+    vendor = next((v for v in vendors if normalize_vendor_name(v["vendor_name"]) == wanted), None)
+    if not vendor:
+        raise HTTPException(status_code=404, detail="Vendor not found")
+    return vendor
+
 @app.get("/api/v1/vendors/{vendor_id}")
 def get_vendor(vendor_id: str):
     vendors = load_data(VENDORS_FILE)
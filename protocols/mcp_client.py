@@ -1,9 +1,8 @@
 import asyncio
 import json
 import nest_asyncio 
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.sse import sse_client
 from utils.logger import get_logger
+from utils.metrics import timed
 
 # Apply the patch immediately
 nest_asyncio.apply()
@@ -14,27 +13,32 @@ async def call_remote_mcp(port: int, tool_name: str, arguments: dict):
     """
     Connects to a FastMCP server via SSE and calls a tool.
     """
+    # The MCP SDK (httpx, pydantic models, anyio) is loaded on the first call, not at import
+    from mcp import ClientSession
+    from mcp.client.sse import sse_client
+
     url = f"http://127.0.0.1:{port}/sse"
-    logger.debug(f"Attempting connection to {url} for tool '{tool_name}'")
+    logger.debug("Attempting connection to %s for tool '%s'", url, tool_name)
     
     try:
-        async with sse_client(url) as (read, write):
-            async with ClientSession(read, write) as session:
-                await session.initialize()
+        with timed("mcp_call", port=port, tool=tool_name):
+            async with sse_client(url) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
                 
-                logger.info(f"Calling Tool: {tool_name}")
-                result = await session.call_tool(tool_name, arguments)
+                    logger.info("Calling Tool: %s", tool_name)
+                    result = await session.call_tool(tool_name, arguments)
                 
-                # Extract Text Content
-                if result.content and len(result.content) > 0:
-                    response = result.content[0].text
-                    return response
+                    # Extract Text Content
+                    if result.content and len(result.content) > 0:
+                        response = result.content[0].text
+                        return response
                 
-                logger.warning(f"Port {port} returned Empty Content")
-                return None
+                    logger.warning("Port %s returned Empty Content", port)
+                    return None
                 
     except Exception as e:
-        logger.error(f"CONNECTION ERROR (Port {port}): {str(e)}")
+        logger.error("CONNECTION ERROR (Port %s): %s", port, e)
         # Return a JSON error string so the caller can parse it gracefully
         return json.dumps({"status": "error", "message": f"Connection Failed: {str(e)}"})
 
@@ -0,0 +1,100 @@
+import math
+import os
+import numpy as np
+
+# Corpus-size thresholds for the automatic index choice (override with VECTOR_INDEX_TYPE)
+FLAT_MAX_VECTORS = int(os.getenv("VECTOR_FLAT_MAX", "20000"))
+HNSW_MAX_VECTORS = int(os.getenv("VECTOR_HNSW_MAX", "1000000"))
+
+# Build / search knobs
+HNSW_M = int(os.getenv("VECTOR_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("VECTOR_HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "16"))
+PQ_NBITS = 8
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+
+def choose_index_type(n_vectors: int) -> str:
+    """Exact search while it is cheap, graph search in the middle, compressed IVF-PQ for very large corpora."""
+    forced = os.getenv("VECTOR_INDEX_TYPE")
+    if forced in INDEX_TYPES:
+        return forced
+    if n_vectors <= FLAT_MAX_VECTORS:
+        return "flat"
+    if n_vectors <= HNSW_MAX_VECTORS:
+        return "hnsw"
+    return "ivfpq"
+
+def index_type_of(index) -> str:
+    import faiss
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivfpq"
+    return "flat"
+
+def _pq_subquantizers(dim: int) -> int:
+    # Largest divisor of dim giving sub-vectors of at least 4 dims, capped at 64 codes per vector
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2, 1):
+        if dim % m == 0 and dim // m >= 4:
+            return m
+    return 1
+
+def build_index(vectors: np.ndarray, kind: str):
+    """
+    Builds (and trains, for IVF-PQ) a FAISS index over float32 vectors, L2 metric
+    like the default langchain FAISS store, and adds the vectors in order.
+    """
+    import faiss
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif kind == "ivfpq":
+        # ~4*sqrt(n) lists, but keep >= 39 training points per list as FAISS recommends
+        nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))
+        if n < 256 * 4 or nlist < 2:
+            raise ValueError(f"Too few vectors ({n}) to train IVF-PQ")
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_subquantizers(dim), PQ_NBITS)
+        sample = vectors[np.random.RandomState(0).choice(n, min(n, nlist * 256), replace=False)]
+        index.train(sample)
+    else:
+        index = faiss.IndexFlatL2(dim)
+
+    index.add(vectors)
+    tune_search(index)
+    return index
+
+def tune_search(index):
+    """Applies the query-time accuracy/speed knobs (not all are persisted by write_index)."""
+    import faiss
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = IVF_NPROBE
+    return index
+
+def rebuild_store(store, embeddings, kind: str = None):
+    """
+    Re-creates a langchain FAISS store with the requested (or size-appropriate) index type.
+    Vectors come from the embedding function, which is the persistent cache for every
+    document already indexed, so a rebuild costs no upstream embedding calls.
+    """
+    from langchain_community.vectorstores import FAISS
+    n = store.index.ntotal
+    kind = kind or choose_index_type(n)
+    ids = [store.index_to_docstore_id[i] for i in range(n)]
+    texts = [store.docstore.search(doc_id).page_content for doc_id in ids]
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+    index = build_index(vectors, kind)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=store.docstore,
+        index_to_docstore_id=dict(store.index_to_docstore_id),
+    )
@@ -0,0 +1,182 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from utils.metrics import timed
+
+CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+class CachedEmbeddings(Embeddings):
+    """
+    Persistent embedding cache in front of any LangChain Embeddings.
+
+    Layout per model (embedding_cache/<model>/):
+      vectors.f32  -> float32 rows appended back to back, read through np.memmap
+      index.tsv    -> "<sha256(kind, text)>\\t<row>" lines, the offset index
+      meta.json    -> {"model": ..., "dim": ...}
+      write.lock   -> flock held while appending (the API and the daemon share the files)
+
+    Only cache misses are sent upstream, de-duplicated and in batches.
+    Query and document vectors are cached separately because some providers
+    (Gemini among them) embed them with different task types.
+    """
+    def __init__(self, inner: Embeddings, model_name: str, cache_dir: str = CACHE_DIR,
+                 batch_size: int = EMBED_BATCH_SIZE):
+        self.inner = inner
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.dir = Path(cache_dir) / re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.dir / "vectors.f32"
+        self.index_path = self.dir / "index.tsv"
+        self.meta_path = self.dir / "meta.json"
+        self.lock_path = self.dir / "write.lock"
+
+        self._lock = threading.Lock()
+        self._offsets = {}
+        self._dim = None
+        self._mmap = None
+        self._mapped_rows = 0
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    # --- LangChain Embeddings interface ---
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_batch(texts, kind="doc")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_batch([text], kind="query")[0]
+
+    # --- Batch API ---
+
+    def embed_batch(self, texts: List[str], kind: str = "doc") -> List[List[float]]:
+        """Returns one vector per text; only texts not already cached are embedded upstream."""
+        keys = [self._key(kind, t) for t in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._offsets and key not in missing:
+                missing[key] = text
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            miss_keys = list(missing)
+            for i in range(0, len(miss_keys), self.batch_size):
+                chunk = miss_keys[i:i + self.batch_size]
+                chunk_texts = [missing[k] for k in chunk]
+                with timed("embedding_call", kind=kind):
+                    if kind == "query":
+                        vectors = [self.inner.embed_query(t) for t in chunk_texts]
+                    else:
+                        vectors = self.inner.embed_documents(chunk_texts)
+                self._append(chunk, vectors)
+
+        return [self._row(self._offsets[k]).tolist() for k in keys]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "entries": len(self._offsets),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+    # --- Storage ---
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def _file_lock(self):
+        # Cross-process: row numbers come from the file size, so appends must not interleave
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _read_dim(self):
+        if self._dim is None and self.meta_path.exists():
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self._dim = json.load(f)["dim"]
+
+    def _load(self):
+        with self._file_lock():
+            self._read_dim()
+            if not self._dim or not self.index_path.exists():
+                return
+            self._repair()
+
+    def _repair(self):
+        """
+        Crash recovery, under the file lock: cuts a torn trailing row off vectors.f32 and
+        rewrites index.tsv without torn lines or rows past the end. Otherwise the next
+        append would reuse those row numbers and the stale lines would point at new vectors.
+        """
+        row_bytes = 4 * self._dim
+        size = self.vectors_path.stat().st_size if self.vectors_path.exists() else 0
+        if size % row_bytes:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(size - size % row_bytes)
+        rows_on_disk = size // row_bytes
+
+        kept, dropped = [], 0
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if (line.endswith("\n") and len(parts) == 2 and parts[1].isdigit()
+                        and int(parts[1]) < rows_on_disk):
+                    self._offsets[parts[0]] = int(parts[1])
+                    kept.append(line)
+                else:
+                    dropped += 1
+        if dropped:
+            tmp = self.index_path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(kept)
+            os.replace(tmp, self.index_path)
+
+    def _append(self, keys: list, vectors: list):
+        arr = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            self._read_dim()  # Another process may have created the cache meanwhile
+            if self._dim is None:
+                self._dim = arr.shape[1]
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "dim": self._dim}, f)
+
+            # Vectors first, then the index lines pointing at them
+            row_bytes = 4 * self._dim
+            with open(self.vectors_path, "ab") as f:
+                size = f.tell()
+                if size % row_bytes:  # Torn row from a writer that crashed mid-append
+                    f.truncate(size - size % row_bytes)
+                first_row = size // row_bytes
+                f.write(arr.tobytes())
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                for i, key in enumerate(keys):
+                    f.write(f"{key}\t{first_row + i}\n")
+            for i, key in enumerate(keys):
+                self._offsets[key] = first_row + i
+
+    def _row(self, row: int) -> np.ndarray:
+        if row >= self._mapped_rows:
+            with self._lock:
+                rows = self.vectors_path.stat().st_size // (4 * self._dim)
+                self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dim))
+                self._mapped_rows = rows
+        return self._mmap[row]
@@ -1,12 +1,16 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from rag_agents.rag_llms import rag_llm
+from rag_agents.rag_llms import get_rag_llm
+from utils.metrics import timed
+from utils.logger import get_logger
+
+logger = get_logger("RAG_GENERATION")
 
 def generation_node(state: dict) -> dict:
     """
     Generates an answer using the retrieved context.
     """
-    print(" [RAG] Generator: Drafting answer...")
+    logger.info("Generator: Drafting answer...")
     
     question = state["question"]
     context = state.get("context_text", "")
@@ -30,7 +34,8 @@ def generation_node(state: dict) -> dict:
         ANSWER:"""
     )
     
-    chain = prompt | rag_llm | StrOutputParser()
-    answer = chain.invoke({"context": context, "question": question})
+    chain = prompt | get_rag_llm() | StrOutputParser()
+    with timed("llm_call", agent="generation"):
+        answer = chain.invoke({"context": context, "question": question})
     
     return {"answer": answer}
\ No newline at end of file
@@ -0,0 +1,307 @@
+import calendar
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Optional
+import numpy as np
+from utils.dates import normalize_date
+from utils.metrics import timed
+from utils.vendors import normalize_vendor_name, vendor_tokens
+
+# Fusion of the lexical and vector rankings: "rrf" (reciprocal rank), "weighted"
+# (normalized score blend, RAG_HYBRID_ALPHA = vector weight), "vector" or "bm25" only.
+FUSION = os.getenv("RAG_FUSION", "rrf").lower()
+HYBRID_ALPHA = float(os.getenv("RAG_HYBRID_ALPHA", "0.5"))
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+_FILE_RE = re.compile(r"[\w.-]+\.(?:pdf|png|jpe?g|tiff?|txt)\b", re.IGNORECASE)
+_STOPWORDS = {"the", "a", "an", "of", "for", "from", "to", "in", "on", "and", "or", "is", "are",
+              "was", "were", "what", "which", "show", "me", "all", "any", "did", "do", "does",
+              "with", "by", "invoice", "invoices", "last", "this", "month", "week", "year"}
+
+def tokenize(text: str) -> list:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+class LexicalIndex:
+    """
+    BM25 inverted index plus metadata indexes over the documents of one FAISS store.
+    Synced incrementally: versions only ever append documents (rebuilds keep the ids).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.postings = defaultdict(dict)   # term -> {doc_id: tf}
+        self.doc_len = {}
+        self.total_len = 0
+        self.meta = {}                      # doc_id -> metadata
+        self.rows = {}                      # doc_id -> FAISS row
+        self.by_status = defaultdict(set)
+        self.by_source = defaultdict(set)
+        self.by_vendor = defaultdict(set)   # lower-cased vendor -> doc ids
+        self.vendor_names = {}              # lower-cased vendor -> display name
+
+    def sync(self, store):
+        with self._lock:
+            for row, doc_id in store.index_to_docstore_id.items():
+                if doc_id in self.doc_len:
+                    self.rows[doc_id] = row
+                    continue
+                doc = store.docstore.search(doc_id)
+                if not hasattr(doc, "page_content"):
+                    continue
+                self._add(doc_id, row, doc)
+
+    def _add(self, doc_id, row, doc):
+        tokens = tokenize(doc.page_content)
+        for term, tf in Counter(tokens).items():
+            self.postings[term][doc_id] = tf
+        self.doc_len[doc_id] = len(tokens)
+        self.total_len += len(tokens)
+        self.rows[doc_id] = row
+        meta = doc.metadata or {}
+        self.meta[doc_id] = meta
+        if meta.get("source"):
+            self.by_source[str(meta["source"]).lower()].add(doc_id)
+        if meta.get("status"):
+            self.by_status[str(meta["status"]).upper()].add(doc_id)
+        if meta.get("vendor_name"):
+            key = str(meta["vendor_name"]).strip().lower()
+            self.by_vendor[key].add(doc_id)
+            self.vendor_names[key] = meta["vendor_name"]
+
+    # --- Metadata pre-filter ---
+
+    def allowed_ids(self, filters: dict) -> Optional[set]:
+        """Doc ids matching every filter; None means no filter was requested."""
+        if not filters:
+            return None
+        allowed = None
+        if filters.get("sources"):
+            allowed = set().union(*(self.by_source.get(s, set()) for s in filters["sources"]))
+        if filters.get("status"):
+            ids = self.by_status.get(filters["status"], set())
+            allowed = set(ids) if allowed is None else allowed & ids
+        if filters.get("vendors"):
+            ids = set().union(*(self.by_vendor.get(v, set()) for v in filters["vendors"]))
+            allowed = ids if allowed is None else allowed & ids
+        if filters.get("date_from") or filters.get("date_to"):
+            pool = allowed if allowed is not None else self.meta.keys()
+            allowed = {d for d in pool if _in_range(self.meta[d], filters.get("date_from"), filters.get("date_to"))}
+        return allowed
+
+    # --- BM25 ---
+
+    @timed("bm25_search")
+    def bm25(self, query: str, k: int, allowed: Optional[set] = None) -> list:
+        n_docs = len(self.doc_len)
+        if not n_docs:
+            return []
+        avgdl = self.total_len / n_docs
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[doc_id] / avgdl)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / norm
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+def _in_range(meta: dict, date_from: Optional[str], date_to: Optional[str]) -> bool:
+    # Chunks indexed before invoice_date was normalized may still hold e.g. "15.03.2024"
+    value = normalize_date(meta.get("invoice_date")) or str(meta.get("processed_at") or "")[:10]
+    if not value:
+        return False
+    if date_from and value < date_from:
+        return False
+    if date_to and value > date_to:
+        return False
+    return True
+
+def vector_search(store, lexical: LexicalIndex, query_vector, k: int, allowed: Optional[set] = None) -> list:
+    """
+    [(doc_id, L2 distance)]. With a pre-filter, FAISS only visits the allowed rows
+    (IDSelector) instead of post-filtering a larger candidate list.
+    """
+    import faiss
+    q = np.asarray([query_vector], dtype=np.float32)
+    if allowed is not None:
+        if not allowed:
+            return []
+        ids = np.fromiter((lexical.rows[d] for d in allowed if d in lexical.rows), dtype=np.int64)
+        params = _search_params(store.index, faiss.IDSelectorBatch(ids))
+        with timed("faiss_op", op="filtered_search"):
+            distances, rows = store.index.search(q, min(k, len(ids)), params=params)
+    else:
+        with timed("faiss_op", op="search"):
+            distances, rows = store.index.search(q, k)
+    return [(store.index_to_docstore_id[int(r)], float(dist))
+            for r, dist in zip(rows[0], distances[0]) if r != -1]
+
+def _search_params(index, selector):
+    import faiss
+    if isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    elif isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    params.sel_ref = selector  # Keep the selector alive for the duration of the call
+    return params
+
+def fuse(vector_hits: list, bm25_hits: list, k: int, mode: str = FUSION) -> list:
+    """Merges [(doc_id, distance)] and [(doc_id, bm25)] into [(doc_id, score)], higher is better."""
+    scores = defaultdict(float)
+    if mode == "vector":
+        return [(d, 1 / (1 + dist)) for d, dist in vector_hits][:k]
+    if mode == "bm25":
+        return bm25_hits[:k]
+    if mode == "weighted":
+        top_bm25 = max((s for _, s in bm25_hits), default=0) or 1
+        for d, dist in vector_hits:
+            scores[d] += HYBRID_ALPHA * (1 / (1 + dist))
+        for d, s in bm25_hits:
+            scores[d] += (1 - HYBRID_ALPHA) * (s / top_bm25)
+    else:
+        for rank, (d, _) in enumerate(vector_hits):
+            scores[d] += 1 / (RRF_K + rank + 1)
+        for rank, (d, _) in enumerate(bm25_hits):
+            scores[d] += 1 / (RRF_K + rank + 1)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+# --- Query understanding for pre-filters ---
+
+def parse_filters(question: str, vendor_names: dict, today: date = None) -> dict:
+    """
+    Cheap, deterministic extraction of metadata filters from the question:
+    source file name, status (failed/passed), vendor (matched against indexed vendor
+    names) and a date range.
+    """
+    q = question.lower()
+    today = today or date.today()
+    filters = {}
+
+    sources = [m.lower() for m in _FILE_RE.findall(question)]
+    if sources:
+        filters["sources"] = sources
+
+    status = _parse_status(q)
+    if status:
+        filters["status"] = status
+
+    vendors = _match_vendors(q, vendor_names)
+    if vendors:
+        filters["vendors"] = vendors
+
+    date_range = _parse_date_range(q, today)
+    if date_range:
+        filters["date_from"], filters["date_to"] = date_range
+    return filters
+
+# Only an outcome tied to the invoices being asked about is a filter: "failed invoices",
+# "invoices that were rejected". "Is this invoice valid?" asks about one invoice's verdict.
+_STATUS_WORDS = {
+    "FAIL": r"fail(ed|ing)?|reject(ed)?|invalid",
+    "PASS": r"pass(ed|ing)?|approved|valid",
+}
+_STATUS_BEFORE = r"\b({words})\s+(?:\w+\s+){{0,2}}?invoices?\b"  # "failed (HafenLogistik) invoices"
+_STATUS_AFTER = r"\binvoices\b[^?.!]{{0,40}}?\b({words})\b"     # "invoices (that were) rejected"
+
+def _parse_status(q: str) -> Optional[str]:
+    for status, words in _STATUS_WORDS.items():
+        if re.search(_STATUS_BEFORE.format(words=words), q) or re.search(_STATUS_AFTER.format(words=words), q):
+            return status
+    return None
+
+# Generic trade words are part of a vendor's full name but never identify it on their own
+# ("global spend", "transporte"); legal forms are dropped by normalize_vendor_name()
+_GENERIC_WORDS = {
+    "the", "global", "international", "logistics", "logistik", "transport", "transporte", "transportes",
+    "shipping", "freight", "trading", "services", "solutions", "group", "holding", "industries",
+}
+
+def _match_vendors(q: str, vendor_names: dict) -> list:
+    """
+    Vendor keys named in the question: by the full name without punctuation and legal form
+    ("global logistics" for "Global Logistics Ltd."), or by a distinctive word of the name
+    that no other vendor shares ("hafenlogistik").
+    """
+    words = vendor_tokens(q)
+    plain_q = f" {' '.join(words)} "
+    names = {key: normalize_vendor_name(key).split() for key in vendor_names}
+    owners = defaultdict(set)
+    for key, tokens in names.items():
+        for w in tokens:
+            owners[w].add(key)
+    vendors = []
+    for key, tokens in names.items():
+        if tokens and f" {' '.join(tokens)} " in plain_q:
+            vendors.append(key)
+        elif any(len(w) > 3 and w not in _GENERIC_WORDS and owners[w] == {key} and w in words for w in tokens):
+            vendors.append(key)
+    return vendors
+
+def describe_filters(filters: dict) -> str:
+    """Human-readable summary of parse_filters() output, e.g. "vendor hafenlogistik gmbh, status FAIL"."""
+    parts = []
+    if filters.get("vendors"):
+        parts.append("vendor " + " or ".join(filters["vendors"]))
+    if filters.get("status"):
+        parts.append(f"status {filters['status']}")
+    if filters.get("date_from") or filters.get("date_to"):
+        parts.append(f"date {filters.get('date_from') or '...'} to {filters.get('date_to') or '...'}")
+    if filters.get("sources"):
+        parts.append("file " + " or ".join(filters["sources"]))
+    return ", ".join(parts)
+
+def _parse_date_range(q: str, today: date):
+    if "today" in q:
+        return today.isoformat(), today.isoformat()
+    if "yesterday" in q:
+        d = today - timedelta(days=1)
+        return d.isoformat(), d.isoformat()
+    if "this week" in q:
+        start = today - timedelta(days=today.weekday())
+        return start.isoformat(), today.isoformat()
+    if "last week" in q:
+        start = today - timedelta(days=today.weekday() + 7)
+        return start.isoformat(), (start + timedelta(days=6)).isoformat()
+    if "this month" in q:
+        return today.replace(day=1).isoformat(), today.isoformat()
+    if "last month" in q:
+        end = today.replace(day=1) - timedelta(days=1)
+        return end.replace(day=1).isoformat(), end.isoformat()
+    if "this year" in q:
+        return f"{today.year}-01-01", today.isoformat()
+    m = re.search(r"\b(\d{4})-(\d{2})\b", q)
+    if m:
+        year, month = int(m.group(1)), int(m.group(2))
+        if 1 <= month <= 12:
+            return _month_range(year, month)
+    for i, name in enumerate(calendar.month_name):
+        if i and re.search(rf"\b{name.lower()}\b", q):
+            y = re.search(r"\b(20\d{2})\b", q)
+            return _month_range(int(y.group(1)) if y else today.year, i)
+    return None
+
+def _month_range(year: int, month: int):
+    last = calendar.monthrange(year, month)[1]
+    return f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last}"
+
+def months_in_range(date_from: str, date_to: str) -> list:
+    """YYYY-MM keys covered by a date range (for month-sharded stores)."""
+    start = datetime.strptime(date_from[:7], "%Y-%m")
+    end = datetime.strptime(date_to[:7], "%Y-%m")
+    keys = []
+    while start <= end:
+        keys.append(start.strftime("%Y-%m"))
+        start = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return keys
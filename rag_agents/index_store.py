@@ -0,0 +1,113 @@
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Optional
+from utils.dates import normalize_date
+
+# On-disk layout of the vector store:
+#   faiss_index/
+#     CURRENT          -> {"version": 12, "path": "v000012", "last_seq": 345}
+#     v000012/         -> index.faiss + index.pkl (immutable once published)
+#     wal.jsonl        -> documents accepted but not yet in a published version
+#     writer.lock      -> flock held by the one process allowed to write this directory
+#     shards/<key>/    -> same layout per shard when VECTOR_SHARD_BY is set
+# Older installs have index.faiss directly in faiss_index/; that is read as version 0.
+DB_PATH = "faiss_index"
+MANIFEST_NAME = "CURRENT"
+WAL_NAME = "wal.jsonl"
+WRITER_LOCK_NAME = "writer.lock"
+SHARDS_DIR = "shards"
+KEEP_VERSIONS = 2
+
+# "" (single index), "month" (invoice_date YYYY-MM) or "tenant" (metadata["tenant"])
+SHARD_BY = os.getenv("VECTOR_SHARD_BY", "").lower()
+# Month shard of invoices whose date could not be read; every month-pruned search includes it
+UNKNOWN_MONTH_SHARD = "unknown"
+
+def shard_key(metadata: dict, mode: str = SHARD_BY) -> str:
+    """Shard a document belongs to, derived from its metadata."""
+    if mode == "month":
+        date = normalize_date(metadata.get("invoice_date"))
+        return date[:7] if date else UNKNOWN_MONTH_SHARD
+    if mode == "tenant":
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", str(metadata.get("tenant") or "default"))
+    return ""
+
+def shard_path(db_path: str, key: str) -> str:
+    return str(Path(db_path) / SHARDS_DIR / key) if key else db_path
+
+def list_shards(db_path: str = DB_PATH) -> list:
+    root = Path(db_path) / SHARDS_DIR
+    return sorted(p.name for p in root.iterdir() if p.is_dir()) if root.exists() else []
+
+def read_manifest(db_path: str = DB_PATH) -> dict:
+    """Returns the published manifest, or a version-0 manifest for the legacy flat layout."""
+    path = Path(db_path) / MANIFEST_NAME
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"version": 0, "path": ".", "last_seq": 0}
+
+def current_index_dir(db_path: str = DB_PATH) -> Optional[Path]:
+    """Directory holding the index.faiss/index.pkl of the published version (None if empty)."""
+    manifest = read_manifest(db_path)
+    index_dir = Path(db_path) / manifest["path"]
+    return index_dir if (index_dir / "index.faiss").exists() else None
+
+class WriterLockHeld(RuntimeError):
+    """Another process already owns the index directory for writing."""
+
+def acquire_writer_lock(db_path: str = DB_PATH):
+    """
+    Exclusive, non-blocking flock on <db_path>/writer.lock, held until the returned
+    file object is closed or the process exits (the kernel drops it on a crash).
+    Only the holder may append to the WAL and publish versions.
+    """
+    import fcntl
+    Path(db_path).mkdir(parents=True, exist_ok=True)
+    f = open(Path(db_path) / WRITER_LOCK_NAME, "a+")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.seek(0)
+        owner = f.read().strip() or "unknown"
+        f.close()
+        raise WriterLockHeld(f"{db_path} is already being written by {owner}")
+    f.seek(0)
+    f.truncate()
+    f.write(f"pid {os.getpid()}\n")
+    f.flush()
+    return f
+
+def publish_version(db_path: str, staged_dir: Path, last_seq: int, missing_seqs: list = None) -> dict:
+    """
+    Promotes a fully written staging directory to the next version.
+    The manifest is swapped with os.replace, so readers see either the old or
+    the new version and never a half-written index. Callers hold the writer lock,
+    so reading the version and writing version + 1 cannot race another process.
+    missing_seqs: WAL entries at or below last_seq that are not in this version
+    (failed batches still being retried); they are replayed after a restart.
+    """
+    db = Path(db_path)
+    version = read_manifest(db_path)["version"] + 1
+    name = f"v{version:06d}"
+    os.replace(staged_dir, db / name)
+
+    manifest = {"version": version, "path": name, "last_seq": last_seq, "missing_seqs": sorted(missing_seqs or [])}
+    tmp = db / (MANIFEST_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, db / MANIFEST_NAME)
+
+    _prune_versions(db, keep=KEEP_VERSIONS)
+    return manifest
+
+def _prune_versions(db: Path, keep: int):
+    versions = sorted(p for p in db.glob("v[0-9]*") if p.is_dir())
+    for old in versions[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)
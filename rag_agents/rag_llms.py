@@ -1,6 +1,5 @@
 import os
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,8 +12,10 @@ def get_llm(temperature=0.0):
     openai_key = os.getenv("OPENAI_API_KEY")
     gemini_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
 
+    # Provider SDKs are imported here: loading them costs seconds, and only the chosen one is needed
     # Priority 1: Use OpenAI if available (Robust for RAG)
     if openai_key:
+        from langchain_openai import ChatOpenAI
         return ChatOpenAI(
             model="gpt-4o-mini", # Cost-effective standard
             temperature=temperature,
@@ -23,6 +24,7 @@ def get_llm(temperature=0.0):
     
     # Priority 2: Use Google Gemini
     elif gemini_key:
+        from langchain_google_genai import ChatGoogleGenerativeAI
         return ChatGoogleGenerativeAI(
             model="gemini-2.0-flash",
             temperature=temperature,
@@ -32,14 +34,28 @@ def get_llm(temperature=0.0):
     else:
         raise ValueError("CRITICAL: No API keys found in .env for RAG Agents.")
 
-# Initialize standard instances for the agents to import
-# 1. The Generator (Answers questions)
-rag_llm = get_llm(temperature=0.0)
+# Standard instances for the agents, built on first use (not at import: missing API keys
+# only fail the RAG endpoints, and the API process starts without loading the SDKs)
+_llms = {}
+_llm_lock = threading.Lock()
 
-# 2. The Reflector (Critics the answer - needs to be strict)
-reflection_llm = get_llm(temperature=0.0)
+def _shared_llm(role: str, temperature: float):
+    llm = _llms.get(role)
+    if llm is None:
+        with _llm_lock:
+            llm = _llms.get(role)
+            if llm is None:
+                llm = _llms[role] = get_llm(temperature=temperature)
+    return llm
 
-# 3. The Rephraser (Chat history context)
-rephrase_llm = get_llm(temperature=0.5)
+def get_rag_llm():
+    """The Generator (Answers questions)"""
+    return _shared_llm("rag", 0.0)
 
-# print(f" [RAG Init] LLMs Initialized using: {rag_llm.model_name or 'Default Model'}")
\ No newline at end of file
+def get_reflection_llm():
+    """The Reflector (Critics the answer - needs to be strict)"""
+    return _shared_llm("reflection", 0.0)
+
+def get_rephrase_llm():
+    """The Rephraser (Chat history context)"""
+    return _shared_llm("rephrase", 0.5)
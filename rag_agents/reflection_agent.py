@@ -1,13 +1,43 @@
 import json
+import os
+import random
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from rag_agents.rag_llms import reflection_llm
+from rag_agents.rag_llms import get_reflection_llm
+from utils.metrics import timed
+from utils.logger import get_logger
+
+logger = get_logger("RAG_REFLECTION")
+
+# "adaptive": grade only low-confidence retrievals plus a random sample of the rest; "always": grade every answer
+REFLECTION_MODE = os.getenv("RAG_REFLECTION_MODE", "adaptive").lower()
+REFLECTION_SAMPLE_RATE = float(os.getenv("RAG_REFLECTION_SAMPLE_RATE", "0.2"))
+# Top retrieval cosine similarity below which the answer is always graded
+REFLECTION_MIN_SIMILARITY = float(os.getenv("RAG_REFLECTION_MIN_SIMILARITY", "0.75"))
+
+reflection_stats = {"graded": 0, "skipped": 0}
+
+def needs_reflection(state: dict) -> bool:
+    if REFLECTION_MODE == "always":
+        return True
+    similarity = state.get("retrieval_similarity")
+    if not state.get("context") or similarity is None or similarity < REFLECTION_MIN_SIMILARITY:
+        return True  # Weak or lexical-only grounding: this is where hallucinations happen
+    return random.random() < REFLECTION_SAMPLE_RATE
 
 def reflection_node(state: dict) -> dict:
     """
     Critiques the generated answer for hallucination and relevance.
     """
-    print(" [RAG] Reflector: Grading answer quality...")
+    if not needs_reflection(state):
+        reflection_stats["skipped"] += 1
+        logger.info("Reflector: Skipped (retrieval similarity %s)", state.get('retrieval_similarity'))
+        return {"reflection_score": {
+            "is_safe": None, "score": None, "skipped": True,
+            "reason": "Not graded: strong retrieval match and not sampled for review.",
+        }}
+    reflection_stats["graded"] += 1
+    logger.info("Reflector: Grading answer quality...")
     
     answer = state.get("answer", "")
     question = state["question"]
@@ -32,22 +62,23 @@ def reflection_node(state: dict) -> dict:
         """
     )
     
-    chain = prompt | reflection_llm | StrOutputParser()
+    chain = prompt | get_reflection_llm() | StrOutputParser()
     
     try:
-        result_str = chain.invoke({
-            "question": question, 
-            "context": context, 
-            "answer": answer
-        })
+        with timed("llm_call", agent="reflection"):
+            result_str = chain.invoke({
+                "question": question, 
+                "context": context, 
+                "answer": answer
+            })
         # Clean markdown if present
         result_str = result_str.replace("```json", "").replace("```", "").strip()
         score_data = json.loads(result_str)
         
-        print(f"   - Score: {score_data.get('score')} ({score_data.get('reason')})")
+        logger.info("   - Score: %s (%s)", score_data.get('score'), score_data.get('reason'))
         return {"reflection_score": score_data}
         
     except Exception as e:
-        print(f"   - Reflection Error: {e}")
-        # Default to safe if scoring fails, but warn
-        return {"reflection_score": {"is_safe": True, "score": 0.5}}
\ No newline at end of file
+        logger.error("   - Reflection Error: %s", e)
+        # Ungraded, not safe: the workflow shows it as "unverified" and does not cache it
+        return {"reflection_score": {"is_safe": None, "score": None, "error": str(e)}}
\ No newline at end of file
@@ -1,6 +1,35 @@
+import os
+import re
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from rag_agents.rag_llms import rephrase_llm
+from rag_agents.rag_llms import get_rephrase_llm
+from utils.metrics import timed
+from utils.logger import get_logger
+
+logger = get_logger("RAG_REPHRASE")
+
+# "auto" skips the LLM for questions that already stand on their own; "always" rephrases whenever there is history
+REPHRASE_MODE = os.getenv("RAG_REPHRASE_MODE", "auto").lower()
+
+# Words that point back into the conversation ("what about its total?", "and the other one?")
+_ANAPHORA_RE = re.compile(
+    r"\b(it|its|it's|this|that|these|those|they|them|their|he|she|his|her|one|ones|same|above|"
+    r"previous|former|latter|earlier|again|else|other|another)\b"
+)
+_FOLLOW_UP_RE = re.compile(r"^\s*(and|also|but|so|then|what about|how about|why not|ok|okay)\b")
+# Concrete anchors that make a question self-contained (invoice numbers, PO numbers, file names, amounts)
+_ANCHOR_RE = re.compile(r"\b(inv|po)[-_ #]?\d+|\w+\.(pdf|png|jpe?g)\b|\d{3,}")
+
+rephrase_stats = {"rephrased": 0, "skipped": 0}
+
+def is_standalone(question: str) -> bool:
+    """Cheap local check: no follow-up opener, no back-reference, and enough words to stand alone."""
+    q = question.lower().strip()
+    if _FOLLOW_UP_RE.search(q):
+        return False
+    if _ANAPHORA_RE.search(q) and not _ANCHOR_RE.search(q):
+        return False
+    return len(re.findall(r"\w+", q)) >= 4 or bool(_ANCHOR_RE.search(q))
 
 def rephrase_node(state: dict) -> dict:
     """
@@ -13,7 +42,13 @@ def rephrase_node(state: dict) -> dict:
     if not chat_history:
         return {"question": question}
 
-    print(" [RAG] Rephraser: Refining query based on history...")
+    if REPHRASE_MODE == "auto" and is_standalone(question):
+        rephrase_stats["skipped"] += 1
+        logger.info("Rephraser: Question is standalone, skipping LLM call")
+        return {"question": question}
+    rephrase_stats["rephrased"] += 1
+
+    logger.info("Rephraser: Refining query based on history...")
 
     prompt = ChatPromptTemplate.from_template(
         """Given a chat history and the latest user question which might reference context in the chat history, 
@@ -29,10 +64,11 @@ def rephrase_node(state: dict) -> dict:
         Standalone Question:"""
     )
     
-    chain = prompt | rephrase_llm | StrOutputParser()
-    new_question = chain.invoke({"chat_history": chat_history, "question": question})
+    chain = prompt | get_rephrase_llm() | StrOutputParser()
+    with timed("llm_call", agent="rephrase"):
+        new_question = chain.invoke({"chat_history": chat_history, "question": question})
     
-    print(f"   - Original: {question}")
-    print(f"   - Rephrased: {new_question}")
+    logger.debug("   - Original: %s", question)
+    logger.info("   - Rephrased: %s", new_question)
     
     return {"question": new_question}
\ No newline at end of file
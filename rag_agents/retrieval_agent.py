@@ -1,24 +1,300 @@
 import os
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from dotenv import load_dotenv
+from rag_agents.index_store import (DB_PATH, SHARD_BY, read_manifest, current_index_dir, shard_path, list_shards,
+                                   UNKNOWN_MONTH_SHARD)
+from rag_agents.ann_index import index_type_of, tune_search
+from rag_agents.embedding_cache import CachedEmbeddings
+from rag_agents.hybrid_retriever import LexicalIndex, FUSION, vector_search, fuse, parse_filters, describe_filters, months_in_range
+from utils.metrics import LatencyWindow, timed
+from utils.logger import get_logger
 
 load_dotenv()
+logger = get_logger("RAG_RETRIEVAL")
 API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
 
-# Use Google Embeddings (Reliable and Free-tier friendly)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004", google_api_key=API_KEY)
-DB_PATH = "faiss_index"
+# Use Google Embeddings (Reliable and Free-tier friendly), behind a persistent cache
+# so re-indexing and repeated questions do not pay the embedding round trip again
+EMBEDDING_MODEL = "models/text-embedding-004"
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings() -> CachedEmbeddings:
+    """Shared embeddings client, created on first use (the Google SDK import is slow)."""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                from langchain_google_genai import GoogleGenerativeAIEmbeddings
+                _embeddings = CachedEmbeddings(
+                    GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=API_KEY),
+                    model_name=EMBEDDING_MODEL,
+                )
+    return _embeddings
+
+# Chunk-level retrieval: fetch this many chunks, then fill the context up to the token budget
+FETCH_K = int(os.getenv("RAG_FETCH_K", "12"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKENS", "1200"))
+
+# How often (seconds) a request may re-read the tiny CURRENT manifest to spot a new index version
+RELOAD_CHECK_SEC = float(os.getenv("RAG_RELOAD_CHECK_SEC", "2"))
+
+class ResidentVectorStore:
+    """
+    Keeps the FAISS store in memory across requests.
+    When the indexer publishes a new version, the next request loads it and swaps the
+    reference atomically; in-flight searches keep using the old object.
+    """
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._store = None
+        self._version = None
+        self._loaded_at = None
+        self._next_check = 0.0
+        self._load_lock = threading.Lock()
+        self.lexical = LexicalIndex()
+
+    def get(self):
+        now = time.monotonic()
+        if self._store is None or now >= self._next_check:
+            self._next_check = now + RELOAD_CHECK_SEC
+            version = read_manifest(self.db_path)["version"]
+            if version != self._version:
+                self._reload(version)
+        return self._store
+
+    def invalidate(self):
+        """Forces a manifest check on the next get() (e.g. right after an in-process flush)."""
+        self._next_check = 0.0
+
+    @property
+    def version(self):
+        return self._version
+
+    def current_version(self):
+        """Version after the (throttled) manifest check, for caches keyed on the index."""
+        self.get()
+        return self._version
+
+    def search(self, query_vector, k: int = 3, **kwargs) -> list:
+        """[(Document, L2 distance)] for a pre-computed query embedding."""
+        store = self.get()
+        if store is None:
+            return []
+        with timed("faiss_op", op="search"):
+            return store.similarity_search_with_score_by_vector(query_vector, k=k, **kwargs)
+
+    def hybrid_search(self, question: str, query_vector, k: int = 3, filters: dict = None) -> list:
+        """
+        [(Document, fused score, L2 distance or None)], best first. Metadata filters are
+        applied before scoring: BM25 only scores allowed postings and FAISS only visits allowed rows.
+        """
+        store, vector_hits, bm25_hits = self.candidates(question, query_vector, k, filters)
+        if store is None:
+            return []
+        distances = dict(vector_hits)
+        return [(store.docstore.search(doc_id), score, distances.get(doc_id))
+                for doc_id, score in fuse(vector_hits, bm25_hits, k)]
+
+    def candidates(self, question: str, query_vector, k: int = 3, filters: dict = None):
+        """Unfused inputs of hybrid_search: (store, [(doc_id, L2 distance)], [(doc_id, bm25)])."""
+        store = self.get()
+        if store is None:
+            return None, [], []
+        allowed = self.lexical.allowed_ids(filters)
+        if allowed is not None and not allowed:
+            # Dropping the filters here would answer "HafenLogistik" questions from other vendors
+            logger.info("No chunks match filters %s", filters)
+            return store, [], []
+        vector_hits = [] if FUSION == "bm25" else vector_search(store, self.lexical, query_vector, k, allowed)
+        bm25_hits = [] if FUSION == "vector" else self.lexical.bm25(question, k, allowed)
+        return store, vector_hits, bm25_hits
+
+    def vendor_names(self) -> dict:
+        self.get()
+        return dict(self.lexical.vendor_names)
+
+    def _reload(self, version: int):
+        with self._load_lock:
+            if version == self._version:
+                return  # Another request already loaded it
+            index_dir = current_index_dir(self.db_path)
+            if index_dir is None:
+                return
+            start = time.perf_counter()
+            store = _load_store(str(index_dir))
+            self.lexical.sync(store)  # Before the swap, so text and vectors always match
+            self._store, self._version, self._loaded_at = store, version, datetime.now().isoformat()
+            logger.info("Loaded index version %s (%d vectors) in %.1f ms",
+                        version, store.index.ntotal, (time.perf_counter() - start) * 1000)
+
+    def stats(self) -> dict:
+        return {
+            "version": self._version,
+            "loaded_at": self._loaded_at,
+            "vectors": self._store.index.ntotal if self._store is not None else 0,
+            "bm25_terms": len(self.lexical.postings),
+            "fusion": FUSION,
+            "index_type": index_type_of(self._store.index) if self._store is not None else None,
+            "latency_ms": retrieval_latency.snapshot(),
+            "embedding_cache": _embeddings.stats() if _embeddings else None,
+        }
+
+class ShardedVectorStore:
+    """
+    One ResidentVectorStore per shard (VECTOR_SHARD_BY=month|tenant), searched in parallel.
+    search() merges on L2 distance, which compares across shards (one embedding model).
+    hybrid_search() fuses once over the union of the shards' vector and BM25 candidate
+    lists; per-shard fused (RRF) scores are rank-based and would not compare.
+    """
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._shards = {}
+        self._next_scan = 0.0
+        self._pool = ThreadPoolExecutor(max_workers=int(os.getenv("RAG_SHARD_WORKERS", "8")),
+                                        thread_name_prefix="shard-search")
+
+    def shards(self, keys: list = None) -> dict:
+        now = time.monotonic()
+        if now >= self._next_scan:
+            self._next_scan = now + RELOAD_CHECK_SEC
+            for key in list_shards(self.db_path):
+                if key not in self._shards:
+                    self._shards[key] = ResidentVectorStore(shard_path(self.db_path, key))
+        if keys is None:
+            return dict(self._shards)
+        return {k: v for k, v in self._shards.items() if k in keys}
+
+    def invalidate(self):
+        self._next_scan = 0.0
+        for store in self._shards.values():
+            store.invalidate()
+
+    def current_version(self):
+        return tuple(sorted((key, store.current_version()) for key, store in self.shards().items()))
+
+    def search(self, query_vector, k: int = 3, shard_keys: list = None, **kwargs) -> list:
+        """Fan-out search; shard_keys limits it to some months/tenants."""
+        targets = list(self.shards(shard_keys).values())
+        if not targets:
+            return []
+        if len(targets) == 1:
+            return targets[0].search(query_vector, k=k, **kwargs)
+        results = self._pool.map(lambda s: s.search(query_vector, k=k, **kwargs), targets)
+        merged = [hit for hits in results for hit in hits]
+        return sorted(merged, key=lambda hit: hit[1])[:k]
+
+    def hybrid_search(self, question: str, query_vector, k: int = 3, filters: dict = None) -> list:
+        """Fan-out hybrid search; a date filter on month shards only touches the months it covers."""
+        keys = None
+        if SHARD_BY == "month" and filters and filters.get("date_from") and filters.get("date_to"):
+            # Undated invoices may still match (on processed_at), so their shard is always searched
+            keys = months_in_range(filters["date_from"], filters["date_to"]) + [UNKNOWN_MONTH_SHARD]
+        targets = list(self.shards(keys).values())
+        if not targets:
+            return []
+        results = self._pool.map(lambda s: s.candidates(question, query_vector, k=k, filters=filters), targets)
+        owner, vector_hits, bm25_hits = {}, [], []
+        for store, shard_vector, shard_bm25 in results:
+            if store is None:
+                continue
+            for doc_id, _ in shard_vector + shard_bm25:
+                owner[doc_id] = store
+            vector_hits += shard_vector
+            bm25_hits += shard_bm25
+        # Global ranks: distances share the embedding space; BM25 uses each shard's IDF (close enough)
+        vector_hits = sorted(vector_hits, key=lambda hit: hit[1])[:k]
+        bm25_hits = sorted(bm25_hits, key=lambda hit: hit[1], reverse=True)[:k]
+        distances = dict(vector_hits)
+        return [(owner[doc_id].docstore.search(doc_id), score, distances.get(doc_id))
+                for doc_id, score in fuse(vector_hits, bm25_hits, k)]
+
+    def vendor_names(self) -> dict:
+        names = {}
+        for store in self.shards().values():
+            names.update(store.vendor_names())
+        return names
+
+    def stats(self) -> dict:
+        return {
+            "shard_by": SHARD_BY,
+            "shards": {key: store.stats() for key, store in self.shards().items()},
+            "latency_ms": retrieval_latency.snapshot(),
+            "embedding_cache": _embeddings.stats() if _embeddings else None,
+        }
+
+@timed("faiss_op", op="load")
+def _load_store(index_dir: str):
+    # Memory-map the vectors where FAISS supports it: pages are shared with the OS cache
+    # and loading a new version does not copy the whole index onto the heap.
+    from langchain_community.vectorstores import FAISS
+    embeddings = get_embeddings()
+    try:
+        import faiss
+        store = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True,
+                                 io_flags=faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except Exception as e:
+        logger.warning("mmap load unavailable (%s), reading index into memory", e)
+        store = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+    tune_search(store.index)
+    return store
+
+vector_store = ShardedVectorStore() if SHARD_BY else ResidentVectorStore()
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English/European invoice text; no tokenizer round trip
+    return max(1, len(text) // 4)
+
+def assemble_context(hits: list, budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Takes ranked hits (best first) and keeps chunks in that order, skipping duplicates,
+    until the token budget is spent. Returns (context_text, selected_docs).
+    """
+    selected, seen, used = [], set(), 0
+    for doc, *_ in hits:
+        if doc.page_content in seen:
+            continue
+        cost = estimate_tokens(doc.page_content)
+        if used + cost > budget and selected:
+            continue  # A smaller chunk further down may still fit
+        seen.add(doc.page_content)
+        selected.append(doc)
+        used += cost
+    return "\n\n".join(d.page_content for d in selected), selected
+
+def top_similarity(hits: list):
+    """
+    Cosine similarity of the closest vector hit. Gemini embeddings are unit length,
+    so FAISS' squared L2 distance d maps to cos = 1 - d / 2. None for BM25-only hits.
+    """
+    distances = [hit[2] for hit in hits if hit[2] is not None]
+    return round(max(0.0, 1 - min(distances) / 2), 4) if distances else None
+
+retrieval_latency = LatencyWindow("rag_retrieval")
 
 def retrieval_node(state):
     question = state["question"]
-    print(f" [RAG] Retrieving context for: {question}")
-    
+    logger.info("Retrieving context for: %s", question)
+
+    start = time.perf_counter()
     try:
-        db = FAISS.load_local(DB_PATH, embeddings, allow_dangerous_deserialization=True)
-        docs = db.similarity_search(question, k=3)
-        context = "\n\n".join([d.page_content for d in docs])
-        return {"context_text": context, "context": docs}
+        filters = parse_filters(question, vector_store.vendor_names())
+        if filters:
+            logger.info("Metadata filters: %s", filters)
+        query_vector = None if FUSION == "bm25" else get_embeddings().embed_query(question)
+        hits = vector_store.hybrid_search(question, query_vector, k=FETCH_K, filters=filters)
+        if not hits and filters:
+            return {"context_text": f"No invoices match the requested filters ({describe_filters(filters)}).",
+                    "context": []}
+        if not hits:
+            return {"context_text": "No documents found.", "context": []}
+        context, docs = assemble_context(hits)
+        return {"context_text": context, "context": docs, "retrieval_similarity": top_similarity(hits)}
     except Exception as e:
-        print(f" [RAG] Retrieval Error: {e}")
-        return {"context_text": "No documents found.", "context": []}
\ No newline at end of file
+        logger.error("Retrieval Error: %s", e)
+        return {"context_text": "No documents found.", "context": []}
+    finally:
+        retrieval_latency.record((time.perf_counter() - start) * 1000)
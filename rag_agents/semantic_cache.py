@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+import numpy as np
+from rag_agents.retrieval_agent import get_embeddings, vector_store
+from utils.logger import get_logger
+
+logger = get_logger("RAG_CACHE")
+
+# Cosine similarity above which two standalone questions count as the same question
+CACHE_THRESHOLD = float(os.getenv("RAG_CACHE_THRESHOLD", "0.95"))
+CACHE_MAX_ENTRIES = int(os.getenv("RAG_CACHE_SIZE", "1000"))
+CACHE_TTL_SEC = float(os.getenv("RAG_CACHE_TTL_SEC", "3600"))
+CACHE_ENABLED = os.getenv("RAG_ANSWER_CACHE", "1") == "1"
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of RAG answers keyed by the embedding of the standalone question.
+    A lookup is one matrix-vector product over the cached (unit-length) question vectors.
+    All entries are dropped when the vector index version changes, since answers
+    computed from an older index may be missing newly processed invoices.
+    """
+    def __init__(self, threshold: float = CACHE_THRESHOLD, max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl_sec: float = CACHE_TTL_SEC):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._vectors = None   # (n, dim) float32, unit rows
+        self._entries = []     # parallel to _vectors rows
+        self._index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved_ms = 0.0
+
+    def lookup(self, query_vector, index_version):
+        """Returns the cached entry dict, or None."""
+        q = _unit(query_vector)
+        with self._lock:
+            self._check_version(index_version)
+            if self._vectors is None or not len(self._entries):
+                self.misses += 1
+                return None
+            sims = self._vectors @ q
+            best = int(np.argmax(sims))
+            entry = self._entries[best]
+            if sims[best] < self.threshold or time.time() - entry["created"] > self.ttl_sec:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.latency_saved_ms += entry["cost_ms"]
+            return {**entry, "similarity": float(sims[best])}
+
+    def store(self, question: str, query_vector, answer: str, reflection_score: dict,
+              cost_ms: float, index_version):
+        q = _unit(query_vector)
+        entry = {"question": question, "answer": answer, "reflection_score": reflection_score,
+                 "cost_ms": cost_ms, "created": time.time()}
+        with self._lock:
+            self._check_version(index_version)
+            if self._vectors is None:
+                self._vectors = q.reshape(1, -1)
+            else:
+                self._vectors = np.vstack([self._vectors, q])
+            self._entries.append(entry)
+            if len(self._entries) > self.max_entries:
+                drop = len(self._entries) - self.max_entries  # Oldest first
+                self._vectors = self._vectors[drop:]
+                self._entries = self._entries[drop:]
+
+    def clear(self):
+        with self._lock:
+            self._vectors, self._entries = None, []
+
+    def _check_version(self, index_version):
+        if index_version != self._index_version:
+            if self._entries:
+                logger.info("Index version changed (%s -> %s), dropping %d cached answers",
+                            self._index_version, index_version, len(self._entries))
+            self._vectors, self._entries = None, []
+            self._index_version = index_version
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": CACHE_ENABLED,
+            "entries": len(self._entries),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "latency_saved_ms": round(self.latency_saved_ms, 1),
+        }
+
+def _unit(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+answer_cache = SemanticAnswerCache()
+
+def cache_lookup_node(state: dict) -> dict:
+    """
+    Runs after rephrase, so the key is the standalone question.
+    On a hit the graph ends here with the cached answer and reflection score.
+    """
+    started = time.perf_counter()
+    if not CACHE_ENABLED:
+        return {"cache_hit": False, "started_at": started}
+    try:
+        entry = answer_cache.lookup(get_embeddings().embed_query(state["question"]), vector_store.current_version())
+    except Exception as e:
+        logger.warning("Answer cache lookup failed: %s", e)
+        entry = None
+    if entry is None:
+        return {"cache_hit": False, "started_at": started}
+
+    logger.info("Answer cache hit (similarity %.3f, saved ~%.0f ms)", entry['similarity'], entry['cost_ms'])
+    return {"cache_hit": True, "answer": entry["answer"], "reflection_score": entry["reflection_score"]}
+
+def cache_store_node(state: dict) -> dict:
+    """Runs after a safe reflection verdict; remembers the answer for similar questions."""
+    if CACHE_ENABLED:
+        cost_ms = (time.perf_counter() - state.get("started_at", time.perf_counter())) * 1000
+        try:
+            answer_cache.store(state["question"], get_embeddings().embed_query(state["question"]),
+                               state.get("answer", ""), state.get("reflection_score", {}),
+                               cost_ms, vector_store.current_version())
+        except Exception as e:
+            logger.warning("Answer cache store failed: %s", e)
+    return {}
+
+def cache_routing(state: dict) -> str:
+    return "hit" if state.get("cache_hit") else "miss"
@@ -1,11 +1,15 @@
+import threading
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, List, Any
 
 # Import Nodes
+from rag_agents.analytics_router import analytics_node, analytics_routing
 from rag_agents.rephrase_agent import rephrase_node
 from rag_agents.retrieval_agent import retrieval_node
 from rag_agents.generation_agent import generation_node
 from rag_agents.reflection_agent import reflection_node
+from rag_agents.semantic_cache import cache_lookup_node, cache_store_node, cache_routing
+from utils.metrics import timed
 
 # Define State
 class RagState(TypedDict):
@@ -13,32 +17,65 @@ class RagState(TypedDict):
     chat_history: List[str]
     context_text: str
     context: List[Any] # Actual documents
+    retrieval_similarity: float
     answer: str
     reflection_score: dict
     final_answer: str
+    route: str
+    cache_hit: bool
+    started_at: float
 
 def rag_routing(state):
     """
-    Decides if the answer is safe to show.
+    Decides if the answer is safe to show, and whether it was actually graded:
+    "unverified" answers (sampling skipped the grade, or the grader failed) are
+    shown but never cached, so the cache only serves answers that passed reflection.
     """
     score = state.get("reflection_score", {})
-    if score.get("is_safe", False):
-        return "safe"
-    else:
+    if score.get("is_safe") is None or score.get("skipped") or score.get("error"):
+        return "unverified"  # is_safe None: no verdict either way
+    if not score["is_safe"]:
         return "unsafe"
+    return "safe"
+
+def _timed(name, node):
+    """Latency histogram / in-flight gauge per node, exported at /metrics."""
+    return timed("workflow_node", graph="rag", node=name)(node)
 
 def build_rag_graph():
     workflow = StateGraph(RagState)
 
     # Add Nodes
-    workflow.add_node("rephrase", rephrase_node)
-    workflow.add_node("retrieve", retrieval_node)
-    workflow.add_node("generate", generation_node)
-    workflow.add_node("reflect", reflection_node)
+    workflow.add_node("analytics", _timed("analytics", analytics_node))
+    workflow.add_node("rephrase", _timed("rephrase", rephrase_node))
+    workflow.add_node("retrieve", _timed("retrieve", retrieval_node))
+    workflow.add_node("generate", _timed("generate", generation_node))
+    workflow.add_node("reflect", _timed("reflect", reflection_node))
+    workflow.add_node("cache_lookup", _timed("cache_lookup", cache_lookup_node))
+    workflow.add_node("cache_store", _timed("cache_store", cache_store_node))
 
     # Build Edge Connections
+    # Follow-ups are made standalone first, so the analytics router never sees "those" or "it"
     workflow.set_entry_point("rephrase")
-    workflow.add_edge("rephrase", "retrieve")
+    workflow.add_edge("rephrase", "analytics")
+    # Aggregate questions are answered from the report store; the rest go through RAG,
+    # starting at the semantic answer cache keyed by the standalone question
+    workflow.add_conditional_edges(
+        "analytics",
+        analytics_routing,
+        {
+            "analytics": END,
+            "rag": "cache_lookup"
+        }
+    )
+    workflow.add_conditional_edges(
+        "cache_lookup",
+        cache_routing,
+        {
+            "hit": END,
+            "miss": "retrieve"
+        }
+    )
     workflow.add_edge("retrieve", "generate")
     workflow.add_edge("generate", "reflect")
 
@@ -47,12 +84,24 @@ def build_rag_graph():
         "reflect",
         rag_routing,
         {
-            "safe": END,
+            "safe": "cache_store", # Only answers that passed reflection are reused
+            "unverified": END,
             "unsafe": END # For now, we just end. Advanced: Loop back to generate.
         }
     )
 
+    workflow.add_edge("cache_store", END)
+
     return workflow.compile()
 
-# Expose the app
-rag_app = build_rag_graph()
\ No newline at end of file
+# Expose the app, compiled on first use so importing this module stays cheap
+_rag_app = None
+_rag_app_lock = threading.Lock()
+
+def get_rag_app():
+    global _rag_app
+    if _rag_app is None:
+        with _rag_app_lock:
+            if _rag_app is None:
+                _rag_app = build_rag_graph()
+    return _rag_app
\ No newline at end of file
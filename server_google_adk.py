@@ -3,8 +3,11 @@ import json
 from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
 from fastmcp import FastMCP
+from starlette.responses import Response
 from persona.persona_agent import load_prompts
 from utils.logger import get_logger
+from utils.metrics import CONTENT_TYPE, render_prometheus, timed
+from utils.profiling import profiled
 
 # Initialize Logger
 logger = get_logger("SERVER_GOOGLE_8002")
@@ -18,6 +21,7 @@ gemini_model = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
 prompts = load_prompts() # Load YAML prompts
 
 @mcp.tool()
+@profiled("translate_invoice")  # No-op unless PROFILE_MCP=1
 def translate_invoice(raw_text: str) -> str:
     """
     Uses Google Gemini to extract JSON from raw invoice text.
@@ -30,7 +34,8 @@ def translate_invoice(raw_text: str) -> str:
     try:
         # 2. Call Gemini
         full_prompt = f"{sys_prompt}\n\n--- INPUT TEXT ---\n{raw_text}"
-        response = gemini_model.invoke(full_prompt)
+        with timed("llm_call", agent="translation", model="gemini-2.0-flash"):
+            response = gemini_model.invoke(full_prompt)
         
         # 3. Clean Output (Remove markdown ```json blocks)
         clean_text = response.content.replace("```json", "").replace("```", "").strip()
@@ -50,30 +55,38 @@ def translate_invoice(raw_text: str) -> str:
         return json.dumps({"error": str(e)})
 
 @mcp.tool()
-def generate_report(report_data: str) -> str:
+@profiled("summarize_report")
+def summarize_report(report_data: str) -> str:
     """
-    Uses Google Gemini to write an HTML report based on validation data.
+    Uses Google Gemini to write a short narrative summary of an audit result.
+    The HTML report itself is rendered locally from a template; this is optional flavour text.
     """
-    logger.info(f"📨 REQUEST: Report Generation")
+    logger.info(f"📨 REQUEST: Report Summary")
     
-    sys_prompt = prompts.get("reporting_agent", {}).get("system_prompt", "Generate HTML.")
+    sys_prompt = prompts.get("reporting_agent", {}).get("system_prompt", "Summarize this invoice audit.")
     
     try:
         # Call Gemini
         full_prompt = f"{sys_prompt}\n\nDATA: {report_data}"
-        response = gemini_model.invoke(full_prompt)
+        with timed("llm_call", agent="reporting", model="gemini-2.0-flash"):
+            response = gemini_model.invoke(full_prompt)
         
         # Clean Output
-        html_content = response.content.replace("```html", "").replace("```", "").strip()
+        summary = response.content.replace("```", "").strip()
         
-        logger.info(f"✅ SUCCESS: Generated {len(html_content)} bytes of HTML")
+        logger.info(f"✅ SUCCESS: Generated {len(summary)} chars of summary")
         
         # Wrap in JSON for transport
-        return json.dumps({"html": html_content})
+        return json.dumps({"summary": summary})
         
     except Exception as e:
         logger.error(f"❌ ERROR: {e}")
-        return json.dumps({"html": f"<b>Error Generating Report: {e}</b>"})
+        return json.dumps({"error": str(e)})
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request):
+    """Prometheus scrape endpoint (Gemini call latency)."""
+    return Response(render_prometheus(), media_type=CONTENT_TYPE)
 
 if __name__ == "__main__":
     logger.info("🚀 STARTING Google ADK FastMCP Server on Port 8002...")
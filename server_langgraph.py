@@ -1,8 +1,11 @@
 import json
 from fastmcp import FastMCP
+from starlette.responses import Response
 from tools.ocr_engine import DataHarvesterTool
 from tools.validator import BusinessValidationTool
 from utils.logger import get_logger
+from utils.metrics import CONTENT_TYPE, render_prometheus, timed
+from utils.profiling import profiled
 
 # Initialize Logger
 logger = get_logger("SERVER_LANGGRAPH_8001")
@@ -16,6 +19,7 @@ ocr_tool = DataHarvesterTool()
 validator_tool = BusinessValidationTool()
 
 @mcp.tool()
+@profiled("ocr_extract")  # No-op unless PROFILE_MCP=1
 def ocr_extract(file_path: str) -> str:
     """
     Extracts text from a PDF or Image invoice using Hybrid OCR.
@@ -25,7 +29,8 @@ def ocr_extract(file_path: str) -> str:
     
     try:
         # Run the local tool
-        result = ocr_tool.execute(file_path)
+        with timed("mcp_tool", server="langgraph", tool="ocr_extract"):
+            result = ocr_tool.execute(file_path)
         
         # Log success/fail logic
         if result.get("status") == "success":
@@ -42,6 +47,7 @@ def ocr_extract(file_path: str) -> str:
         return json.dumps({"status": "error", "message": str(e)})
 
 @mcp.tool()
+@profiled("validate_business_data")
 def validate_business_data(validation_type: str, key: str) -> str:
     """
     Validates PO, Vendor, or SKU against the Mock ERP.
@@ -49,7 +55,8 @@ def validate_business_data(validation_type: str, key: str) -> str:
     logger.info(f"📨 REQUEST: Validate {validation_type} -> {key}")
     
     try:
-        result = validator_tool.execute(validation_type, key)
+        with timed("mcp_tool", server="langgraph", tool="validate_business_data"):
+            result = validator_tool.execute(validation_type, key)
         
         is_valid = result.get("valid", False)
         icon = "✅" if is_valid else "❌"
@@ -61,6 +68,11 @@ def validate_business_data(validation_type: str, key: str) -> str:
         logger.critical(f"🔥 CRASH: {e}")
         return json.dumps({"valid": False, "reason": f"Server Error: {e}"})
 
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request):
+    """Prometheus scrape endpoint (tool latency, ERP lookups)."""
+    return Response(render_prometheus(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     logger.info("🚀 STARTING LangGraph FastMCP Server on Port 8001...")
     # transport="sse" enables HTTP/SSE mode required for Remote Agents
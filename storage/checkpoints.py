@@ -0,0 +1,38 @@
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+from utils.logger import get_logger
+
+logger = get_logger("CHECKPOINTS")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DB_PATH = BASE_DIR / "outputs" / "checkpoints.sqlite3"
+
+_saver = None
+_saver_lock = threading.Lock()
+
+def get_checkpointer():
+    """
+    Process-wide LangGraph SqliteSaver. Every node's output is persisted per thread,
+    so a run can be resumed from any node without redoing OCR / translation.
+    """
+    global _saver
+    with _saver_lock:
+        if _saver is None:
+            from langgraph.checkpoint.sqlite import SqliteSaver
+            DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+            # Shared by the API threads and the graph's parallel branches (SqliteSaver locks internally)
+            conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            _saver = SqliteSaver(conn)
+            _saver.setup()
+            logger.info(f"Workflow checkpoints in {DB_PATH}")
+        return _saver
+
+def new_thread_id(file_name: str) -> str:
+    """One checkpoint thread per processing run of an invoice file."""
+    return f"{file_name}:{uuid.uuid4().hex[:8]}"
+
+def thread_config(thread_id: str, **config) -> dict:
+    return {**config, "configurable": {"thread_id": thread_id}}
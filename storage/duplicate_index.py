@@ -0,0 +1,186 @@
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from utils.logger import get_logger
+
+logger = get_logger("DUPLICATE_INDEX")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DB_PATH = BASE_DIR / "outputs" / "duplicate_index.sqlite3"
+
+# MinHash / LSH parameters: 32 bands x 4 rows = 128 permutations.
+# Candidate pairs appear from ~0.4 Jaccard; NEAR_DUP_THRESHOLD decides what is reported.
+NUM_PERM = 128
+LSH_BANDS = 32
+LSH_ROWS = NUM_PERM // LSH_BANDS
+SHINGLE_SIZE = 5
+NEAR_DUP_THRESHOLD = 0.85
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Registrations are owned by a run (the workflow thread id), not a file name: re-uploading
+# "invoice.pdf" is a duplicate, resuming or re-running the same workflow is not.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoice_keys (
+    key        TEXT PRIMARY KEY,
+    source     TEXT,
+    created_at TEXT NOT NULL,
+    run_id     TEXT
+);
+CREATE TABLE IF NOT EXISTS run_signatures (
+    run_id     TEXT PRIMARY KEY,
+    source     TEXT,
+    signature  BLOB NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+def exact_key(vendor_name, invoice_no, total_amount) -> Optional[str]:
+    """Normalized (vendor, invoice_no, total) key; None if the invoice has no number."""
+    if not invoice_no or str(invoice_no).lower() in ["none", "null", ""]:
+        return None
+    vendor = re.sub(r"\s+", " ", str(vendor_name or "")).strip().lower()
+    number = re.sub(r"\s+", "", str(invoice_no)).upper()
+    try:
+        total = f"{float(total_amount):.2f}"
+    except (TypeError, ValueError):
+        total = str(total_amount)
+    return f"{vendor}|{number}|{total}"
+
+class DuplicateIndex:
+    """
+    Duplicate-invoice detection.
+    - Exact: dict lookup on (vendor, invoice_no, total), O(1), persisted in SQLite.
+    - Near:  MinHash signatures of the OCR text bucketed with LSH, so a re-scanned or
+             re-exported copy of the same invoice is caught before translation.
+    """
+    def __init__(self, db_path: Path = DB_PATH, threshold: float = NEAR_DUP_THRESHOLD):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold
+        self._lock = threading.Lock()
+
+        rng = np.random.RandomState(1)  # Fixed seed: signatures must stay comparable across restarts
+        self._a = rng.randint(1, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+        self._b = rng.randint(0, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+        # In-memory views rebuilt at startup
+        self._keys = {key: (source, run_id) for key, source, run_id in
+                      self._conn.execute("SELECT key, source, COALESCE(run_id, source) FROM invoice_keys")}
+        self._signatures = {}
+        self._sources = {}  # run_id -> file name, for reporting
+        self._buckets = [defaultdict(set) for _ in range(LSH_BANDS)]
+        for run_id, source, blob in self._conn.execute("SELECT run_id, source, signature FROM run_signatures"):
+            self._index_signature(run_id, source, np.frombuffer(blob, dtype=np.uint64))
+        logger.info(f"Loaded {len(self._keys)} invoice keys, {len(self._signatures)} text signatures")
+
+    def _migrate(self):
+        # Databases from before run ids: keys get a NULL run_id, signatures were keyed by file name
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(invoice_keys)")}
+        if "run_id" not in columns:
+            self._conn.execute("ALTER TABLE invoice_keys ADD COLUMN run_id TEXT")
+        legacy = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'text_signatures'").fetchone()
+        if legacy:
+            with self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO run_signatures "
+                                   "SELECT source, source, signature, created_at FROM text_signatures")
+                self._conn.execute("DROP TABLE text_signatures")
+
+    # --- Exact duplicates ---
+
+    def check_exact(self, vendor_name, invoice_no, total_amount, run_id: str = None) -> Optional[str]:
+        """Returns the source that first registered this key in another run, or None."""
+        key = exact_key(vendor_name, invoice_no, total_amount)
+        if key is None:
+            return None
+        owner = self._keys.get(key)
+        return owner[0] if owner and owner[1] != run_id else None
+
+    def register_exact(self, vendor_name, invoice_no, total_amount, source: str, run_id: str):
+        key = exact_key(vendor_name, invoice_no, total_amount)
+        if key is None:
+            return
+        with self._lock:
+            if key in self._keys:
+                return
+            self._keys[key] = (source, run_id)
+            with self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO invoice_keys VALUES (?, ?, ?, ?)",
+                                   (key, source, datetime.now().isoformat(), run_id))
+
+    # --- Near duplicates ---
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self._shingles(text)
+        if not shingles:
+            return np.full(NUM_PERM, _MAX_HASH, dtype=np.uint64)
+        hv = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+            dtype=np.uint64,
+        )
+        # (a*x + b) mod p, one row per shingle, min over shingles -> one value per permutation
+        phv = np.bitwise_and((np.outer(hv, self._a) + self._b) % _MERSENNE_PRIME, _MAX_HASH)
+        return phv.min(axis=0)
+
+    def find_near_duplicate(self, text: str, run_id: str = None):
+        """Returns (source, estimated_jaccard) of the closest invoice from another run above threshold, else None."""
+        sig = self.signature(text)
+        candidates = set()
+        for band, start in enumerate(range(0, NUM_PERM, LSH_ROWS)):
+            candidates |= self._buckets[band].get(sig[start:start + LSH_ROWS].tobytes(), set())
+        candidates.discard(run_id)
+
+        best = None
+        for cand in candidates:
+            score = float(np.mean(self._signatures[cand] == sig))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (self._sources[cand], score)
+        return best
+
+    def register_text(self, text: str, source: str, run_id: str):
+        sig = self.signature(text)
+        with self._lock:
+            self._index_signature(run_id, source, sig)
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO run_signatures VALUES (?, ?, ?, ?)",
+                                   (run_id, source, sig.tobytes(), datetime.now().isoformat()))
+
+    def _index_signature(self, run_id: str, source: str, sig: np.ndarray):
+        old = self._signatures.get(run_id)
+        if old is not None:
+            for band, start in enumerate(range(0, NUM_PERM, LSH_ROWS)):
+                self._buckets[band][old[start:start + LSH_ROWS].tobytes()].discard(run_id)
+        self._signatures[run_id] = sig
+        self._sources[run_id] = source
+        for band, start in enumerate(range(0, NUM_PERM, LSH_ROWS)):
+            self._buckets[band][sig[start:start + LSH_ROWS].tobytes()].add(run_id)
+
+    @staticmethod
+    def _shingles(text: str) -> set:
+        tokens = re.findall(r"\w+", text.lower())
+        if len(tokens) < SHINGLE_SIZE:
+            return {" ".join(tokens)} if tokens else set()
+        return {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_duplicate_index() -> DuplicateIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DuplicateIndex()
+        return _index
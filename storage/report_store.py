@@ -0,0 +1,410 @@
+import base64
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from utils.dates import normalize_date
+from utils.logger import get_logger
+
+logger = get_logger("REPORT_STORE")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DB_PATH = BASE_DIR / "outputs" / "report_store.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    invoice_id       TEXT PRIMARY KEY,
+    invoice_no       TEXT,
+    vendor_name      TEXT,
+    vendor_key       TEXT,
+    status           TEXT,
+    total_amount     REAL,
+    currency         TEXT,
+    invoice_date     TEXT,
+    created_at       TEXT NOT NULL,
+    html_report_path TEXT,
+    version          INTEGER NOT NULL DEFAULT 1,
+    payload          TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reports_created ON reports(created_at, invoice_id);
+CREATE INDEX IF NOT EXISTS idx_reports_status ON reports(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_reports_vendor ON reports(vendor_key, created_at);
+CREATE INDEX IF NOT EXISTS idx_reports_invoice_date ON reports(invoice_date, invoice_id);
+-- Covering index for aggregates: COUNT/SUM queries read only these narrow columns, never the payload
+CREATE INDEX IF NOT EXISTS idx_reports_agg ON reports(created_at, status, vendor_key, total_amount, currency);
+
+CREATE TABLE IF NOT EXISTS audit_log (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    invoice_id   TEXT NOT NULL,
+    action       TEXT NOT NULL,
+    actor        TEXT,
+    notes        TEXT,
+    from_status  TEXT,
+    to_status    TEXT,
+    from_version INTEGER,
+    to_version   INTEGER,
+    created_at   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_audit_invoice ON audit_log(invoice_id, id);
+CREATE TRIGGER IF NOT EXISTS audit_log_no_update BEFORE UPDATE ON audit_log
+BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS audit_log_no_delete BEFORE DELETE ON audit_log
+BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END;
+"""
+
+# Human review actions -> resulting report status
+ACTION_STATUS = {"APPROVE": "Approved", "REJECT": "Rejected"}
+
+# Whitelisted ORDER BY columns (user input never reaches the SQL text directly)
+SORT_COLUMNS = {
+    "created_at": "created_at",
+    "invoice_date": "COALESCE(invoice_date, '')",
+    "total_amount": "COALESCE(total_amount, 0)",
+    "vendor_name": "COALESCE(vendor_key, '')",
+}
+DATE_FIELDS = {"created_at", "invoice_date"}
+
+# Outcome groups used by analytics ("failed" covers rejected-by-reviewer too)
+STATUS_GROUPS = {"FAIL": ("FAIL", "Rejected"), "PASS": ("PASS", "Approved", "SUCCESS")}
+AGGREGATES = {
+    "count": "COUNT(*)",
+    "sum": "COALESCE(SUM(total_amount), 0)",
+    "avg": "COALESCE(AVG(total_amount), 0)",
+}
+GROUP_COLUMNS = {"vendor": "vendor_name", "status": "status", "currency": "currency"}
+
+class ReportStore:
+    """
+    Indexed SQLite (WAL) store for report metadata.
+    The HTML stays on disk in outputs/reports and is referenced by html_report_path.
+    """
+    def __init__(self, db_path: Path = DB_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            self._normalize_invoice_dates(conn)
+
+    @staticmethod
+    def _normalize_invoice_dates(conn: sqlite3.Connection):
+        # Rows written before upsert() normalized the LLM-extracted date (e.g. "15.03.2024")
+        rows = conn.execute(
+            "SELECT invoice_id, invoice_date FROM reports WHERE invoice_date IS NOT NULL "
+            "AND invoice_date NOT GLOB '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9]'"
+        ).fetchall()
+        for invoice_id, value in rows:
+            conn.execute("UPDATE reports SET invoice_date = ? WHERE invoice_id = ?",
+                         (normalize_date(value), invoice_id))
+        if rows:
+            logger.info("Normalized invoice_date of %d reports to ISO", len(rows))
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets readers run while a writer commits
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Writes ---
+
+    def upsert(self, metadata: dict):
+        """Inserts or replaces one report (the same dict that is written as <id>.json)."""
+        row = self._to_row(metadata)
+        with self._conn() as conn:
+            conn.execute(
+                """INSERT INTO reports (invoice_id, invoice_no, vendor_name, vendor_key, status,
+                       total_amount, currency, invoice_date, created_at, html_report_path, payload)
+                   VALUES (:invoice_id, :invoice_no, :vendor_name, :vendor_key, :status,
+                       :total_amount, :currency, :invoice_date, :created_at, :html_report_path, :payload)
+                   ON CONFLICT(invoice_id) DO UPDATE SET
+                       invoice_no=excluded.invoice_no, vendor_name=excluded.vendor_name,
+                       vendor_key=excluded.vendor_key, status=excluded.status,
+                       total_amount=excluded.total_amount, currency=excluded.currency,
+                       invoice_date=excluded.invoice_date, created_at=excluded.created_at,
+                       html_report_path=excluded.html_report_path, payload=excluded.payload,
+                       version=reports.version + 1""",
+                row,
+            )
+
+    def set_narrative(self, invoice_id: str, narrative: str) -> bool:
+        """
+        Patches only payload.narrative_summary. Status, version and audit log are left
+        alone, so a narrative that lands after a reviewer's decision cannot undo it.
+        """
+        with self._conn() as conn:
+            cur = conn.execute(
+                "UPDATE reports SET payload = json_set(payload, '$.narrative_summary', ?) WHERE invoice_id = ?",
+                (narrative, invoice_id),
+            )
+        return cur.rowcount > 0
+
+    def apply_actions(self, actions: list, actor: str = None, all_or_nothing: bool = False) -> list:
+        """
+        Applies many approve/reject decisions in ONE write transaction.
+        Each action: {"invoice_id", "action": APPROVE|REJECT, "notes", "expected_version"}.
+        expected_version (optional) is an optimistic lock: the change is refused with
+        "conflict" if someone else modified the report since the reviewer loaded it.
+        With all_or_nothing=True any conflict/not_found rolls back the whole batch.
+        Returns one result dict per action, in order.
+        """
+        results = []
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # Take the write lock up front: no lost updates
+        try:
+            for a in actions:
+                action = str(a.get("action", "")).upper()
+                if action not in ACTION_STATUS:
+                    results.append({"invoice_id": a.get("invoice_id"), "result": "invalid_action"})
+                    continue
+
+                def mutate(data, action=action, notes=a.get("notes") or ""):
+                    data["status"] = ACTION_STATUS[action]
+                    data["human_readable_summary"] = f"{data.get('human_readable_summary', '')} (Manually {action}: {notes})"
+
+                results.append(self._transition(conn, a.get("invoice_id"), action, mutate,
+                                                a.get("expected_version"), a.get("notes"), actor))
+
+            if all_or_nothing and any(r["result"] != "ok" for r in results):
+                conn.rollback()
+                for r in results:
+                    if r["result"] == "ok":
+                        r["result"] = "rolled_back"
+            else:
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        applied = sum(1 for r in results if r["result"] == "ok")
+        logger.info(f"Applied {applied}/{len(actions)} review actions (actor={actor})")
+        return results
+
+    def update_report(self, invoice_id: str, action: str, mutate, expected_version: int = None,
+                      notes: str = None, actor: str = None) -> dict:
+        """Single audited read-modify-write (e.g. a re-run result), same locking as apply_actions."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = self._transition(conn, invoice_id, action, mutate, expected_version, notes, actor)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+    def audit_trail(self, invoice_id: str) -> list:
+        rows = self._conn().execute(
+            "SELECT * FROM audit_log WHERE invoice_id = ? ORDER BY id", (invoice_id,)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def _transition(self, conn, invoice_id, action, mutate, expected_version, notes, actor) -> dict:
+        row = conn.execute(
+            "SELECT payload, version, status FROM reports WHERE invoice_id = ?", (invoice_id,)
+        ).fetchone()
+        if row is None:
+            return {"invoice_id": invoice_id, "result": "not_found"}
+        if expected_version is not None and int(expected_version) != row["version"]:
+            return {"invoice_id": invoice_id, "result": "conflict", "current_version": row["version"]}
+
+        data = json.loads(row["payload"])
+        mutate(data)
+        new_row = self._to_row(data)
+        conn.execute(
+            """UPDATE reports SET status=:status, vendor_name=:vendor_name, vendor_key=:vendor_key,
+                   total_amount=:total_amount, currency=:currency, invoice_date=:invoice_date,
+                   payload=:payload, version=version + 1
+               WHERE invoice_id=:invoice_id""",
+            new_row,
+        )
+        conn.execute(
+            """INSERT INTO audit_log (invoice_id, action, actor, notes, from_status, to_status,
+                   from_version, to_version, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (invoice_id, action, actor, notes, row["status"], new_row["status"],
+             row["version"], row["version"] + 1, datetime.now().isoformat()),
+        )
+        return {"invoice_id": invoice_id, "result": "ok", "status": new_row["status"],
+                "version": row["version"] + 1}
+
+    def import_json_dir(self, reports_dir: Path) -> int:
+        """One-off migration of legacy outputs/reports/*.json files into the store."""
+        count = 0
+        for f in Path(reports_dir).glob("*.json"):
+            try:
+                with open(f, "r", encoding="utf-8") as jf:
+                    self.upsert(json.load(jf))
+                count += 1
+            except Exception as e:
+                logger.warning(f"Skipping unreadable report {f.name}: {e}")
+        logger.info(f"Imported {count} legacy JSON reports")
+        return count
+
+    # --- Reads ---
+
+    def get(self, invoice_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT payload, version FROM reports WHERE invoice_id = ?", (invoice_id,)
+        ).fetchone()
+        return self._from_row(row) if row else None
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+    def list(self, limit: int = 50, cursor: str = None, status: str = None, vendor: str = None,
+             date_from: str = None, date_to: str = None, date_field: str = "created_at",
+             sort: str = "created_at", order: str = "desc", statuses: list = None,
+             vendors: list = None) -> dict:
+        """
+        Keyset-paginated listing. Filtering and ordering happen in SQL on indexed columns,
+        so cost depends on the page size and not on the number of stored reports.
+        Returns {"items": [...], "next_cursor": str | None}.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unsupported sort column: {sort}")
+        if date_field not in DATE_FIELDS:
+            raise ValueError(f"Unsupported date field: {date_field}")
+        sort_expr = SORT_COLUMNS[sort]
+        desc = order.lower() != "asc"
+        limit = max(1, min(int(limit), 500))
+
+        statuses = statuses or ([status] if status else None)
+        vendors = vendors or ([vendor] if vendor else None)
+        where, params = self._filters(statuses, vendors, date_from, date_to, date_field)
+        if cursor:
+            last_value, last_id = self._decode_cursor(cursor)
+            op = "<" if desc else ">"
+            where.append(f"({sort_expr}, invoice_id) {op} (?, ?)")
+            params.extend([last_value, last_id])
+
+        direction = "DESC" if desc else "ASC"
+        sql = f"SELECT payload, version, {sort_expr} AS sort_value, invoice_id FROM reports"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {sort_expr} {direction}, invoice_id {direction} LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._conn().execute(sql, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = None
+        if has_more and rows:
+            next_cursor = self._encode_cursor(rows[-1]["sort_value"], rows[-1]["invoice_id"])
+        return {"items": [self._from_row(r) for r in rows], "next_cursor": next_cursor}
+
+    def aggregate(self, metric: str = "count", group_by: str = None, statuses: list = None,
+                  vendors: list = None, date_from: str = None, date_to: str = None,
+                  date_field: str = "created_at", limit: int = 50) -> list:
+        """
+        COUNT / SUM / AVG of total_amount over the filtered reports, optionally grouped.
+        Totals are always split by currency so amounts in different currencies never add up.
+        Returns [{"group", "currency", "value", "invoices"}], largest first.
+        """
+        if metric not in AGGREGATES:
+            raise ValueError(f"Unsupported metric: {metric}")
+        if group_by is not None and group_by not in GROUP_COLUMNS:
+            raise ValueError(f"Unsupported group: {group_by}")
+        if date_field not in DATE_FIELDS:
+            raise ValueError(f"Unsupported date field: {date_field}")
+
+        where, params = self._filters(statuses, vendors, date_from, date_to, date_field)
+        group_expr = GROUP_COLUMNS[group_by] if group_by else "NULL"
+        currency_expr = "NULL" if metric == "count" else "currency"
+        sql = (f"SELECT {group_expr} AS grp, {currency_expr} AS cur, {AGGREGATES[metric]} AS value, "
+               f"COUNT(*) AS invoices FROM reports")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " GROUP BY grp, cur ORDER BY value DESC LIMIT ?"
+        params.append(limit)
+        return [{"group": r["grp"], "currency": r["cur"], "value": r["value"], "invoices": r["invoices"]}
+                for r in self._conn().execute(sql, params).fetchall()]
+
+    def vendor_names(self) -> dict:
+        """vendor_key -> display name for every vendor in the store."""
+        rows = self._conn().execute(
+            "SELECT vendor_key, MAX(vendor_name) AS name FROM reports WHERE vendor_key IS NOT NULL GROUP BY vendor_key"
+        ).fetchall()
+        return {r["vendor_key"]: r["name"] for r in rows}
+
+    # --- Helpers ---
+
+    @staticmethod
+    def _filters(statuses, vendors, date_from, date_to, date_field) -> tuple:
+        """WHERE clauses + params shared by list() and aggregate(); only indexed columns."""
+        where, params = [], []
+        if statuses:
+            where.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if vendors:
+            where.append(f"vendor_key IN ({', '.join('?' * len(vendors))})")
+            params.extend(v.strip().lower() for v in vendors)
+        if date_from:
+            where.append(f"{date_field} >= ?")
+            params.append(date_from)
+        if date_to:
+            # Inclusive end date: '2025-03-14' also matches '2025-03-14T18:00:00'
+            where.append(f"{date_field} <= ?")
+            params.append(date_to + "\uffff" if len(date_to) == 10 else date_to)
+        return where, params
+
+    @staticmethod
+    def _to_row(metadata: dict) -> dict:
+        invoice = (metadata.get("audit_trail") or {}).get("invoice_data") or {}
+        vendor = invoice.get("vendor_name")
+        total = invoice.get("total_amount")
+        try:
+            total = float(total) if total is not None else None
+        except (TypeError, ValueError):
+            total = None
+        return {
+            "invoice_id": metadata["invoice_id"],
+            "invoice_no": metadata.get("original_invoice_no"),
+            "vendor_name": vendor,
+            "vendor_key": vendor.strip().lower() if vendor else None,
+            "status": metadata.get("status"),
+            "total_amount": total,
+            "currency": invoice.get("currency"),
+            "invoice_date": normalize_date(invoice.get("invoice_date")),  # Date filters compare ISO strings
+            "created_at": metadata.get("timestamp") or datetime.now().isoformat(),
+            "html_report_path": metadata.get("html_report_path"),
+            "payload": json.dumps({k: v for k, v in metadata.items() if k != "version"}),
+        }
+
+    @staticmethod
+    def _from_row(row) -> dict:
+        data = json.loads(row["payload"])
+        data["version"] = row["version"]
+        return data
+
+    @staticmethod
+    def _encode_cursor(value, invoice_id: str) -> str:
+        raw = json.dumps([value, invoice_id]).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            value, invoice_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return value, invoice_id
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_report_store() -> ReportStore:
+    """Process-wide store; the first call migrates any legacy JSON reports."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            fresh = not DB_PATH.exists()
+            _store = ReportStore()
+            if fresh:
+                _store.import_json_dir(BASE_DIR / "outputs" / "reports")
+        return _store
@@ -0,0 +1,177 @@
+"""
+Claim / lease protocol for invoices in a shared incoming folder.
+
+    incoming/inv.pdf                                   waiting
+    incoming/.processing/<token>__inv.pdf              claimed (atomic rename: one winner)
+    incoming/.processing/<token>__inv.pdf.lease.json   owner, host, pid, attempts
+    processed/inv.pdf  |  failed/inv.pdf (+ .error.json)   finalized
+
+The lease file's mtime is the heartbeat. A lease whose heartbeat is older than
+LEASE_TTL_SEC belongs to a crashed worker and is re-claimed by another one, again
+with an atomic rename so only one worker wins. Safe for N processes or hosts as
+long as they share one filesystem (rename is atomic within a filesystem).
+"""
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from utils.logger import get_logger
+
+logger = get_logger("FILE_LEASE")
+
+LEASE_DIR_NAME = ".processing"
+LEASE_TTL_SEC = float(os.getenv("LEASE_TTL_SEC", "120"))
+HEARTBEAT_SEC = LEASE_TTL_SEC / 4
+MAX_ATTEMPTS = int(os.getenv("LEASE_MAX_ATTEMPTS", "3"))
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class Lease:
+    """One claimed file. Keep it alive with start_heartbeat() and end it with finalize()."""
+    def __init__(self, path: Path, file_name: str, owner: str, attempts: int = 1):
+        self.path = Path(path)
+        self.file_name = file_name
+        self.owner = owner
+        self.attempts = attempts
+        self._stop = threading.Event()
+
+    @property
+    def sidecar(self) -> Path:
+        return _sidecar(self.path)
+
+    def heartbeat(self):
+        os.utime(self.path, None)
+
+    def start_heartbeat(self):
+        def beat():
+            while not self._stop.wait(HEARTBEAT_SEC):
+                try:
+                    self.heartbeat()
+                except FileNotFoundError:
+                    return  # Finalized (or stolen after we stalled past the TTL)
+        threading.Thread(target=beat, name=f"lease-{self.file_name}", daemon=True).start()
+        return self
+
+    def finalize(self, success: bool, dest_dir: Path, error: str = None) -> Path:
+        """Moves the file to processed/ (success) or failed/ and drops the lease."""
+        self._stop.set()
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        destination = dest_dir / self.file_name
+        if destination.exists():
+            destination = dest_dir / f"{uuid.uuid4().hex[:8]}_{self.file_name}"
+        shutil.move(str(self.path), str(destination))
+        if not success:
+            with open(destination.with_name(destination.name + ".error.json"), "w", encoding="utf-8") as f:
+                json.dump({"error": error, "owner": self.owner, "attempts": self.attempts,
+                           "failed_at": datetime.now().isoformat()}, f, indent=2)
+        self.sidecar.unlink(missing_ok=True)
+        return destination
+
+    def release(self, input_dir: Path):
+        """Gives the file back to the incoming folder unprocessed (e.g. on shutdown)."""
+        self._stop.set()
+        target = Path(input_dir) / self.file_name
+        if not target.exists():
+            os.rename(self.path, target)
+        self.sidecar.unlink(missing_ok=True)
+
+def _lease_dir(input_dir: Path) -> Path:
+    path = Path(input_dir) / LEASE_DIR_NAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def _sidecar(lease_path: Path) -> Path:
+    return lease_path.with_name(lease_path.name + ".lease.json")
+
+def _write_sidecar(lease_path: Path, info: dict):
+    # Written BEFORE the rename, so a fresh lease never looks expired to other workers
+    with open(_sidecar(lease_path), "w", encoding="utf-8") as f:
+        json.dump(info, f)
+
+def _new_lease_path(input_dir: Path, file_name: str) -> Path:
+    return _lease_dir(input_dir) / f"{uuid.uuid4().hex[:12]}__{file_name}"
+
+def claim(path: Path, owner: str = None) -> Optional[Lease]:
+    """Atomically claims one incoming file. Returns None if another worker got it first."""
+    path = Path(path)
+    owner = owner or default_owner()
+    lease_path = _new_lease_path(path.parent, path.name)
+    _write_sidecar(lease_path, {"owner": owner, "file_name": path.name, "attempts": 1,
+                                "claimed_at": datetime.now().isoformat()})
+    try:
+        os.rename(path, lease_path)
+    except FileNotFoundError:
+        _sidecar(lease_path).unlink(missing_ok=True)
+        return None
+    os.utime(lease_path, None)  # rename keeps the old mtime; start the heartbeat clock now
+    return Lease(lease_path, path.name, owner)
+
+def _heartbeat_age(lease_path: Path) -> float:
+    newest = lease_path.stat().st_mtime
+    try:
+        newest = max(newest, _sidecar(lease_path).stat().st_mtime)
+    except FileNotFoundError:
+        pass
+    return time.time() - newest
+
+def reclaim_expired(input_dir: Path, failed_dir: Path, owner: str = None) -> list:
+    """
+    Takes over leases whose owner stopped heart-beating. Files that already crashed
+    a worker MAX_ATTEMPTS times are moved to failed/ instead of being retried forever.
+    """
+    owner = owner or default_owner()
+    reclaimed = []
+    for stale in _lease_dir(input_dir).iterdir():
+        if stale.name.endswith(".lease.json"):
+            continue
+        try:
+            if _heartbeat_age(stale) < LEASE_TTL_SEC:
+                continue
+            with open(_sidecar(stale), "r", encoding="utf-8") as f:
+                info = json.load(f)
+        except FileNotFoundError:
+            continue  # Finalized or reclaimed meanwhile
+        except ValueError:
+            info = {}
+
+        file_name = info.get("file_name") or stale.name.split("__", 1)[-1]
+        attempts = int(info.get("attempts", 1)) + 1
+        lease_path = _new_lease_path(input_dir, file_name)
+        _write_sidecar(lease_path, {"owner": owner, "file_name": file_name, "attempts": attempts,
+                                    "claimed_at": datetime.now().isoformat(),
+                                    "reclaimed_from": info.get("owner")})
+        try:
+            os.rename(stale, lease_path)
+        except FileNotFoundError:
+            _sidecar(lease_path).unlink(missing_ok=True)
+            continue  # Another worker reclaimed it first
+        os.utime(lease_path, None)
+        _sidecar(stale).unlink(missing_ok=True)
+
+        lease = Lease(lease_path, file_name, owner, attempts)
+        logger.warning(f"Reclaimed {file_name} from {info.get('owner')} (attempt {attempts})")
+        if attempts > MAX_ATTEMPTS:
+            lease.finalize(False, failed_dir, error=f"Gave up after {attempts - 1} crashed attempts")
+            continue
+        reclaimed.append(lease)
+    return reclaimed
+
+def finalize_path(lease_path: str, success: bool, dest_dir: Path, error: str = None) -> Path:
+    """finalize() for callers that only kept the lease path (e.g. from workflow state)."""
+    lease_path = Path(lease_path)
+    try:
+        with open(_sidecar(lease_path), "r", encoding="utf-8") as f:
+            info = json.load(f)
+    except (FileNotFoundError, ValueError):
+        info = {}
+    lease = Lease(lease_path, info.get("file_name") or lease_path.name.split("__", 1)[-1],
+                  info.get("owner"), int(info.get("attempts", 1)))
+    return lease.finalize(success, dest_dir, error)
@@ -1,35 +1,47 @@
-import os
-import shutil
 from pathlib import Path
 from protocols.mcp import BaseTool
+from tools.file_lease import claim, reclaim_expired
 
 class InvoiceWatcherTool(BaseTool):
-    def __init__(self, input_dir="data/incoming", processing_dir="data/processed"):
+    def __init__(self, input_dir="data/incoming", processing_dir="data/processed", failed_dir="data/failed"):
         super().__init__(name="invoice_watcher", description="Monitors folder for new invoices.")
         self.input_path = Path(input_dir)
         self.process_path = Path(processing_dir)
-        
+        self.failed_path = Path(failed_dir)
+
         # Ensure directories exist
         self.input_path.mkdir(parents=True, exist_ok=True)
         self.process_path.mkdir(parents=True, exist_ok=True)
+        self.failed_path.mkdir(parents=True, exist_ok=True)
 
     def execute(self) -> dict:
-        """Checks input folder. Moves first found file to processed. Returns path."""
+        """
+        Claims one invoice with a lease (safe with several watchers on the same folder).
+        The caller finalizes it with tools.file_lease.finalize_path(lease_path, ...)
+        (main_workflow.run_workflow does this for the monitor node).
+        """
+        # Leases of crashed workers come first: they have waited longest
+        for lease in reclaim_expired(self.input_path, self.failed_path):
+            lease.start_heartbeat()
+            return self._found(lease)
+
         # Filter for PDF or Images
         valid_extensions = {'.pdf', '.png', '.jpg', '.jpeg'}
-        files = [f for f in self.input_path.iterdir() if f.suffix.lower() in valid_extensions]
-        
-        if not files:
-            return {"found": False}
-        
-        target_file = files[0] # Pick the first one
-        dest_file = self.process_path / target_file.name
-        
-        # Move file to prevent double-reading
-        shutil.move(str(target_file), str(dest_file))
-        
+        files = [f for f in self.input_path.iterdir() if f.is_file() and f.suffix.lower() in valid_extensions]
+
+        for target_file in files:
+            lease = claim(target_file)
+            if lease:  # None: another watcher claimed it first, try the next one
+                lease.start_heartbeat()
+                return self._found(lease)
+
+        return {"found": False}
+
+    @staticmethod
+    def _found(lease) -> dict:
         return {
             "found": True,
-            "file_path": str(dest_file),
-            "file_name": target_file.name
-        }
\ No newline at end of file
+            "file_path": str(lease.path),
+            "file_name": lease.file_name,
+            "lease_path": str(lease.path)
+        }
@@ -0,0 +1,118 @@
+"""
+Durable spool for index chunks the writer process could not take yet.
+
+    data/index_outbox.jsonl        one line per invoice: {"id", "file_name", "documents": [...]}
+    data/index_outbox.jsonl.lock   flock for appends and for rewriting after a drain
+    data/index_outbox.jsonl.drain  flock of the one process/thread currently delivering
+
+The ingestion daemon's workflow outcome does not depend on the index writer being up:
+when forwarding fails the chunks are appended here (fsync) and delivered later by
+drain(), oldest first. A batch leaves the spool only after the writer accepted it.
+"""
+import fcntl
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from utils.logger import get_logger
+
+logger = get_logger("INDEX_OUTBOX")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+OUTBOX_PATH = Path(os.getenv("INDEX_OUTBOX_PATH", str(BASE_DIR / "data" / "index_outbox.jsonl")))
+OUTBOX_RETRY_SEC = float(os.getenv("INDEX_OUTBOX_RETRY_SEC", "30"))
+
+class IndexOutbox:
+    def __init__(self, path: Path = OUTBOX_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock_path = self.path.with_name(self.path.name + ".lock")
+        self._drain_lock_path = self.path.with_name(self.path.name + ".drain")
+
+    @contextmanager
+    def _file_lock(self):
+        # Several daemons may share data/: appends and the post-drain rewrite must not interleave
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def put(self, documents: list, file_name: str = None):
+        """documents: [{"page_content", "metadata"}]. Durable once this returns."""
+        line = json.dumps({"id": uuid.uuid4().hex, "file_name": file_name, "documents": documents},
+                          default=str) + "\n"
+        with self._file_lock():
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        logger.warning("Spooled %d chunks of %s for later indexing", len(documents), file_name)
+
+    def pending(self) -> int:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return sum(1 for line in f if line.strip())
+        except FileNotFoundError:
+            return 0
+
+    def drain(self, send) -> int:
+        """
+        Calls send(documents) for each spooled batch, oldest first, and stops at the first
+        failure (the writer is still down). Returns the number of batches delivered.
+        The network calls run without the file lock, so workers can keep spooling meanwhile.
+        """
+        drain_lock = open(self._drain_lock_path, "a")
+        try:
+            # One drainer across threads and daemons, or a batch could be sent twice
+            fcntl.flock(drain_lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            drain_lock.close()
+            return 0
+        try:
+            with self._file_lock():
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        lines = f.readlines()
+                except FileNotFoundError:
+                    return 0
+            delivered = set()
+            for line in lines:
+                try:
+                    batch = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Torn line from a crash mid-append: never acknowledged, nothing to send
+                try:
+                    send(batch["documents"])
+                except Exception as e:
+                    logger.warning("Index writer still unavailable (%s); %d batches stay spooled",
+                                   e, len(lines) - len(delivered))
+                    break
+                delivered.add(batch["id"])
+            if delivered:
+                self._remove(delivered)
+                logger.info("Delivered %d spooled batches to the index writer", len(delivered))
+            return len(delivered)
+        finally:
+            drain_lock.close()  # Closing the file drops the flock
+
+    def _remove(self, ids: set):
+        # Re-read under the lock: batches spooled during the drain are kept
+        with self._file_lock():
+            keep = []
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        if json.loads(line)["id"] in ids:
+                            continue
+                    except json.JSONDecodeError:
+                        continue
+                    keep.append(line)
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(keep)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
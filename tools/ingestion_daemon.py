@@ -0,0 +1,269 @@
+"""
+Event-driven ingestion: watches data/incoming and runs the invoice workflow for
+every new file on a worker pool.
+
+    python -m tools.ingestion_daemon
+
+Filesystem events only mark a file as pending; it is enqueued once its size has
+stopped changing for INGEST_DEBOUNCE_SEC, so half-copied uploads are never read.
+Workers claim each file with a lease (tools.file_lease), so several daemons can
+share one incoming folder and a crashed daemon's files are picked up again.
+Chunks are indexed by the API process (INDEX_WRITER_URL), which owns the FAISS index;
+while it is unreachable they wait in a durable outbox (tools.index_outbox) and the
+invoice itself is archived on its workflow result alone.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+from utils.logger import get_logger
+from utils.metrics import LatencyWindow
+from tools.file_lease import claim, reclaim_expired, LEASE_TTL_SEC
+from tools.index_outbox import IndexOutbox, OUTBOX_RETRY_SEC
+from storage.checkpoints import get_checkpointer, new_thread_id, thread_config
+
+logger = get_logger("INGEST")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+INCOMING_DIR = BASE_DIR / "data" / "incoming"
+PROCESSED_DIR = BASE_DIR / "data" / "processed"
+FAILED_DIR = BASE_DIR / "data" / "failed"
+VALID_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg"}
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+DEBOUNCE_SEC = float(os.getenv("INGEST_DEBOUNCE_SEC", "1.0"))
+STATS_INTERVAL_SEC = float(os.getenv("INGEST_STATS_INTERVAL_SEC", "30"))
+
+class _IncomingHandler(FileSystemEventHandler):
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.daemon.touch(Path(event.src_path))
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.daemon.touch(Path(event.src_path))
+
+    def on_moved(self, event):
+        # Atomic "write to temp name, then rename" uploads show up as a move into the folder
+        if not event.is_directory:
+            self.daemon.touch(Path(event.dest_path))
+
+class IngestionDaemon:
+    """
+    pending  -> seen by a filesystem event, waiting for the file size to settle
+    queued   -> handed to the worker pool
+    running  -> workflow in progress
+    """
+    def __init__(self, input_dir: Path = INCOMING_DIR, processed_dir: Path = PROCESSED_DIR,
+                 failed_dir: Path = FAILED_DIR, workers: int = INGEST_WORKERS):
+        self.input_dir = Path(input_dir)
+        self.processed_dir = Path(processed_dir)
+        self.failed_dir = Path(failed_dir)
+        for d in (self.input_dir, self.processed_dir, self.failed_dir):
+            d.mkdir(parents=True, exist_ok=True)
+
+        self._pending = {}      # path -> (last_event_time, last_size)
+        self._active = set()    # queued or running, never enqueued twice
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._observer = None
+        self._workflow = None
+        self._outbox = IndexOutbox()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.lost_claims = 0
+        self.reclaimed = 0
+        self.latency = LatencyWindow("ingest_file")          # Enqueue -> archived (includes queue wait)
+        self.work_latency = LatencyWindow("ingest_workflow")  # Workflow + indexing only
+
+    # --- Event intake ---
+
+    def touch(self, path: Path):
+        if path.suffix.lower() not in VALID_EXTENSIONS or path.parent != self.input_dir:
+            return
+        with self._lock:
+            if path not in self._active:
+                self._pending[path] = (time.monotonic(), -1)
+
+    def _settle_loop(self):
+        """Promotes pending files whose size did not change during the debounce window."""
+        next_reclaim = 0.0
+        while not self._stop.wait(DEBOUNCE_SEC / 2):
+            now = time.monotonic()
+            if now >= next_reclaim:
+                next_reclaim = now + LEASE_TTL_SEC / 2
+                self._reclaim()
+            ready = []
+            with self._lock:
+                for path, (last_event, last_size) in list(self._pending.items()):
+                    try:
+                        size = path.stat().st_size
+                    except FileNotFoundError:
+                        del self._pending[path]  # Moved away or deleted before it settled
+                        continue
+                    if size != last_size:
+                        self._pending[path] = (now, size)
+                    elif now - last_event >= DEBOUNCE_SEC and size > 0:
+                        del self._pending[path]
+                        self._active.add(path)
+                        ready.append(path)
+            for path in ready:
+                self._enqueue(path)
+
+    def _enqueue(self, path: Path, lease=None):
+        with self._lock:
+            self.queued += 1
+        self._pool.submit(self._process, path, time.perf_counter(), lease)
+
+    def _reclaim(self):
+        try:
+            leases = reclaim_expired(self.input_dir, self.failed_dir)
+        except Exception as e:
+            logger.error("Lease reclaim failed: %s", e)
+            return
+        for lease in leases:
+            with self._lock:
+                self.reclaimed += 1
+            # Beat from now on: the pool may be busy for longer than LEASE_TTL_SEC, and a silent
+            # lease would be reclaimed (and processed) a second time by another daemon
+            lease.start_heartbeat()
+            self._enqueue(self.input_dir / lease.file_name, lease)
+
+    # --- Workers ---
+
+    def _get_workflow(self):
+        # Compiled once and shared: LangGraph graphs are safe to invoke concurrently
+        if self._workflow is None:
+            from main_workflow import build_graph
+            self._workflow = build_graph(checkpointer=get_checkpointer())
+        return self._workflow
+
+    def _process(self, path: Path, enqueued_at: float, lease=None):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            if lease is None:
+                lease = claim(path)
+                if lease is None:
+                    with self._lock:
+                        self.lost_claims += 1  # Another daemon claimed it first
+                    return
+                lease.start_heartbeat()  # Reclaimed leases are already beating (see _reclaim)
+            started = time.perf_counter()
+            logger.info("Processing %s", lease.file_name)
+            try:
+                # Checkpointed per file: a failed run can be resumed via /api/workflows/resume
+                thread_id = new_thread_id(lease.file_name)
+                final_state = self._get_workflow().invoke({
+                    "status": "STARTING",
+                    "file_name": lease.file_name,
+                    "file_path": str(lease.path),
+                    "thread_id": thread_id,
+                }, config=thread_config(thread_id))
+            except Exception as e:
+                lease.finalize(False, self.failed_dir, error=str(e))
+                raise
+            # The file's fate depends on the workflow only; indexing is a separate, retried hop
+            lease.finalize(True, self.processed_dir)
+
+            # FAILED runs are indexed once, when /api/workflows/resume completes them
+            if final_state.get("raw_text") and final_state.get("status") != "FAILED":
+                self._index(final_state, lease.file_name)
+
+            ms = (time.perf_counter() - enqueued_at) * 1000
+            self.latency.record(ms)
+            self.work_latency.record((time.perf_counter() - started) * 1000)
+            with self._lock:
+                self.completed += 1
+            logger.info("Finished %s in %.0f ms (status=%s)", path.name, ms, final_state.get("status"))
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.error("Failed %s: %s", path.name, e)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self._active.discard(path)
+
+    def _index(self, final_state: dict, file_name: str):
+        """The API process is the index's only writer: hand it the chunks, or spool them."""
+        from agents.indexing_tool import as_payload, forward_invoice_documents
+        from agents.invoice_chunker import chunk_invoice
+        documents = [as_payload(d) for d in chunk_invoice(final_state, file_name)]
+        if not documents:
+            return
+        if not self._outbox.pending():  # Otherwise keep the order: queue behind what is spooled
+            try:
+                forward_invoice_documents(documents, retries=1)
+                return
+            except Exception as e:
+                logger.warning("Index writer unavailable for %s: %s", file_name, e)
+        self._outbox.put(documents, file_name=file_name)
+
+    def _outbox_loop(self):
+        from agents.indexing_tool import forward_invoice_documents
+        while not self._stop.wait(OUTBOX_RETRY_SEC):
+            try:
+                self._outbox.drain(lambda documents: forward_invoice_documents(documents, retries=1))
+            except Exception as e:
+                logger.error("Index outbox drain failed: %s", e)
+
+    # --- Lifecycle ---
+
+    def start(self):
+        self._observer = Observer()
+        self._observer.schedule(_IncomingHandler(self), str(self.input_dir), recursive=False)
+        self._observer.start()
+        threading.Thread(target=self._settle_loop, name="ingest-debounce", daemon=True).start()
+        threading.Thread(target=self._outbox_loop, name="index-outbox", daemon=True).start()
+
+        # Files dropped while the daemon was down get no event: pick them up once at start
+        for path in sorted(self.input_dir.iterdir()):
+            self.touch(path)
+        logger.info("Watching %s with %d workers", self.input_dir, self._pool._max_workers)
+
+    def stop(self, wait: bool = True):
+        self._stop.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+        self._pool.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "queued": self.queued,
+                "running": self.running,
+                "queue_depth": len(self._pending) + self.queued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "lost_claims": self.lost_claims,
+                "reclaimed": self.reclaimed,
+                "index_outbox": self._outbox.pending(),
+                "latency_ms": self.latency.snapshot(),
+                "workflow_ms": self.work_latency.snapshot(),
+            }
+
+    def run_forever(self):
+        self.start()
+        try:
+            while True:
+                time.sleep(STATS_INTERVAL_SEC)
+                logger.info("Stats: %s", self.stats())
+        except KeyboardInterrupt:
+            logger.info("Stopping (waiting for running invoices to finish)...")
+            self.stop()
+
+if __name__ == "__main__":
+    IngestionDaemon().run_forever()
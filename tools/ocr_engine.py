@@ -5,6 +5,9 @@ import numpy as np
 from pdf2image import convert_from_path
 from protocols.mcp import BaseTool
 from pathlib import Path
+from utils.logger import get_logger
+
+logger = get_logger("OCR_ENGINE")
 
 class DataHarvesterTool(BaseTool):
     def __init__(self):
@@ -12,7 +15,7 @@ class DataHarvesterTool(BaseTool):
             name="data_harvester",
             description="Extracts text from invoices. Uses PDFPlumber for digital PDFs and EasyOCR for scans."
         )
-        print(" [Init] Loading EasyOCR models... (This happens only once)")
+        logger.info("Loading EasyOCR models... (This happens only once)")
         # We load English, Spanish, German
         self.reader = easyocr.Reader(['en', 'es', 'de'], gpu=False)
 
@@ -49,7 +52,7 @@ class DataHarvesterTool(BaseTool):
             # Strategy 2: Fallback to Optical Character Recognition (EasyOCR)
             # Runs if file is an image OR if PDFPlumber found nothing (scanned PDF)
             if not extracted_text.strip():
-                print(" [OCR] Digital extraction empty. Switching to Vision OCR...")
+                logger.info("Digital extraction empty. Switching to Vision OCR...")
                 method = "EasyOCR (Vision)"
                 
                 images = []
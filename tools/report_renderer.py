@@ -0,0 +1,64 @@
+from datetime import datetime
+from pathlib import Path
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from protocols.mcp import BaseTool
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+TEMPLATE_DIR = BASE_DIR / "templates" / "reports"
+
+# Bump this (and add invoice_report_<version>.html.j2) when the report layout changes.
+# Old reports keep the version they were rendered with in their metadata.
+REPORT_TEMPLATE_VERSION = "v1"
+
+class ReportRendererTool(BaseTool):
+    """
+    Renders the HTML audit report locally from a versioned Jinja template.
+    Replaces the LLM-written HTML: deterministic output in milliseconds.
+    """
+    def __init__(self, template_version: str = REPORT_TEMPLATE_VERSION):
+        super().__init__(
+            name="report_renderer",
+            description="Renders the invoice audit HTML report from structured data."
+        )
+        self.template_version = template_version
+        self.env = Environment(
+            loader=FileSystemLoader(str(TEMPLATE_DIR)),
+            autoescape=select_autoescape(["html", "j2"]),
+            trim_blocks=True,
+            lstrip_blocks=True,
+        )
+        self.template = self.env.get_template(f"invoice_report_{template_version}.html.j2")
+
+    def build_context(self, report_data: dict, narrative: str = None) -> dict:
+        """Maps the merged invoice + validation payload onto template variables."""
+        status = report_data.get("validation_status", "Unknown")
+        return {
+            "invoice": report_data,
+            "line_items": report_data.get("line_items") or [],
+            "status": status,
+            "passed": status in ["PASS", "Approved", "SUCCESS"],
+            "discrepancies": report_data.get("discrepancies") or [],
+            "narrative": narrative,
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "template_version": self.template_version,
+        }
+
+    def execute(self, report_data: dict, output_path: str, narrative: str = None) -> dict:
+        """
+        Streams the rendered template straight to disk, so very large
+        line-item tables are never held in memory as one string.
+        """
+        path = Path(output_path)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        context = self.build_context(report_data, narrative)
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for chunk in self.template.generate(**context):
+                f.write(chunk)
+        tmp_path.replace(path)  # Atomic swap: readers never see a half-written report
+
+        return {
+            "status": "success",
+            "path": str(path),
+            "template_version": self.template_version,
+        }
@@ -0,0 +1,109 @@
+"""
+Streams an uploaded invoice into the incoming folder without blocking the event loop.
+
+    incoming/.upload-<token>-inv.pdf.part    being written (ignored by watchers: .part suffix)
+    incoming/inv.pdf                         complete, renamed into place atomically
+
+One pass over the upload: each chunk is size-checked, hashed (sha256) and written
+by a worker thread; the first bytes decide the MIME type. Oversized, empty or
+non-invoice content is rejected before anything appears under the final name.
+"""
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from starlette.concurrency import run_in_threadpool
+from utils.logger import get_logger
+
+logger = get_logger("UPLOAD_RECEIVER")
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+
+# Magic bytes -> MIME type, and the file extensions each type may carry
+_SIGNATURES = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+EXTENSIONS_BY_TYPE = {
+    "application/pdf": {".pdf"},
+    "image/png": {".png"},
+    "image/jpeg": {".jpg", ".jpeg"},
+}
+
+class UploadRejected(Exception):
+    """The upload cannot be accepted; status_code is the HTTP status to answer with."""
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def sniff_mime(head: bytes):
+    for signature, mime in _SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    return None
+
+def safe_filename(filename: str) -> str:
+    """Base name only: a client-supplied "../../x.pdf" must not leave the incoming folder."""
+    name = Path((filename or "").replace("\\", "/")).name.strip()
+    if not name or name.startswith("."):
+        raise UploadRejected(400, f"Invalid file name: {filename!r}")
+    return name
+
+def _write_chunk(fh, hasher, chunk: bytes):
+    hasher.update(chunk)
+    fh.write(chunk)
+
+def _discard(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+async def receive_upload(upload, dest_dir: Path, max_bytes: int = MAX_UPLOAD_BYTES) -> dict:
+    """
+    Writes a FastAPI UploadFile to dest_dir/<name>. Returns
+    {"path", "file_name", "size_bytes", "sha256", "content_type"}; raises UploadRejected.
+    """
+    name = safe_filename(upload.filename)
+    # Size announced by the client / multipart parser: reject before copying a byte
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadRejected(413, f"{name} is {upload.size} bytes, limit is {max_bytes}")
+
+    dest = Path(dest_dir) / name
+    tmp = dest.with_name(f".upload-{uuid.uuid4().hex[:8]}-{name}.part")
+    hasher = hashlib.sha256()
+    size, mime = 0, None
+
+    fh = await run_in_threadpool(open, tmp, "wb")
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            if mime is None:
+                mime = sniff_mime(chunk[:16])
+                if mime is None:
+                    raise UploadRejected(415, f"{name}: content is not a PDF, PNG or JPEG")
+                if dest.suffix.lower() not in EXTENSIONS_BY_TYPE[mime]:
+                    raise UploadRejected(415, f"{name}: content is {mime}, which does not match the '{dest.suffix}' extension")
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadRejected(413, f"{name} exceeds the {max_bytes} byte upload limit")
+            await run_in_threadpool(_write_chunk, fh, hasher, chunk)
+        if size == 0:
+            raise UploadRejected(400, f"{name} is empty")
+        await run_in_threadpool(fh.close)
+        # Same directory, same filesystem: the complete file appears under its name in one step
+        await run_in_threadpool(os.replace, tmp, dest)
+    except BaseException:
+        # Synchronous on purpose: also runs when the request is cancelled mid-upload
+        fh.close()
+        _discard(tmp)
+        raise
+
+    digest = hasher.hexdigest()
+    logger.info("Received %s (%d bytes, %s, sha256 %s)", name, size, mime, digest[:12])
+    return {"path": dest, "file_name": name, "size_bytes": size, "sha256": digest, "content_type": mime}
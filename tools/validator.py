@@ -1,5 +1,7 @@
 import requests
+from urllib.parse import quote
 from protocols.mcp import BaseTool
+from utils.metrics import timed
 
 class BusinessValidationTool(BaseTool):
     # --- FIX: Point to Port 8003 (where Mock ERP is now running) ---
@@ -12,13 +14,14 @@ class BusinessValidationTool(BaseTool):
 
     def execute(self, validation_type: str, key: str) -> dict:
         """
-        validation_type: 'po' or 'vendor' or 'sku'
-        key: The ID to check (e.g., 'PO-1001')
+        validation_type: 'po', 'vendor', 'vendor_name' or 'sku'
+        key: The ID to check (e.g., 'PO-1001'), or the vendor name for 'vendor_name'
         """
         # Map simple commands to API endpoints
         endpoints = {
             "po": f"/purchase_orders/{key}",
             "vendor": f"/vendors/{key}",
+            "vendor_name": f"/vendors?name={quote(key)}",
             "sku": f"/skus/{key}"
         }
 
@@ -29,7 +32,8 @@ class BusinessValidationTool(BaseTool):
         
         try:
             # Call the Mock ERP API
-            response = requests.get(url)
+            with timed("erp_request", type=validation_type):
+                response = requests.get(url)
             
             if response.status_code == 200:
                 data = response.json()
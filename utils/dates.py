@@ -0,0 +1,30 @@
+import re
+from datetime import datetime
+from typing import Optional
+
+# Invoice dates arrive as whatever the LLM read off the document. Day-first wins over
+# month-first for slashed dates: the invoices are mostly European ("03/04/2024" = 3 April).
+_FORMATS = (
+    "%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d",
+    "%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%y", "%d/%m/%y",
+    "%m/%d/%Y",
+    "%d %B %Y", "%d %b %Y", "%B %d %Y", "%b %d %Y",
+)
+_ISO_PREFIX_RE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+def normalize_date(value) -> Optional[str]:
+    """ISO "YYYY-MM-DD" for an extracted invoice date, or None when it cannot be parsed."""
+    if value in (None, "", "null", "None"):
+        return None
+    text = str(value).strip()
+    m = _ISO_PREFIX_RE.match(text)
+    if m:
+        text = m.group(0)  # "2024-03-15T00:00:00" and friends
+    text = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", text)       # "15th March 2024"
+    text = re.sub(r"\s+", " ", text.replace(",", " ")).strip()  # "March 15, 2024"
+    for fmt in _FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
@@ -1,10 +1,31 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
 import sys
+import threading
+from datetime import datetime, timezone
 import colorama
 from colorama import Fore, Style
 
 colorama.init(autoreset=True)
 
+# LOG_LEVEL is the default for every logger; LOG_LEVELS overrides single ones ("RAG_RETRIEVAL=DEBUG,MCP_CLIENT=WARNING")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = dict(
+    part.split("=", 1) for part in os.getenv("LOG_LEVELS", "").replace(" ", "").split(",") if "=" in part
+)
+# "text": coloured lines for a terminal; "json": one JSON object per line for log shippers
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Share of log_payload() calls that are actually emitted (large debug dumps only)
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+# Records beyond this are dropped (and counted) instead of blocking the caller
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
 class ColoredFormatter(logging.Formatter):
     COLORS = {
         'DEBUG': Fore.CYAN,
@@ -17,16 +38,93 @@ class ColoredFormatter(logging.Formatter):
     def format(self, record):
         color = self.COLORS.get(record.levelname, Fore.WHITE)
         message = super().format(record)
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            message = f"{message}\n{json.dumps(payload, indent=2, default=str)}"
         return f"{color}{message}{Style.RESET_ALL}"
 
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg (+ payload, exc)."""
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            entry["payload"] = payload
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread. Only the %-args are merged here; colours,
+    JSON encoding, payload dumps and the stdout write all happen off the caller's thread.
+    """
+    dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _NonBlockingQueueHandler.dropped += 1
+
+_queue_handler = None
+_listener = None
+_setup_lock = threading.Lock()
+
+def _get_queue_handler() -> logging.Handler:
+    """One queue + listener thread per process, shared by every logger."""
+    global _queue_handler, _listener
+    with _setup_lock:
+        if _queue_handler is None:
+            log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            handler = logging.StreamHandler(sys.stdout)
+            if LOG_FORMAT == "json":
+                handler.setFormatter(JsonFormatter())
+            else:
+                handler.setFormatter(ColoredFormatter('%(asctime)s | [%(name)s] | %(levelname)s | %(message)s', datefmt='%H:%M:%S'))
+            _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=False)
+            _listener.start()
+            atexit.register(_listener.stop)  # Flushes what is still queued
+            _queue_handler = _NonBlockingQueueHandler(log_queue)
+        return _queue_handler
+
 def get_logger(name):
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG) 
-    
+    logger.setLevel(LOG_LEVELS.get(name, LOG_LEVEL).upper())
+
     if not logger.handlers:
-        handler = logging.StreamHandler(sys.stdout)
-        formatter = ColoredFormatter('%(asctime)s | [%(name)s] | %(levelname)s | %(message)s', datefmt='%H:%M:%S')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        
-    return logger
\ No newline at end of file
+        logger.addHandler(_get_queue_handler())
+
+    return logger
+
+def log_payload(logger, message, payload, *args, level=logging.DEBUG, sample_rate=None):
+    """
+    Logs a large structure (e.g. extracted invoice JSON) for a sample of calls.
+    Nothing is serialized unless the level is enabled and the call is sampled;
+    the dump itself is done by the listener thread.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if random.random() >= (LOG_DEBUG_SAMPLE_RATE if sample_rate is None else sample_rate):
+        return
+    logger.log(level, message, *args, extra={"payload": payload})
+
+def logging_stats() -> dict:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _NonBlockingQueueHandler.dropped,
+        "format": LOG_FORMAT,
+        "level": LOG_LEVEL,
+    }
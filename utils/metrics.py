@@ -0,0 +1,240 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+class LatencyWindow:
+    """
+    Rolling window of the last N latency samples (milliseconds) with percentiles.
+    Cheap enough to record on every request.
+    """
+    def __init__(self, name: str, size: int = 2048):
+        self.name = name
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, ms: float):
+        with self._lock:
+            self._samples.append(ms)
+            self.count += 1
+
+    def percentiles(self, points=(50, 90, 95, 99)) -> dict:
+        with self._lock:
+            data = sorted(self._samples)
+        if not data:
+            return {f"p{p}": None for p in points}
+        return {f"p{p}": round(data[min(len(data) - 1, int(len(data) * p / 100))], 2) for p in points}
+
+    def snapshot(self) -> dict:
+        return {"name": self.name, "count": self.count, "window": len(self._samples), **self.percentiles()}
+
+# --- Prometheus-style metrics ---
+# Counters, gauges and histograms aggregated in-process and rendered in the Prometheus
+# text format at /metrics. Recording is a dict lookup plus a lock, so every node,
+# MCP call, ERP lookup, LLM call and FAISS operation can be wrapped in timed(...).
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans range from sub-millisecond FAISS searches to multi-second OCR / LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str = ""):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help or self.name}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items)
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str = "", buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        self._observe(_label_key(labels), value)
+
+    def _observe(self, key: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts + overflow slot, sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help or self.name}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(e[0]), e[1], e[2])) for key, e in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Get-or-create access to named metrics; one registry per process (see `registry`)."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, help, **kwargs)
+        if not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str = "") -> Gauge:
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str = "", buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+def get_registry() -> MetricsRegistry:
+    return registry
+
+def render_prometheus() -> str:
+    return registry.render()
+
+class timed:
+    """
+    Timing span, usable as a context manager or a decorator:
+
+        with timed("mcp_call", tool="ocr_extract"): ...
+
+        @timed("workflow_node", graph="rag", node="retrieve")
+        def retrieval_node(state): ...
+
+    Records <metric>_seconds (histogram), <metric>_in_flight (gauge) and
+    <metric>_errors_total (counter, spans that raised), all with the given labels.
+    """
+    __slots__ = ("metric", "labels", "_key", "_hist", "_in_flight", "_errors", "_start")
+
+    def __init__(self, metric: str, **labels):
+        self.metric = metric
+        self.labels = labels
+        self._key = _label_key(labels)
+        self._hist = registry.histogram(f"{metric}_seconds", f"Latency of {metric} spans in seconds")
+        self._in_flight = registry.gauge(f"{metric}_in_flight", f"{metric} spans currently running")
+        self._errors = registry.counter(f"{metric}_errors_total", f"{metric} spans that raised")
+
+    def _begin(self):
+        with self._in_flight._lock:
+            values = self._in_flight._values
+            values[self._key] = values.get(self._key, 0) + 1
+        return time.perf_counter()
+
+    def _end(self, start: float, failed: bool):
+        self._hist._observe(self._key, time.perf_counter() - start)
+        with self._in_flight._lock:
+            self._in_flight._values[self._key] -= 1
+        if failed:
+            with self._errors._lock:
+                values = self._errors._values
+                values[self._key] = values.get(self._key, 0) + 1
+
+    def __enter__(self):
+        self._start = self._begin()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._end(self._start, exc_type is not None)
+        return False
+
+    def __call__(self, fn):
+        # Metrics are resolved once here; each call only pays for the clock and the locks
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = self._begin()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                self._end(start, True)
+                raise
+            self._end(start, False)
+            return result
+        return wrapper
@@ -0,0 +1,148 @@
+import contextvars
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from utils.logger import get_logger
+
+logger = get_logger("PROFILING")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(BASE_DIR / "outputs" / "profiles")))
+# "1": profile every request / tool call; otherwise only requests sent with "X-Profile: 1"
+PROFILE_ALL = os.getenv("PROFILE_REQUESTS", "0") == "1"
+# MCP tools are only wrapped when this is set at startup (no header on the MCP transport)
+PROFILE_MCP = os.getenv("PROFILE_MCP", "0") == "1" or PROFILE_ALL
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+# 5 ms between samples: enough resolution for OCR / LLM / SSE setup, negligible cost while on
+PROFILE_INTERVAL_SEC = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+
+_TRACE_ID_RE = re.compile(r"[A-Za-z0-9_.:-]{1,128}")
+
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+
+def current_profile_id():
+    """Trace id of the profile recording the current request, or None."""
+    return _current_profile.get()
+
+def wants_profile(headers) -> bool:
+    return PROFILE_ALL or headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+
+class SamplingProfiler:
+    """
+    Statistical profiler built on sys._current_frames(): a daemon thread snapshots
+    every thread's stack each interval and counts them in folded form
+    ("thread;file:func;file:func N"), which flamegraph.pl and speedscope read directly.
+    All threads are sampled (graph branches, the report queue and pool workers do the
+    real work), so concurrent requests show up under their own thread roots.
+    """
+    def __init__(self, trace_id: str, label: str = "", interval: float = PROFILE_INTERVAL_SEC):
+        self.trace_id = trace_id
+        self.label = label
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{trace_id}", daemon=True)
+        self._started = None
+        self._extra = {}
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self, **extra):
+        """Stops sampling; the sampler thread writes the profile, off the caller's thread."""
+        self._extra = extra
+        self._stop.set()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                name = names.get(thread_id)
+                if name is None:
+                    name = names[thread_id] = _thread_name(thread_id)
+                stack.append(name)
+                self.stacks[";".join(reversed(stack))] += 1
+        self._write((time.perf_counter() - self._started) * 1000)
+
+    def _write(self, duration_ms: float):
+        try:
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            folded = PROFILE_DIR / f"{self.trace_id}.folded"
+            folded.write_text("".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()))
+            meta = {
+                "trace_id": self.trace_id,
+                "label": self.label,
+                "duration_ms": round(duration_ms, 1),
+                "samples": self.samples,
+                "interval_ms": self.interval * 1000,
+                "folded": folded.name,
+                **self._extra,
+            }
+            (PROFILE_DIR / f"{self.trace_id}.json").write_text(json.dumps(meta, indent=2, default=str))
+            logger.info("Profile %s (%s, %.0f ms, %d samples) -> %s",
+                        self.trace_id, self.label, duration_ms, self.samples, folded)
+        except Exception as e:
+            logger.error("Could not write profile %s: %s", self.trace_id, e)
+
+def _thread_name(thread_id: int) -> str:
+    for thread in threading.enumerate():
+        if thread.ident == thread_id:
+            return f"thread:{thread.name}"
+    return f"thread:{thread_id}"
+
+def new_trace_id(prefix: str = "req") -> str:
+    return f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+def start_profile(label: str, trace_id: str = None):
+    """Starts a profile and makes its id visible to the code running in this context."""
+    if not trace_id or not _TRACE_ID_RE.fullmatch(trace_id):  # Client-supplied ids become file names
+        trace_id = new_trace_id()
+    profiler = SamplingProfiler(trace_id, label).start()
+    token = _current_profile.set(profiler.trace_id)
+    return profiler, token
+
+def reset_profile_context(token):
+    _current_profile.reset(token)
+
+def finish_profile(profiler: SamplingProfiler, token, **extra):
+    reset_profile_context(token)
+    profiler.stop(**extra)
+
+def profiled(name: str):
+    """
+    Decorator for MCP tools. With PROFILE_MCP / PROFILE_REQUESTS off at startup the
+    function is returned unchanged, so there is no per-call cost at all.
+    """
+    def decorate(fn):
+        if not PROFILE_MCP:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler, token = start_profile(name, new_trace_id(name))
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                finish_profile(profiler, token)
+        return wrapper
+    return decorate
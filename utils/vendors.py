@@ -0,0 +1,21 @@
+import re
+import unicodedata
+
+# Legal forms trailing a company name: "Global Logistics Ltd" is "Global Logistics Limited"
+LEGAL_FORMS = {
+    "ltd", "limited", "gmbh", "mbh", "inc", "incorporated", "llc", "corp", "corporation", "company",
+    "co", "s", "a", "sa", "sl", "srl", "spa", "bv", "nv", "ag", "kg", "plc", "oy", "ab", "pty",
+}
+_TOKEN_RE = re.compile(r"\w+")
+
+def vendor_tokens(text: str) -> list:
+    """Lower-cased words without accents or punctuation ("Ibérico S.A." -> ["iberico", "s", "a"])."""
+    folded = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode()
+    return _TOKEN_RE.findall(folded.lower())
+
+def normalize_vendor_name(name: str) -> str:
+    """Comparable form of a vendor name: "HafenLogistik GmbH." and "Hafenlogistik" -> "hafenlogistik"."""
+    tokens = vendor_tokens(name)
+    while len(tokens) > 1 and tokens[-1] in LEGAL_FORMS:
+        tokens.pop()
+    return " ".join(tokens)